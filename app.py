@@ -7,135 +7,32 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-from barfi import st_barfi, Block
-from prompt_templates import prompt_templates_app
-import re  # For parsing variables from the prompt template
-from langchain_community.tools.pubmed.tool import PubmedQueryRun
-from langchain_community.tools import WikipediaQueryRun
-from langchain_community.utilities import WikipediaAPIWrapper
+from barfi import st_barfi
+from prompt_templates import current_job_owner, prompt_templates_app, show_background_jobs, show_usage, submit_job
+import altair as alt
 import boto3
 import json
-from langchain_community.tools.tavily_search import TavilySearchResults
+import time
+import uuid
+from search_tools import search_stats
 
 from auth import login_user, logout, register_user  # Update import
-from llm import call_llm
+from flow_engine import FlowMemo, run_flow
+from flow_sinks import PresetSink, get_sink, session_result_store
+from result_store import get_page, page_count
+from run_store import ATTRIBUTION_VALUES, get_run_store, replay_plan
+from blocks import cached_blocks
+from template_store import get_store
+from tracing import get_spans, to_chrome_trace, to_otel_json
+from vector_index import get_index, upload_prefix
 
 ###############################################################################
 # 1. Define Compute Functions
+#
+# The flow blocks' compute functions live in blocks.py so flows can also run
+# headless (see flow_runner.py).
 ###############################################################################
 
-def invoke_anthropic(self):
-    """
-    Compute function for the Anthropic (Model) Block.
-    """
-    in_val = self.get_interface(name='input_0')
-    if in_val:
-        st.sidebar.write("Anthropic block received input:", in_val)
-        
-        # Handle input that might be a dictionary or string
-        prompt = in_val['output'] if isinstance(in_val, dict) and 'output' in in_val else str(in_val)
-        
-        # Call the LLM using the input value
-        raw_output = call_llm(prompt=prompt, model="anthropic.claude-3-sonnet-20240229-v1:0")
-        
-        # Format the output as JSON
-        out_val = {
-            "input": prompt,
-            "model": "anthropic.claude-3-sonnet-20240229-v1:0",
-            "output": raw_output
-        }
-        
-        self.set_interface(name='output_0', value=out_val)
-        st.sidebar.write("### Anthropic Block Output:")
-        st.sidebar.json(out_val)
-    else:
-        st.sidebar.write("Anthropic block received no input.")
-
-
-def invoke_titan(self):
-    """
-    Compute function for the Titan (Model) Block.
-    """
-    in_val = self.get_interface(name='input_0')
-    if in_val:
-        st.sidebar.write("Titan block received input:", in_val)
-        
-        # Handle input that might be a dictionary or string
-        prompt = in_val['output'] if isinstance(in_val, dict) and 'output' in in_val else str(in_val)
-        
-        # Call the LLM using the input value
-        raw_output = call_llm(prompt=prompt, model="amazon.titan-text-premier-v1:0")
-        
-        # Format the output as JSON
-        out_val = {
-            "input": prompt,
-            "model": "amazon.titan-text-premier-v1:0",
-            "output": raw_output
-        }
-        
-        self.set_interface(name='output_0', value=out_val)
-        st.sidebar.write("### Titan Block Output:")
-        st.sidebar.json(out_val)
-    else:
-        st.sidebar.write("Titan block received no input.")
-
-
-def invoke_meta_llama(self):
-    """
-    Compute function for the Meta LLama (Model) Block.
-    """
-    in_val = self.get_interface(name='input_0')
-    if in_val:
-        st.sidebar.write("Meta LLama block received input:", in_val)
-        
-        # Handle input that might be a dictionary or string
-        prompt = in_val['output'] if isinstance(in_val, dict) and 'output' in in_val else str(in_val)
-        
-        # Call the LLM using the input value
-        raw_output = call_llm(prompt=prompt, model="meta.llama3-8b-instruct-v1:0")
-        
-        # Format the output as JSON
-        out_val = {
-            "input": prompt,
-            "model": "meta.llama3-8b-instruct-v1:0",
-            "output": raw_output
-        }
-        
-        self.set_interface(name='output_0', value=out_val)
-        st.sidebar.write("### Meta LLama Block Output:")
-        st.sidebar.json(out_val)
-    else:
-        st.sidebar.write("Meta LLama block received no input.")
-
-
-def invoke_mistral(self):
-    """
-    Compute function for the Mistral (Model) Block.
-    """
-    in_val = self.get_interface(name='input_0')
-    if in_val:
-        st.sidebar.write("Mistral block received input:", in_val)
-        
-        # Handle input that might be a dictionary or string
-        prompt = in_val['output'] if isinstance(in_val, dict) and 'output' in in_val else str(in_val)
-        
-        # Call the LLM using the input value
-        raw_output = call_llm(prompt=prompt, model="mistral.mistral-large-2402-v1:0")
-        
-        # Format the output as JSON
-        out_val = {
-            "input": prompt,
-            "model": "mistral.mistral-large-2402-v1:0",
-            "output": raw_output
-        }
-        
-        self.set_interface(name='output_0', value=out_val)
-        st.sidebar.write("### Mistral Block Output:")
-        st.sidebar.json(out_val)
-    else:
-        st.sidebar.write("Mistral block received no input.")
-
-
 def feed_compute(self):
     """
     Compute function for the Prompt (Feed) Block.
@@ -147,153 +44,204 @@ def feed_compute(self):
             st.sidebar.write("Prompt block submitted:", text)
             self.set_interface(name='output_0', value=text)
 
-def final_output_compute(self):
-    """
-    Compute function for the Final Output Block.
-    """
-    val = self.get_interface(name='input_0')
-    if val:
-        st.sidebar.write("Final output block received input:", val)
-        st.sidebar.json(val)  # Added JSON display
-    else:
-        st.sidebar.write("Final output block received no input.")
+###############################################################################
+# 2. Utility Functions
+###############################################################################
 
-def web_search_compute(self):
-    """
-    Compute function for the Web Search (Tool) Block.
-    """
-    in_val = self.get_interface(name='input_0')
-    if in_val:
-        st.sidebar.write("Web Search block received input:", in_val)
-        
-        # Initialize the TavilySearchResults with the API key from secrets
-        api_key = st.secrets["TAVILY_API_KEY"]
-        search = TavilySearchResults(
-            max_results=2, 
-            tavily_api_key=api_key
+def show_flow_report(report):
+    """
+    Displays per-block wall time and the critical path of a flow run.
+    """
+    st.sidebar.write("### Flow Timing")
+    st.sidebar.dataframe(
+        [
+            {
+                "Block": t["block"],
+                "Status": "Replayed" if t.get("replayed") else "Reused" if t.get("reused") else t["status"],
+                "Start (s)": round(t["start"], 2) if t["start"] is not None else None,
+                "Duration (s)": round(t["duration"], 2),
+            }
+            for t in report["timings"]
+        ],
+        hide_index=True,
+        use_container_width=True
+    )
+    wall_time = report["wall_time"]
+    serial_time = report["serial_time"]
+    speedup = serial_time / wall_time if wall_time else 1.0
+    st.sidebar.write(
+        f"**Wall time:** {wall_time:.2f}s · **Serial time:** {serial_time:.2f}s · "
+        f"**Speedup:** {speedup:.1f}x"
+    )
+    st.sidebar.write(
+        f"**Critical path** ({report['critical_path_time']:.2f}s): "
+        + " → ".join(report["critical_path"])
+    )
+    if report["reused"]:
+        st.sidebar.write(
+            f"**Reused:** {report['reused']} of {len(report['timings'])} blocks unchanged since the last run"
+        )
+    if report["replayed"]:
+        st.sidebar.write(
+            f"**Replayed:** {report['replayed']} of {len(report['timings'])} blocks served from the recorded run"
         )
-        out_val = search.invoke({"query": str(in_val)})
-        
-        self.set_interface(name='output_0', value=out_val)
-        st.sidebar.write("Web Search block set output:", out_val)
-        st.sidebar.json(out_val)  # Display the output in JSON format for better visibility
-    else:
-        st.sidebar.write("Web Search block received no input.")
-
-def pubmed_search_compute(self):
-    """
-    Compute function for the PubMed Search (Tool) Block.
-    """
-    in_val = self.get_interface(name='input_0')
-    if in_val:
-        st.sidebar.write("PubMed Search block received input:", in_val)
-        
-        # Use Langchain's PubMedSearchTool
-        search_tool = PubmedQueryRun()
-        raw_output = search_tool.invoke(in_val)
-        
-        # Convert the output to a structured JSON format
-        out_val = {
-            "query": in_val,
-            "results": raw_output.split("\n\n")  # Split into separate results
-        }
-        
-        self.set_interface(name='output_0', value=out_val)
-        st.sidebar.write("PubMed Search block set output:")
-        st.sidebar.json(out_val)  # Now displays properly formatted JSON
-    else:
-        st.sidebar.write("PubMed Search block received no input.")
 
-def wikipedia_search_compute(self):
-    """
-    Compute function for the Wikipedia Search (Tool) Block.
-    """
-    in_val = self.get_interface(name='input_0')
-    if in_val:
-        st.sidebar.write("Wikipedia Search block received input:", in_val)
-        
-        # Initialize the WikipediaAPIWrapper and WikipediaQueryRun
-        api_wrapper = WikipediaAPIWrapper()
-        search_tool = WikipediaQueryRun(api_wrapper=api_wrapper)
-        raw_output = search_tool.invoke(in_val)
-        
-        # Convert the output to a structured JSON format
-        out_val = {
-            "query": in_val,
-            "results": raw_output.split("\n\n")  # Split into separate results
+def show_trace_timeline(spans):
+    """
+    Draws a flow run's spans (blocks, model calls, searches) as a timeline,
+    with downloads for chrome://tracing / Perfetto and OpenTelemetry tools.
+    """
+    if not spans:
+        return
+    origin = min(s["start_ns"] for s in spans)
+    rows = [
+        {
+            "Span": f"{s['name']} ({s['category']})",
+            "Category": s["category"],
+            "Start (ms)": (s["start_ns"] - origin) / 1e6,
+            "End (ms)": (s["end_ns"] - origin) / 1e6,
+            "Duration (ms)": round((s["end_ns"] - s["start_ns"]) / 1e6, 1),
+            "Thread": s["thread_name"],
+            "Error": s["error"] or "",
         }
-        
-        self.set_interface(name='output_0', value=out_val)
-        st.sidebar.write("Wikipedia Search block set output:")
-        st.sidebar.json(out_val)  # Now displays properly formatted JSON
-    else:
-        st.sidebar.write("Wikipedia Search block received no input.")
-
-def init_block_compute(self):
-    """
-    Compute function for the Init Block.
-    This block serves as the starting point of the flow.
-    """
-    st.sidebar.write("Init Block is the start of the flow.")
-    
-    # Read from session state
-    user_input = st.session_state.get("init_input", "")
-    
-    if user_input:
-        self.set_interface(name='output_0', value=user_input)
-        st.sidebar.write("Init Block has set the initial value:", user_input)
-    else:
-        st.sidebar.write("No input provided in Init Block.")
-
-
-def pack_block_compute(self):
-    """
-    Compute function for the Pack Block.
-    """
-    in_val = self.get_interface(name='input_0')
-    if in_val:
-        st.sidebar.write("Pack Block received input:", in_val)
-        # Dummy processing logic
-        out_val = f"Packed: {in_val}"
-        self.set_interface(name='output_0', value=out_val)
-        st.sidebar.write("Pack Block set output:", out_val)
-    else:
-        st.sidebar.write("Pack Block received no input.")
-
-def combine_block_compute(self):
-    """
-    Compute function for the Combine Block.
-    """
-    # Collect inputs
-    inputs = [
-        self.get_interface(name='input_1'),
-        self.get_interface(name='input_2'),
-        self.get_interface(name='input_3')
+        for s in sorted(spans, key=lambda s: s["start_ns"])
     ]
-    
-    # Debug: Print input values
-    st.sidebar.write("Combine Block inputs:", inputs)
-    
-    # Filter out None values and join the inputs
-    combined_val = " + ".join(filter(None, inputs))
-    
-    if combined_val:
-        st.sidebar.write("Combine Block received inputs:", inputs)
-        self.set_interface(name='output_0', value=combined_val)
-        st.sidebar.write("Combine Block set output:", combined_val)
-        st.sidebar.json(combined_val)  # Added JSON display
-    else:
-        st.sidebar.write("Combine Block received no valid inputs.")
+    with st.sidebar.expander("Trace Timeline", expanded=False):
+        chart = alt.Chart(alt.Data(values=rows)).mark_bar().encode(
+            x=alt.X("Start (ms):Q", title="ms since flow start"),
+            x2="End (ms):Q",
+            y=alt.Y("Span:N", sort=None, title=None),
+            color="Category:N",
+            tooltip=["Span:N", "Duration (ms):Q", "Thread:N", "Error:N"],
+        )
+        st.altair_chart(chart, use_container_width=True)
+        st.download_button(
+            "Download Chrome trace",
+            json.dumps(to_chrome_trace(spans)),
+            file_name="flow_trace.json",
+            mime="application/json"
+        )
+        st.download_button(
+            "Download OpenTelemetry JSON",
+            json.dumps(to_otel_json(spans)),
+            file_name="flow_trace_otlp.json",
+            mime="application/json"
+        )
 
-###############################################################################
-# 2. Utility Functions
-###############################################################################
+def show_output_inspector():
+    """
+    Pages through the block results kept for this session (see
+    result_store), rendering one page of one result at a time.
+    """
+    entries = {entry["id"]: entry for entry in session_result_store().entries()}
+    if not entries:
+        return
+    with st.sidebar.expander("Output Inspector", expanded=False):
+        entry_id = st.selectbox(
+            "Result",
+            list(reversed(entries)),
+            format_func=lambda i: (
+                f"#{i} {entries[i]['block'] or ''} · {entries[i]['label'].lstrip('# ')} "
+                f"({entries[i]['size']:,} chars)"
+            ),
+            key="inspector_result"
+        )
+        value = entries[entry_id]["value"]
+        pages = page_count(value)
+        page = 1
+        if pages > 1:
+            page = st.number_input("Page", min_value=1, max_value=pages, value=1,
+                                   key=f"inspector_page_{entry_id}")
+            st.caption(f"Page {page} of {pages}")
+        chunk = get_page(value, page - 1)
+        if isinstance(chunk, str):
+            st.text(chunk)
+        else:
+            st.json(chunk)
 
-def parse_template_variables(prompt_template: str):
+def show_retrieval_documents():
     """
-    Parses the prompt template and extracts all variables enclosed in curly braces.
+    Uploads documents into the retrieval index (see vector_index), for
+    Retrieval blocks that search "Inputs and uploads".
     """
-    return re.findall(r'\{(.*?)\}', prompt_template)
+    with st.sidebar.expander("Retrieval Documents", expanded=False):
+        files = st.file_uploader(
+            "Upload documents",
+            type=["txt", "md", "csv", "json"],
+            accept_multiple_files=True,
+            key="retrieval_files"
+        )
+        index = get_index()
+        # Uploads are only searched by their owner's Retrieval blocks.
+        prefix = upload_prefix(st.session_state.get("username") or st.session_state["usage_session"])
+        uploaded = st.session_state.setdefault("retrieval_uploads", [])
+        for file in files or []:
+            if file.name in uploaded:
+                continue
+            with st.spinner(f"Indexing {file.name}..."):
+                index.add(file.getvalue().decode("utf-8", errors="replace"),
+                          source=prefix + file.name)
+            # A new list, so Retrieval blocks that read it are recomputed.
+            uploaded = st.session_state["retrieval_uploads"] = sorted(uploaded + [file.name])
+        for source, chunks in index.sources(prefix=prefix):
+            st.caption(f"{source[len(prefix):]} · {chunks} chunks")
+        stats = index.stats()
+        st.caption(f"Index: {stats['chunks']:,} chunks from {stats['sources']:,} sources")
+
+def _flow_inputs():
+    # The session values flow blocks read, as recorded with each run.
+    return {name: st.session_state.get(name) for name in ("init_input", "flow_cache", "retrieval_uploads")}
+
+
+def show_run_history(base_blocks, limit=20):
+    """
+    Lists this owner's recorded flow runs (see run_store) and replays one:
+    its blocks are served from the record, except those picked to execute
+    again and everything downstream of them.
+    """
+    store = get_run_store()
+    runs = {run["id"]: run for run in store.runs(current_job_owner(), limit=limit)}
+    with st.sidebar.expander("Run History", expanded=False):
+        if not runs:
+            st.caption("No recorded runs yet.")
+            return
+        run_id = st.selectbox(
+            "Run",
+            list(runs),
+            format_func=lambda i: (
+                f"{time.strftime('%m-%d %H:%M:%S', time.localtime(runs[i]['created']))} · "
+                f"{runs[i]['label'] or '(no input)'} · {runs[i]['status']}"
+                + (f" · {runs[i]['wall_time']:.1f}s" if runs[i]["wall_time"] is not None else "")
+            ),
+            key="replay_run"
+        )
+        run = store.get(run_id)
+        blocks = [block["name"] for block in run["blocks"].values()]
+        changed = st.multiselect(
+            "Execute again",
+            blocks,
+            key=f"replay_changed_{run_id}",
+            help="These blocks, and every block downstream of them, run again; the rest come from the record"
+        )
+        current = st.checkbox(
+            "Use the current inputs",
+            key="replay_current_inputs",
+            help="Blocks that read the sidebar (such as the Init Block) run again if it has changed"
+        )
+        replay = st.button("Replay run", key="replay_button")
+    if not replay:
+        return
+    sink = get_sink() if current else PresetSink(get_sink(), run["inputs"], live=ATTRIBUTION_VALUES)
+    try:
+        report = run_flow(base_blocks, run["schema"], sink=sink, replay=replay_plan(run, changed))
+    except ValueError as e:
+        st.error(f"Error replaying flow: {e}")
+        return
+    store.record(report, run["schema"], _flow_inputs() if current else run["inputs"],
+                 owner=current_job_owner(), replay_of=run_id)
+    show_flow_report(report)
+    show_trace_timeline(get_spans(report["trace_id"]))
+
 
 ###############################################################################
 # 3. Define the Main Page with Barfi Blocks
@@ -328,9 +276,8 @@ def main_page():
         st.rerun()
 
     # Show a dropdown of all saved templates, if any
-    template_names = []
-    if "templates" in st.session_state and st.session_state["templates"]:
-        template_names = list(st.session_state["templates"].keys())
+    template_version, templates = get_store().snapshot()
+    template_names = list(templates.keys())
 
     selected_template = st.sidebar.selectbox(
         "Select a saved template:",
@@ -338,152 +285,101 @@ def main_page():
     )
     if selected_template and selected_template != "No saved templates":
         st.sidebar.write("You selected:", selected_template)
-        st.sidebar.json(st.session_state["templates"][selected_template])
+        st.sidebar.json(templates[selected_template])
 
     # Optional: Prompt for initialization
     st.sidebar.write("Initialize Flow")
     st.sidebar.text_input("Enter your prompt here", key="init_input")
+    st.sidebar.checkbox(
+        "Cache model responses",
+        key="flow_cache",
+        help="Reuse stored responses when a model block sees the same prompt again"
+    )
+    st.sidebar.checkbox(
+        "Only recompute changed blocks",
+        value=True,
+        key="flow_incremental",
+        help="Reuse the previous output of blocks whose inputs and settings are unchanged"
+    )
+    st.sidebar.checkbox(
+        "Run flows in background",
+        key="flow_background",
+        help="Queue the run on a background worker; results stay available after a reload"
+    )
+    if "flow_memo" not in st.session_state:
+        st.session_state["flow_memo"] = FlowMemo()
+    show_retrieval_documents()
 
     # -----------------------------------------------------------------
-    # Create the standard blocks: Final Output, Anthropic, Web Search, etc.
-    # -----------------------------------------------------------------
-    final_output = Block(name="Final Output")
-    final_output.add_input(name='input_0')
-    final_output.add_compute(final_output_compute)
-
-    anthropic_block = Block(name='Anthropic (Model)')
-    anthropic_block.add_input(name='input_0')
-    anthropic_block.add_output(name='output_0')
-    anthropic_block.add_compute(invoke_anthropic)
-
-    titan_block = Block(name='Titan (Model)')
-    titan_block.add_input(name='input_0')
-    titan_block.add_output(name='output_0')
-    titan_block.add_compute(invoke_titan)
-
-    llama_block = Block(name='Meta (Model)')
-    llama_block.add_input(name='input_0')
-    llama_block.add_output(name='output_0')
-    llama_block.add_compute(invoke_meta_llama)
-
-    mistral_block = Block(name='Mistral (Model)')
-    mistral_block.add_input(name='input_0')
-    mistral_block.add_output(name='output_0')
-    mistral_block.add_compute(invoke_mistral)
-
-    web_search_block = Block(name='Web Search (Tool)')
-    web_search_block.add_input(name='input_0')
-    web_search_block.add_output(name='output_0')
-    web_search_block.add_compute(web_search_compute)
-
-    init_block = Block(name="Init Block")
-    init_block.add_output(name="output_0")
-    init_block.add_compute(init_block_compute)
-
-    pubmed_block = Block(name='PubMed Search (Tool)')
-    pubmed_block.add_input(name='input_0')
-    pubmed_block.add_output(name='output_0')
-    pubmed_block.add_compute(pubmed_search_compute)
-
-    wikipedia_block = Block(name='Wikipedia Search (Tool)')
-    wikipedia_block.add_input(name='input_0')
-    wikipedia_block.add_output(name='output_0')
-    wikipedia_block.add_compute(wikipedia_search_compute)
-
-    combine_block = Block(name='Combine Block')
-    combine_block.add_input(name='input_1')
-    combine_block.add_input(name='input_2')
-    combine_block.add_input(name='input_3')
-    combine_block.add_output(name='output_0')
-    combine_block.add_compute(combine_block_compute)
-
-    # -----------------------------------------------------------------
-    # Create base blocks list - all blocks except Pack Block which is conditional
+    # The standard blocks plus one Prompt block per saved template; the
+    # Pack Block is only offered to logged-in users. Built once per session
+    # and template-set version rather than on every rerun.
     # -----------------------------------------------------------------
-    base_blocks = [
-        init_block,
-        anthropic_block,
-        web_search_block,
-        pubmed_block,
-        wikipedia_block,
-        final_output,
-        combine_block,
-        titan_block,
-        llama_block,
-        mistral_block
-    ]
-    
-    # Conditionally add Pack Block if user is logged in
-    if login_status:
-        # Create Pack Block only when logged in
-        pack_block = Block(name='Pack Block')
-        pack_block.add_input(name='input_0')
-        pack_block.add_output(name='output_0')
-        pack_block.add_compute(pack_block_compute)
-        
-        # Add to base blocks
-        base_blocks.append(pack_block)
-    
-    # ------------------------------------------------
-    # Create a Prompt block PER template in session_state
-    # ------------------------------------------------
-    if "templates" in st.session_state and st.session_state["templates"]:
-        for tmpl_name, tmpl_data in st.session_state["templates"].items():
-            prompt_template = tmpl_data["prompt_template"]
-            variables = parse_template_variables(prompt_template)
-
-            block_title = f"Prompt: {tmpl_name}"
-            new_block = Block(name=block_title)
-
-            for var in variables:
-                new_block.add_input(name=var)
-
-            new_block.add_output(name='output_0')
-            new_block.add_compute(prompt_compute_factory(prompt_template, variables))
-
-            base_blocks.append(new_block)
+    base_blocks = cached_blocks(
+        st.session_state,
+        templates,
+        template_version,
+        include_pack=login_status
+    )
 
     # -----------------------------------------------------------------
-    # Render everything in Barfi, with our stable key
+    # Render everything in Barfi, with our stable key. Barfi's built-in
+    # engine runs blocks one after another, so we execute the flow ourselves
+    # and let independent branches run concurrently.
     # -----------------------------------------------------------------
-    st_barfi(
+    flow = st_barfi(
         base_blocks=base_blocks,
+        compute_engine=False,
         key=st.session_state["barfi_key"]
     )
 
-###############################################################################
-# 4. Compute Function Factory for Prompt Block
-###############################################################################
-
-def prompt_compute_factory(prompt_template: str, variables: list):
-    """
-    Creates a compute function for the Prompt Block based on the template and variables.
-    """
-    def prompt_compute(self):
-        # Collect inputs for each variable
-        input_values = {}
-        for var in variables:
-            input_val = self.get_interface(name=var)
-            if input_val:
-                input_values[var] = input_val
-            else:
-                st.error(f"Missing input for variable: {var}")
-                return  # Exit if any input is missing
-
-        # Inject variables into the prompt template
+    if flow.get("command") == "execute" and st.session_state["flow_background"]:
+        submit_job("flow", {
+            "schema": flow["editor_state"],
+            "owner": current_job_owner(),
+            "row": {
+                "input": st.session_state["init_input"],
+                "flow_cache": st.session_state["flow_cache"],
+                "usage_session": st.session_state.get("usage_session"),
+                "username": st.session_state.get("username"),
+            },
+        }, label=f"Flow: {st.session_state['init_input'][:40] or '(no input)'}")
+        st.sidebar.success("Flow queued")
+    elif flow.get("command") == "execute":
         try:
-            final_prompt = prompt_template.format(**input_values)
-            st.sidebar.write("### Final Prompt:")
-            st.sidebar.code(final_prompt, language="markdown")
-
-            # Set the output interface with the formatted prompt
-            self.set_interface(name='output_0', value=final_prompt)
-
-        except Exception as e:
-            st.error(f"Error generating prompt: {e}")
-
-    return prompt_compute
-
+            memo = st.session_state["flow_memo"] if st.session_state["flow_incremental"] else None
+            report = run_flow(base_blocks, flow["editor_state"], memo=memo)
+            get_run_store().record(report, flow["editor_state"], _flow_inputs(), owner=current_job_owner())
+            show_flow_report(report)
+            show_trace_timeline(get_spans(report["trace_id"]))
+        except ValueError as e:
+            st.error(f"Error executing flow: {e}")
+
+    show_run_history(base_blocks)
+    show_output_inspector()
+
+    with st.sidebar.expander("Background Jobs", expanded=st.session_state["flow_background"]):
+        show_background_jobs()
+
+    with st.sidebar.expander("Token Usage", expanded=False):
+        show_usage()
+
+    tool_stats = search_stats()
+    if tool_stats:
+        with st.sidebar.expander("Search Cache", expanded=False):
+            st.dataframe(
+                [
+                    {
+                        "Tool": tool,
+                        "Calls": stats["calls"],
+                        "Hit rate": f"{stats['hit_rate']:.0%}",
+                        "Shared": stats["shared"],
+                        "Mean latency (s)": round(stats["mean_latency"], 2),
+                    }
+                    for tool, stats in tool_stats.items()
+                ],
+                hide_index=True
+            )
 
 ###############################################################################
 # 6. Page Navigation
@@ -496,6 +392,10 @@ def main():
     # Set default page if not already set
     if "page" not in st.session_state:
         st.session_state["page"] = "home"
+
+    # Identifies this browser session in the token usage totals
+    if "usage_session" not in st.session_state:
+        st.session_state["usage_session"] = uuid.uuid4().hex
     
     # Display login status and controls in the sidebar
     with st.sidebar:
@@ -1,20 +1,140 @@
 import streamlit as st
 import requests
+import base64
 import json
 import logging
+import os
+import threading
+import time
+
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # API Base URL - replace with your actual API URL
-API_BASE_URL = "http://127.0.0.1:5000"  # Update this with your actual API endpoint
+API_BASE_URL = os.environ.get("AUTH_API_URL", "http://127.0.0.1:5000")
+
+# (connect, read) timeouts in seconds for every API request
+API_TIMEOUT = (
+    float(os.environ.get("AUTH_CONNECT_TIMEOUT", "3.05")),
+    float(os.environ.get("AUTH_READ_TIMEOUT", "10")),
+)
+
+# How long a fetched user profile is reused, in seconds
+PROFILE_TTL = float(os.environ.get("AUTH_PROFILE_TTL", "60"))
+
+# Access tokens are refreshed this many seconds before they expire
+REFRESH_MARGIN = 30
+
+
+def token_expiry(token):
+    """
+    Returns a JWT's expiry time (the "exp" claim, seconds since the epoch),
+    or None if the token has none or is not a JWT. The signature is not
+    checked; the API does that.
+    """
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class ApiClient(object):
+    """
+    Shared client for the auth API.
+
+    Requests go through one pooled requests.Session, so logins and profile
+    lookups from every session reuse keep-alive connections. Every request
+    has a timeout; connection failures, and 502/503/504 responses to GETs,
+    are retried with exponential backoff. Profiles are cached per access
+    token for PROFILE_TTL seconds.
+    """
+
+    def __init__(self, base_url=API_BASE_URL, timeout=API_TIMEOUT, pool_size=32, retries=3, backoff=0.2):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        # POSTs are only retried when the connection failed, i.e. before the
+        # API saw them, so a slow registration is never submitted twice.
+        retry = Retry(total=retries, connect=retries, read=retries, backoff_factor=backoff,
+                      status_forcelist=[502, 503, 504], allowed_methods=frozenset(["GET"]),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._profiles = TTLCache(maxsize=1024, ttl=PROFILE_TTL)
+        self._profiles_lock = threading.Lock()
+
+    def request(self, method, path, token=None, **kwargs):
+        """Sends a request to the API, with a bearer token if given."""
+        headers = kwargs.pop("headers", {})
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, f"{self.base_url}{path}", headers=headers, **kwargs)
+
+    def login(self, credentials):
+        return self.request("POST", "/login", json=credentials)
+
+    def register(self, details):
+        return self.request("POST", "/register", json=details)
+
+    def refresh(self, refresh_token):
+        """Exchanges a refresh token for a new access token."""
+        return self.request("POST", "/refresh", token=refresh_token)
+
+    def profile(self, token):
+        """
+        Returns the profile for an access token, or None if the API refused.
+
+        Raises:
+            requests.RequestException: If the API could not be reached
+        """
+        with self._profiles_lock:
+            cached = self._profiles.get(token)
+        if cached is not None:
+            return cached
+        response = self.request("GET", "/user", token=token)
+        if response.status_code != 200:
+            return None
+        profile = response.json()
+        with self._profiles_lock:
+            self._profiles[token] = profile
+        return profile
+
+    def forget(self, token):
+        """Drops the cached profile for a token, e.g. on logout."""
+        with self._profiles_lock:
+            self._profiles.pop(token, None)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_api_client():
+    """Returns the process-wide ApiClient."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ApiClient()
+        return _client
 
 # --- Initialize Session States ---
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
 if 'access_token' not in st.session_state:
     st.session_state.access_token = None
+if 'refresh_token' not in st.session_state:
+    st.session_state.refresh_token = None
+if 'token_expires_at' not in st.session_state:
+    st.session_state.token_expires_at = None
 if 'username' not in st.session_state:
     st.session_state.username = None
 if 'user_id' not in st.session_state:
@@ -43,12 +163,8 @@ def login_user(username, password):
         else:
             login_data = {"username": username, "password": password}
         
-        # Make API request
-        response = requests.post(
-            f"{API_BASE_URL}/login",
-            json=login_data,
-            headers={"Content-Type": "application/json"}
-        )
+        # Make API request over the shared connection pool
+        response = get_api_client().login(login_data)
         
         # Check if login was successful
         if response.status_code == 200:
@@ -56,6 +172,8 @@ def login_user(username, password):
             # Save user data in session state
             st.session_state.logged_in = True
             st.session_state.access_token = data.get('access_token')
+            st.session_state.refresh_token = data.get('refresh_token')
+            st.session_state.token_expires_at = token_expiry(data.get('access_token'))
             st.session_state.username = data.get('username')
             st.session_state.user_id = data.get('user_id')
             st.session_state.email = data.get('email')
@@ -90,12 +208,8 @@ def register_user(email, username, password):
             "password": password
         }
         
-        # Make API request
-        response = requests.post(
-            f"{API_BASE_URL}/register",
-            json=register_data,
-            headers={"Content-Type": "application/json"}
-        )
+        # Make API request over the shared connection pool
+        response = get_api_client().register(register_data)
         
         # Parse response
         data = response.json()
@@ -111,31 +225,66 @@ def register_user(email, username, password):
         logger.error(f"Error during registration: {str(e)}")
         return False, f"An error occurred: {str(e)}"
 
+def ensure_access_token():
+    """
+    Returns a usable access token, refreshing it first if it is about to
+    expire. Logs the user out when the token has expired and cannot be
+    refreshed.
+
+    Returns:
+        str: The access token, or None if not logged in
+    """
+    if not st.session_state.logged_in or not st.session_state.access_token:
+        return None
+    expires_at = st.session_state.token_expires_at
+    if expires_at is None or time.time() < expires_at - REFRESH_MARGIN:
+        return st.session_state.access_token
+
+    refresh_token = st.session_state.refresh_token
+    if refresh_token:
+        try:
+            response = get_api_client().refresh(refresh_token)
+            if response.status_code == 200:
+                data = response.json()
+                get_api_client().forget(st.session_state.access_token)
+                st.session_state.access_token = data.get('access_token')
+                st.session_state.refresh_token = data.get('refresh_token', refresh_token)
+                st.session_state.token_expires_at = token_expiry(data.get('access_token'))
+                logger.info(f"Refreshed access token for '{st.session_state.username}'")
+                return st.session_state.access_token
+            logger.warning(f"Token refresh failed with status {response.status_code}")
+        except Exception as e:
+            logger.error(f"Error refreshing token: {str(e)}")
+            # The old token may still work until it actually expires
+            if time.time() < expires_at:
+                return st.session_state.access_token
+            return None
+
+    if time.time() < expires_at:
+        return st.session_state.access_token
+    logger.info("Access token expired; logging out")
+    logout()
+    return None
+
 def get_user_profile():
     """
     Get current user profile data
     
+    Profiles are cached for PROFILE_TTL seconds, so calling this on every
+    rerun does not hit the API each time.
+    
     Returns:
         dict: User profile data or None if not logged in or error
     """
-    if not st.session_state.logged_in or not st.session_state.access_token:
+    token = ensure_access_token()
+    if not token:
         return None
         
     try:
-        # Make API request with JWT token
-        response = requests.get(
-            f"{API_BASE_URL}/user",
-            headers={
-                "Authorization": f"Bearer {st.session_state.access_token}",
-                "Content-Type": "application/json"
-            }
-        )
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
+        profile = get_api_client().profile(token)
+        if profile is None:
             logger.warning("Failed to get user profile")
-            return None
+        return profile
     except Exception as e:
         logger.error(f"Error getting user profile: {str(e)}")
         return None
@@ -144,9 +293,14 @@ def logout():
     """Logs out the user and clears session state."""
     logger.info("User logged out")
     
+    if st.session_state.access_token:
+        get_api_client().forget(st.session_state.access_token)
+    
     # Clear session state
     st.session_state.logged_in = False
     st.session_state.access_token = None
+    st.session_state.refresh_token = None
+    st.session_state.token_expires_at = None
     st.session_state.username = None
     st.session_state.user_id = None
     st.session_state.email = None
@@ -0,0 +1,89 @@
+"""
+Serial `call_llm` vs. concurrent `acall_llm` against a throttling stub Bedrock.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_async_llm --calls 200 --latency 0.2 --quota 40
+
+The stub accepts `--quota` requests per second and answers the rest with
+ThrottlingException, like an account at its Bedrock quota. The async run
+should approach the quota while the model's AdaptiveLimiter keeps the
+number of throttled requests low.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.bench_llm_clients import _configure_env
+from benchmarks.stub_bedrock import StubBedrockServer
+
+
+def _run_serial(calls):
+    from llm import call_llm
+
+    start = time.perf_counter()
+    for i in range(calls):
+        call_llm(f"serial prompt {i}")
+    return time.perf_counter() - start
+
+
+async def _gather(calls, concurrency):
+    from llm import acall_llm
+
+    # ChatBedrock.ainvoke runs in the default executor; size it to the limiter.
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    start = time.perf_counter()
+    await asyncio.gather(*(acall_llm(f"async prompt {i}") for i in range(calls)))
+    return time.perf_counter() - start
+
+
+def _report(label, calls, elapsed, server, throttled_before):
+    throttled = server.throttled_count - throttled_before
+    print(f"{label:<7} {calls} calls in {elapsed:6.2f}s  "
+          f"{calls / elapsed:7.1f} calls/s  {throttled} throttled")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--serial-calls", type=int, default=20,
+                        help="Calls for the serial baseline")
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="Artificial server latency in seconds")
+    parser.add_argument("--quota", type=float, default=40.0,
+                        help="Requests per second the stub accepts")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="Fraction of requests throttled at random")
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    server = StubBedrockServer(latency=args.latency, quota=args.quota,
+                               throttle_rate=args.throttle_rate).start()
+    _configure_env(server.url)
+    os.environ["LLM_MAX_CONCURRENCY"] = str(args.concurrency)
+    os.environ.setdefault("LLM_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "cache.sqlite3"))
+    try:
+        from rate_limit import get_limiter
+        from llm import DEFAULT_MODEL
+
+        throttled = server.throttled_count
+        elapsed = _run_serial(args.serial_calls)
+        _report("serial", args.serial_calls, elapsed, server, throttled)
+
+        throttled = server.throttled_count
+        elapsed = asyncio.run(_gather(args.calls, args.concurrency))
+        _report("async", args.calls, elapsed, server, throttled)
+
+        stats = get_limiter(DEFAULT_MODEL).stats()
+        rate = f"{stats['rate']:.1f}/s" if stats["rate"] else "unlimited"
+        print(f"limiter: learned rate {rate}, {stats['throttles']} throttles seen, "
+              f"concurrency cap {stats['max_concurrency']}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+One-off `requests` calls vs. the pooled auth ApiClient under concurrent logins.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_auth --users 200 --concurrency 32 --latency 0.01
+
+Each simulated user logs in and then loads their profile a few times, as
+the app does across reruns. The baseline opens a new connection for every
+request and fetches the profile every time; the ApiClient reuses pooled
+keep-alive connections and serves repeat profile lookups from its cache.
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.stub_auth import StubAuthServer
+
+
+def _one_off_session(base_url, username, profile_loads):
+    # What auth.py did before ApiClient: a fresh connection per request.
+    response = requests.post(f"{base_url}/login", json={"username": username, "password": "pw"},
+                             headers={"Content-Type": "application/json"})
+    token = response.json()["access_token"]
+    for _ in range(profile_loads):
+        requests.get(f"{base_url}/user", headers={"Authorization": f"Bearer {token}"})
+
+
+def _pooled_session(client, username, profile_loads):
+    token = client.login({"username": username, "password": "pw"}).json()["access_token"]
+    for _ in range(profile_loads):
+        client.profile(token)
+
+
+def _run(label, fn, users, concurrency, server):
+    connections = server.connection_count
+    requests_before = sum(server.request_count.values())
+
+    def timed(username):
+        start = time.perf_counter()
+        fn(username)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = sorted(pool.map(timed, users))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<8} {len(users)} users in {elapsed:6.2f}s  "
+          f"p50={statistics.median(samples) * 1000:7.1f} ms  "
+          f"p95={samples[int(len(samples) * 0.95) - 1] * 1000:7.1f} ms  "
+          f"{sum(server.request_count.values()) - requests_before} requests  "
+          f"{server.connection_count - connections} connections")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--profile-loads", type=int, default=5,
+                        help="Profile lookups per user after logging in")
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="Artificial server latency in seconds")
+    args = parser.parse_args()
+
+    server = StubAuthServer(latency=args.latency).start()
+    users = [f"user{i}" for i in range(args.users)]
+    for username in users:
+        requests.post(f"{server.url}/register",
+                      json={"username": username, "email": f"{username}@example.com", "password": "pw"})
+    try:
+        from auth import ApiClient
+
+        client = ApiClient(base_url=server.url, pool_size=args.concurrency)
+        _run("one-off", lambda u: _one_off_session(server.url, u, args.profile_loads),
+             users, args.concurrency, server)
+        _run("pooled", lambda u: _pooled_session(client, u, args.profile_loads),
+             users, args.concurrency, server)
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Tail latency of model calls with occasional stalls: single model vs. fallback vs. hedged routing.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_hedging --calls 200 --latency 0.1 --stall-rate 0.03 --stall-time 3
+
+The stub stalls a random fraction of the primary model's requests, like
+occasional Bedrock stalls; the backup model is never stalled. Fallback
+routing waits FIRST_TOKEN_TIMEOUT for a first token before switching, and
+hedged routing starts the backup once the primary has gone its measured
+p95 time to first token without one, so hedging should cut p99 to about
+that delay plus the backup's latency. Keep --stall-rate under 5%: a p95
+that includes the stalls themselves makes a useless hedge delay.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.bench_llm_clients import _configure_env
+from benchmarks.stub_bedrock import StubBedrockServer
+
+PRIMARY = "anthropic.claude-3-sonnet-20240229-v1:0"
+BACKUP = "anthropic.claude-3-haiku-20240307-v1:0"
+
+
+def _run(policy, calls, first_token_timeout):
+    from llm import stream_routed
+
+    samples = []
+    routed = 0
+    for i in range(calls):
+        stats = {}
+        start = time.perf_counter()
+        # Distinct prompts, so no call joins another's in-flight request.
+        for _ in stream_routed(f"{policy} prompt {i}", [PRIMARY, BACKUP], policy=policy, stats=stats,
+                               first_token_timeout=first_token_timeout):
+            pass
+        samples.append(time.perf_counter() - start)
+        routed += stats["model"] != PRIMARY
+    return samples, routed
+
+
+def _report(label, samples, routed):
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    print(f"{label:<9} p50 {cuts[49]:6.3f}s  p95 {cuts[94]:6.3f}s  p99 {cuts[98]:6.3f}s  "
+          f"max {max(samples):6.3f}s  answered by backup {routed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.1,
+                        help="Artificial server latency in seconds")
+    parser.add_argument("--stall-rate", type=float, default=0.03,
+                        help="Fraction of primary model requests that stall")
+    parser.add_argument("--stall-time", type=float, default=3.0,
+                        help="Seconds a stalled request takes")
+    parser.add_argument("--first-token-timeout", type=float, default=1.0,
+                        help="Seconds fallback routing waits for a first token")
+    args = parser.parse_args()
+
+    server = StubBedrockServer(latency=args.latency, stall_rate=args.stall_rate, stall_time=args.stall_time,
+                               stall_models=[PRIMARY]).start()
+    _configure_env(server.url)
+    os.environ.setdefault("LLM_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "cache.sqlite3"))
+    try:
+        from llm import ROUTE_FALLBACK, ROUTE_HEDGED, ROUTE_SINGLE, hedge_delay
+
+        # The single-model run also gives hedging the measured TTFTs it needs.
+        for label, policy in (("single", ROUTE_SINGLE), ("fallback", ROUTE_FALLBACK), ("hedged", ROUTE_HEDGED)):
+            samples, routed = _run(policy, args.calls, args.first_token_timeout)
+            _report(label, samples, routed)
+        print(f"hedge delay: {hedge_delay(PRIMARY):.3f}s (p95 time to first token)")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Cold vs. warm `call_llm` latency against a local stub Bedrock endpoint.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_llm_clients --calls 50
+"""
+import argparse
+import os
+import statistics
+import time
+
+from benchmarks.stub_bedrock import StubBedrockServer
+
+
+def _configure_env(url):
+    os.environ["BEDROCK_ENDPOINT_URL"] = url
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "stub")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "stub")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+
+def _time_calls(calls, before_each=None):
+    from llm import call_llm
+
+    samples = []
+    for i in range(calls):
+        if before_each:
+            before_each()
+        start = time.perf_counter()
+        call_llm(f"benchmark prompt {i}")
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1] if len(samples) > 1 else samples[0]
+    print(f"{label:<6} n={len(samples):<4} "
+          f"mean={statistics.mean(samples) * 1000:8.2f} ms  "
+          f"p50={statistics.median(samples) * 1000:8.2f} ms  "
+          f"p95={p95 * 1000:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Artificial server latency in seconds")
+    args = parser.parse_args()
+
+    server = StubBedrockServer(latency=args.latency).start()
+    _configure_env(server.url)
+    try:
+        from llm import clear_clients
+
+        cold = _time_calls(args.calls, before_each=clear_clients)
+        clear_clients()
+        _time_calls(1)  # prime the registry
+        warm = _time_calls(args.calls)
+    finally:
+        server.stop()
+
+    _report("cold", cold)
+    _report("warm", warm)
+    print(f"speedup (mean): {statistics.mean(cold) / statistics.mean(warm):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
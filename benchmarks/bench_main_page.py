@@ -0,0 +1,80 @@
+"""
+`main_page` rerun time against the number of saved templates.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_main_page --counts 0 100 500 1000 --reruns 5
+
+Each rerun drives app.py through Streamlit's AppTest, like a widget change
+in the sidebar would. "rebuild" drops the session's block catalog before
+every rerun, as the app behaved before the catalog was cached; "cached" is
+the normal path, where a session's catalog is only rebuilt when templates
+change.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+
+def _time_reruns(app, reruns, before_each=None):
+    samples = []
+    for _ in range(reruns):
+        if before_each:
+            before_each()
+        start = time.perf_counter()
+        app.run()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[0, 100, 500, 1000])
+    parser.add_argument("--reruns", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ["TEMPLATE_DB_PATH"] = os.path.join(workdir, "templates.sqlite3")
+    os.environ.setdefault("LLM_CACHE_PATH", os.path.join(workdir, "cache.sqlite3"))
+
+    from streamlit.testing.v1 import AppTest
+
+    import blocks
+    from template_store import get_store
+
+    store = get_store()
+    app = AppTest.from_file(os.path.join(os.getcwd(), "app.py"), default_timeout=120)
+    app.run()
+
+    def drop_catalog():
+        if blocks.CATALOG_STATE_KEY in app.session_state:
+            del app.session_state[blocks.CATALOG_STATE_KEY]
+
+    print(f"{'templates':>9}  {'build_blocks':>12}  {'rebuild rerun':>13}  {'cached rerun':>12}")
+    saved = 0
+    for count in sorted(args.counts):
+        for i in range(saved, count):
+            store.save(f"Template {i:05d}", {
+                "prompt_template": f"Summarize {{topic}} for {{audience}} in style {i}.",
+                "placeholder_json": "{}",
+                "model_name": "anthropic.claude-3-sonnet-20240229-v1:0",
+                "temperature": 0.7,
+            })
+        saved = max(saved, count)
+
+        templates = store.all()
+        start = time.perf_counter()
+        blocks.build_blocks(templates)
+        build_time = time.perf_counter() - start
+
+        rebuild = _time_reruns(app, args.reruns, before_each=drop_catalog)
+        app.run()  # Rebuild once for the current template set
+        cached = _time_reruns(app, args.reruns)
+        print(f"{count:>9}  {build_time * 1000:>9.1f} ms  {rebuild * 1000:>10.1f} ms  "
+              f"{cached * 1000:>9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
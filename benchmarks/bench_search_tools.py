@@ -0,0 +1,49 @@
+"""
+Search tool latency and cache hit rate against local stand-in servers.
+
+Simulates several users running the same research flow: each round issues
+the same handful of queries to the web, PubMed and Wikipedia tools.
+
+    python -m benchmarks.bench_search_tools --rounds 10 --latency 0.05
+"""
+import argparse
+import os
+import time
+
+from benchmarks.stub_search import StubSearchServer
+
+QUERIES = ["crispr gene editing", "mrna vaccines", "protein folding"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Artificial server latency in seconds")
+    args = parser.parse_args()
+
+    server = StubSearchServer(latency=args.latency).start()
+    os.environ.update(server.environ())
+    import search_tools
+
+    start = time.perf_counter()
+    try:
+        for _ in range(args.rounds):
+            for query in QUERIES:
+                search_tools.web_search(query, api_key="stub")
+                search_tools.pubmed_search(query)
+                search_tools.wikipedia_search(query)
+    finally:
+        server.stop()
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.rounds} rounds x {len(QUERIES)} queries x 3 tools in {elapsed:.2f}s, "
+          f"{server.request_count} upstream HTTP requests")
+    for tool, stats in sorted(search_tools.search_stats().items()):
+        print(f"{tool:<10} calls={stats['calls']:<4} hit_rate={stats['hit_rate']:6.1%}  "
+              f"mean_latency={stats['mean_latency'] * 1000:7.1f} ms  "
+              f"max_latency={stats['max_latency'] * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
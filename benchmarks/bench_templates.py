@@ -0,0 +1,70 @@
+"""
+Regex parsing + str.format vs. compiled templates on large templates.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_templates --variables 200 --rows 5000
+
+"parse" is what building the Prompt blocks costs on every rerun (variable
+extraction per template); "render" fills one template in for every row, as
+a batch evaluation does.
+"""
+import argparse
+import re
+import time
+
+from template_engine import compile_template
+
+
+def _make_template(variables):
+    names = [f"var_{i}" for i in range(variables)]
+    lines = [
+        f"Section {i}: some fixed instructions about {{{{the format}}}} and {{{name}}}, "
+        f"scored {{score_{i % 10}:>6.2f}}."
+        for i, name in enumerate(names)
+    ]
+    return "\n".join(lines), names
+
+
+def _time(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return time.perf_counter() - start
+
+
+def _report(label, baseline, compiled):
+    print(f"{label:<7} str.format/regex {baseline * 1000:9.1f} ms  "
+          f"compiled {compiled * 1000:9.1f} ms  speedup {baseline / compiled:5.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--variables", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--reruns", type=int, default=2000,
+                        help="Variable extractions timed for the parse step")
+    args = parser.parse_args()
+
+    source, names = _make_template(args.variables)
+    rows = [
+        dict({name: f"value {r}/{name}" for name in names},
+             **{f"score_{i}": r * 0.5 + i for i in range(10)})
+        for r in range(args.rows)
+    ]
+    print(f"template: {len(source)} chars, {args.variables} variables; {args.rows} rows")
+
+    regex = _time(lambda: re.findall(r'\{(.*?)\}', source), args.reruns)
+    compile_template.cache_clear()
+    compiled = _time(lambda: compile_template(source).variables, args.reruns)
+    _report("parse", regex, compiled)
+
+    template = compile_template(source)
+    assert template.render(rows[0]) == source.format(**rows[0])
+    formatted = _time(lambda: [source.format(**row) for row in rows], 1)
+    rendered = _time(lambda: [template.render(row) for row in rows], 1)
+    _report("render", formatted, rendered)
+
+
+if __name__ == "__main__":
+    main()
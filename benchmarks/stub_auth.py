@@ -0,0 +1,143 @@
+"""
+Local stand-in for the Flask auth API used by auth.py.
+
+Implements /register, /login, /refresh and /user with the same request
+and response shapes. Access tokens are unsigned JWTs with an "exp" claim,
+so clients can track expiry; refresh tokens are opaque strings.
+"""
+import base64
+import json
+import secrets
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _jwt(claims):
+    def encode(part):
+        return base64.urlsafe_b64encode(json.dumps(part).encode("utf-8")).rstrip(b"=").decode("ascii")
+    return f"{encode({'alg': 'none', 'typ': 'JWT'})}.{encode(claims)}."
+
+
+class StubAuthHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # See stub_search: avoids Nagle/delayed-ACK stalls on keep-alive.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length)) if length else {}
+        with self.server.lock:
+            self.server.request_count[self.path] = self.server.request_count.get(self.path, 0) + 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        token = self.headers.get("Authorization", "").replace("Bearer ", "", 1)
+
+        if self.path == "/register":
+            self._register(body)
+        elif self.path == "/login":
+            self._login(body)
+        elif self.path == "/refresh":
+            username = self.server.refresh_tokens.get(token)
+            if username is None:
+                self._send({"message": "Invalid refresh token"}, status=401)
+            else:
+                self._send({"access_token": self.server.issue(username)})
+        elif self.path == "/user":
+            username = self.server.access_tokens.get(token)
+            if username is None or self.server.expired(token):
+                self._send({"message": "Token has expired"}, status=401)
+            else:
+                self._send(self.server.profile(username))
+        else:
+            self._send({"message": "not found"}, status=404)
+
+    def _register(self, body):
+        username = body.get("username")
+        with self.server.lock:
+            if not username or username in self.server.users:
+                self._send({"message": "Username already exists"}, status=400)
+                return
+            self.server.users[username] = {"email": body.get("email"), "password": body.get("password"),
+                                           "user_id": len(self.server.users) + 1}
+        self._send({"message": "User registered"}, status=201)
+
+    def _login(self, body):
+        username = body.get("username") or next(
+            (name for name, user in self.server.users.items() if user["email"] == body.get("email")), None)
+        user = self.server.users.get(username)
+        if user is None or user["password"] != body.get("password"):
+            self._send({"message": "Invalid credentials"}, status=401)
+            return
+        refresh_token = secrets.token_hex(16)
+        self.server.refresh_tokens[refresh_token] = username
+        self._send(dict(self.server.profile(username), access_token=self.server.issue(username),
+                        refresh_token=refresh_token))
+
+    def _send(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubAuthServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # socketserver's default backlog of 5 resets connections under a burst
+    # of concurrent logins; a production server listens with a deeper queue.
+    request_queue_size = 128
+
+    def __init__(self, latency=0.0, token_ttl=900, port=0):
+        super().__init__(("127.0.0.1", port), StubAuthHandler)
+        self.latency = latency
+        self.token_ttl = token_ttl
+        self.users = {}
+        self.access_tokens = {}
+        self.refresh_tokens = {}
+        self.request_count = {}
+        self.connection_count = 0
+        self.lock = threading.Lock()
+
+    def issue(self, username):
+        token = _jwt({"sub": username, "exp": time.time() + self.token_ttl, "jti": secrets.token_hex(8)})
+        self.access_tokens[token] = username
+        return token
+
+    def expired(self, token):
+        payload = token.split(".")[1]
+        return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["exp"] < time.time()
+
+    def profile(self, username):
+        user = self.users[username]
+        return {"username": username, "user_id": user["user_id"], "email": user["email"],
+                "premium_status": False}
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
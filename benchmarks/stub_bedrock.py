@@ -0,0 +1,199 @@
+"""
+A tiny local stand-in for the Bedrock runtime API.
+
+Implements InvokeModel and InvokeModelWithResponseStream for Anthropic
+messages-style bodies, which is all ChatBedrock needs for `invoke` and
+`stream`.
+
+Latency and throttling can be injected: `quota` caps accepted requests per
+second account-style (a token bucket), and `throttle_rate` throttles a random
+fraction of requests. Throttled requests get the 429 ThrottlingException
+Bedrock returns. `stall_rate` makes a random fraction of requests take
+`stall_time` seconds instead of `latency`, like occasional Bedrock stalls,
+and `stall_models` limits throttling and stalls to some model ids.
+"""
+import base64
+import json
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+
+class StubBedrockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without this, Nagle's
+        # algorithm plus delayed ACKs adds ~40 ms to every keep-alive request.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request_body = self.rfile.read(length)
+        self.server.request_count += 1
+
+        affected = self.server.affects(self.path)
+        if affected and self.server.should_throttle():
+            self._send(429, {"message": "Too many requests, please wait before trying again."},
+                       headers={"x-amzn-ErrorType": "ThrottlingException"})
+            return
+
+        if affected and random.random() < self.server.stall_rate:
+            time.sleep(self.server.stall_time)
+        elif self.server.latency:
+            time.sleep(self.server.latency)
+
+        try:
+            prompt = json.loads(request_body)["messages"][-1]["content"]
+        except (ValueError, KeyError, IndexError):
+            prompt = ""
+        if isinstance(prompt, list):
+            prompt = " ".join(part.get("text", "") for part in prompt)
+
+        text = self.server.reply or f"Echo: {prompt}"
+        if self.path.endswith("/invoke-with-response-stream"):
+            self._send_stream(prompt, text)
+            return
+        if not self.path.endswith("/invoke"):
+            self._send(404, {"message": f"Unsupported path {self.path}"})
+            return
+
+        self._send(200, {
+            "id": "msg_stub",
+            "type": "message",
+            "role": "assistant",
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "usage": {
+                "input_tokens": len(prompt.split()),
+                "output_tokens": len(text.split()),
+            },
+        })
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, prompt, text):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.amazon.eventstream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        words = text.split(" ")
+        events = [{"type": "message_start", "message": {"role": "assistant", "content": []}}]
+        for i, word in enumerate(words):
+            events.append({
+                "type": "content_block_delta",
+                "index": 0,
+                "delta": {"type": "text_delta", "text": word if i == 0 else " " + word},
+            })
+        events.append({"type": "message_delta", "delta": {"stop_reason": "end_turn"}})
+        events.append({
+            "type": "message_stop",
+            "amazon-bedrock-invocationMetrics": {
+                "inputTokenCount": len(prompt.split()),
+                "outputTokenCount": len(words),
+            },
+        })
+
+        for event in events:
+            if event["type"] == "content_block_delta" and self.server.token_delay:
+                time.sleep(self.server.token_delay)
+            payload = json.dumps({
+                "bytes": base64.b64encode(json.dumps(event).encode("utf-8")).decode("ascii")
+            }).encode("utf-8")
+            frame = _encode_event(payload)
+            self.wfile.write(f"{len(frame):x}\r\n".encode("ascii") + frame + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _encode_event(payload):
+    """Frame a payload as an AWS event-stream `chunk` event."""
+    headers = b""
+    for name, value in ((":event-type", "chunk"),
+                        (":content-type", "application/json"),
+                        (":message-type", "event")):
+        name, value = name.encode("utf-8"), value.encode("utf-8")
+        headers += struct.pack(">B", len(name)) + name + b"\x07" + struct.pack(">H", len(value)) + value
+    prelude = struct.pack(">II", 12 + len(headers) + len(payload) + 4, len(headers))
+    message = prelude + struct.pack(">I", zlib.crc32(prelude)) + headers + payload
+    return message + struct.pack(">I", zlib.crc32(message))
+
+
+class StubBedrockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, reply=None, token_delay=0.0, port=0,
+                 quota=None, burst=None, throttle_rate=0.0, stall_rate=0.0, stall_time=0.0,
+                 stall_models=None):
+        super().__init__(("127.0.0.1", port), StubBedrockHandler)
+        self.latency = latency
+        self.reply = reply
+        self.token_delay = token_delay
+        self.quota = quota
+        self.burst = burst or max(1.0, quota or 1.0)
+        self.throttle_rate = throttle_rate
+        self.stall_rate = stall_rate
+        self.stall_time = stall_time
+        self.stall_models = stall_models
+        self.request_count = 0
+        self.throttled_count = 0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def affects(self, path):
+        """Whether throttling and stalls apply to a request path (/model/<id>/...)."""
+        path = unquote(path)
+        return self.stall_models is None or any(f"/model/{model}/" in path for model in self.stall_models)
+
+    def should_throttle(self):
+        with self._lock:
+            throttle = random.random() < self.throttle_rate
+            if self.quota and not throttle:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.quota)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                else:
+                    throttle = True
+            self.throttled_count += throttle
+            return throttle
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections is expected under load.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,111 @@
+"""
+Local stand-ins for the Tavily, PubMed E-utilities and Wikipedia APIs.
+
+Each response is just detailed enough for the corresponding LangChain tool
+to parse it.
+"""
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PUBMED_ARTICLE = """<?xml version="1.0"?>
+<PubmedArticleSet><PubmedArticle><MedlineCitation><Article>
+<ArticleTitle>Article {uid}</ArticleTitle>
+<Abstract><AbstractText>Stub abstract for article {uid}.</AbstractText></Abstract>
+<ArticleDate><Year>2024</Year><Month>01</Month><Day>01</Day></ArticleDate>
+</Article></MedlineCitation></PubmedArticle></PubmedArticleSet>"""
+
+
+class StubSearchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without this, Nagle's
+        # algorithm plus delayed ACKs adds ~40 ms to every keep-alive request.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        self.server.request_count += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if url.path == "/tavily/search":
+            query = json.loads(body)["query"]
+            self._send({"results": [
+                {"url": f"https://example.com/{i}", "content": f"Result {i} for {query}"}
+                for i in range(json.loads(body).get("max_results") or 2)
+            ]})
+        elif url.path == "/pubmed/esearch.fcgi":
+            self._send({"esearchresult": {"idlist": ["101", "102"], "webenv": "stub"}})
+        elif url.path == "/pubmed/efetch.fcgi":
+            self._send(PUBMED_ARTICLE.format(uid=params["id"]), "text/xml")
+        elif url.path == "/wikipedia/api.php":
+            self._send(self._wikipedia(params))
+        else:
+            self._send({"message": "not found"}, status=404)
+
+    def _wikipedia(self, params):
+        if params.get("list") == "search":
+            query = params["srsearch"]
+            return {"query": {"search": [{"title": f"{query} (topic)"}]}}
+        title = params.get("titles") or "Stub"
+        if "extracts" in params.get("prop", "").split("|"):
+            return {"query": {"pages": {"1": {"pageid": 1, "title": title, "extract": f"Summary of {title}."}}}}
+        return {"query": {"pages": {"1": {
+            "pageid": 1, "title": title, "fullurl": f"https://en.wikipedia.org/wiki/{title}"}}}}
+
+    def _send(self, payload, content_type="application/json", status=200):
+        body = payload if isinstance(payload, str) else json.dumps(payload)
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubSearchServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, port=0):
+        super().__init__(("127.0.0.1", port), StubSearchHandler)
+        self.latency = latency
+        self.request_count = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+    def environ(self):
+        """Environment variables that point search_tools at this server."""
+        return {
+            "TAVILY_API_URL": f"{self.url}/tavily",
+            "PUBMED_API_URL": f"{self.url}/pubmed",
+            "WIKIPEDIA_API_URL": f"{self.url}/wikipedia/api.php",
+        }
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,523 @@
+import logging
+
+from barfi import Block
+
+from flow_sinks import get_sink
+from llm import ROUTE_FALLBACK, ROUTE_HEDGED, ROUTE_SINGLE, observed_latencies, stream_routed
+from model_catalog import catalog_version, get_catalog, get_model, model_ids, route_model
+from payload import (COMPLETION, PASSAGES, SEARCH, as_payload, completion_payload, passages_payload,
+                     search_payload, text_payload)
+from search_tools import web_search, pubmed_search, wikipedia_search
+from template_engine import TemplateError, compile_template
+from token_budget import get_ledger, usage_scopes
+from vector_index import fetched_source, get_index, upload_prefix
+
+logger = logging.getLogger(__name__)
+
+# Where cached_blocks keeps a session's block catalog.
+CATALOG_STATE_KEY = "block_catalog"
+
+# Model block routing options (see llm.stream_routed).
+ROUTING_POLICIES = {
+    "Single model": ROUTE_SINGLE,
+    "Fallback": ROUTE_FALLBACK,
+    "Hedged": ROUTE_HEDGED,
+}
+NEXT_IN_CATALOG = "Next in catalog"
+
+###############################################################################
+# 1. Define Compute Functions
+#
+# Compute functions never touch Streamlit directly: all output goes through
+# get_sink(), which renders to the sidebar in the app and records structured
+# events when a flow runs headless. Blocks pass data as immutable Payloads
+# (see payload): downstream blocks read `.text`, never the raw structure.
+###############################################################################
+
+def _routes(self, model):
+    """
+    The block's (model, region) routes, primary first: the backup model
+    (by default the next one in the catalog) in the backup region, if set.
+    """
+    backup = self.get_option(name='backup_model') or NEXT_IN_CATALOG
+    if backup == NEXT_IN_CATALOG:
+        ids = model_ids()
+        backup = ids[(ids.index(model) + 1) % len(ids)] if model in ids else model
+    return [(model, None), (backup, self.get_option(name='backup_region') or None)]
+
+
+def invoke_model(self, model: str, label: str):
+    """
+    Shared body of the model block compute functions; max_tokens, limits
+    and the prompt budget come from the model's catalog entry. The block's
+    routing option (a single model unless the user picks otherwise) decides
+    whether a slow or failing request falls back to, or is hedged with, the
+    backup route; the output records the model that answered. Token usage,
+    including that of abandoned routes, is added to the session's and
+    user's totals.
+    """
+    sink = get_sink()
+    in_val = as_payload(self.get_interface(name='input_0'))
+    if in_val:
+        sink.write(f"{label} block received input:", in_val)
+        prompt = in_val.text
+
+        # Stream the LLM response as tokens arrive
+        stats = {}
+        policy = ROUTING_POLICIES.get(self.get_option(name='routing'), ROUTE_SINGLE)
+        raw_output = sink.stream(
+            f"### {label} Block Response:",
+            stream_routed(
+                prompt=prompt,
+                routes=_routes(self, model),
+                policy=policy,
+                stats=stats,
+                cache=sink.get_value("flow_cache") or None
+            ),
+            stats=stats
+        )
+        if stats.get("truncated"):
+            sink.write(f"{label} block: the prompt was over the model's token budget and was truncated.")
+        scopes = usage_scopes(sink.get_value("usage_session"), sink.get_value("username"))
+        for attempt in stats["attempts"]:
+            if attempt.get("total_time") is not None:
+                get_ledger().record(scopes, attempt["model"], attempt.get("input_tokens"),
+                                    attempt.get("output_tokens"), cached=attempt.get("cached", False))
+        for attempt in stats["attempts"]:
+            if attempt["outcome"] in ("failed", "timeout"):
+                sink.write(f"{label} block: {get_model(attempt['model'])['label']} did not answer "
+                           f"({attempt['error']}).")
+
+        out_val = completion_payload(prompt, stats["model"], raw_output, requested_model=model,
+                                     region=stats["region"], policy=policy, hedged=stats["hedged"],
+                                     fallback=stats["fallback"])
+        self.set_interface(name='output_0', value=out_val)
+        sink.result(f"### {label} Block Output:", out_val)
+    else:
+        sink.write(f"{label} block received no input.")
+
+
+def model_compute_factory(spec: dict):
+    """
+    Creates the compute function for a model block from its catalog entry
+    (see model_catalog).
+    """
+    def invoke(self):
+        invoke_model(self, model=spec["id"], label=spec["label"])
+
+    return invoke
+
+
+def auto_model_compute(self):
+    """
+    Compute function for the Auto (Model) Block: sends the prompt to the
+    cheapest catalog model expected to answer within the block's latency
+    budget, using measured latencies once there are enough of them.
+    """
+    model = route_model(self.get_option(name="latency_budget") or None, observed=observed_latencies())
+    invoke_model(self, model=model, label=f"Auto ({get_model(model)['label']})")
+
+
+def final_output_compute(self):
+    """
+    Compute function for the Final Output Block.
+    """
+    sink = get_sink()
+    val = as_payload(self.get_interface(name='input_0'))
+    if val:
+        sink.result("Final output block received input:", val)
+    else:
+        sink.write("Final output block received no input.")
+
+def web_search_compute(self):
+    """
+    Compute function for the Web Search (Tool) Block.
+    """
+    sink = get_sink()
+    in_val = as_payload(self.get_interface(name='input_0'))
+    if in_val:
+        sink.write("Web Search block received input:", in_val)
+
+        # Shared Tavily client; repeated queries are served from the cache
+        api_key = sink.get_secret("TAVILY_API_KEY")
+        out_val = search_payload("web", in_val.text, web_search(in_val.text, api_key=api_key, max_results=2))
+
+        self.set_interface(name='output_0', value=out_val)
+        sink.result("Web Search block set output:", out_val)
+    else:
+        sink.write("Web Search block received no input.")
+
+def pubmed_search_compute(self):
+    """
+    Compute function for the PubMed Search (Tool) Block.
+    """
+    sink = get_sink()
+    in_val = as_payload(self.get_interface(name='input_0'))
+    if in_val:
+        sink.write("PubMed Search block received input:", in_val)
+
+        # Shared PubMed tool; repeated queries are served from the cache
+        raw_output = pubmed_search(in_val.text)
+
+        # One result per paragraph
+        out_val = search_payload("pubmed", in_val.text, raw_output.split("\n\n"))
+
+        self.set_interface(name='output_0', value=out_val)
+        sink.result("PubMed Search block set output:", out_val)
+    else:
+        sink.write("PubMed Search block received no input.")
+
+def wikipedia_search_compute(self):
+    """
+    Compute function for the Wikipedia Search (Tool) Block.
+    """
+    sink = get_sink()
+    in_val = as_payload(self.get_interface(name='input_0'))
+    if in_val:
+        sink.write("Wikipedia Search block received input:", in_val)
+
+        # Shared Wikipedia tool; repeated queries are served from the cache
+        raw_output = wikipedia_search(in_val.text)
+
+        # One result per paragraph
+        out_val = search_payload("wikipedia", in_val.text, raw_output.split("\n\n"))
+
+        self.set_interface(name='output_0', value=out_val)
+        sink.result("Wikipedia Search block set output:", out_val)
+    else:
+        sink.write("Wikipedia Search block received no input.")
+
+def init_block_compute(self):
+    """
+    Compute function for the Init Block.
+    This block serves as the starting point of the flow.
+    """
+    sink = get_sink()
+    sink.write("Init Block is the start of the flow.")
+
+    # Read from session state (or the headless runner's inputs)
+    user_input = sink.get_value("init_input", "")
+
+    if user_input:
+        self.set_interface(name='output_0', value=text_payload(user_input))
+        sink.write("Init Block has set the initial value:", user_input)
+    else:
+        sink.write("No input provided in Init Block.")
+
+
+def pack_block_compute(self):
+    """
+    Compute function for the Pack Block.
+    """
+    sink = get_sink()
+    in_val = as_payload(self.get_interface(name='input_0'))
+    if in_val:
+        sink.write("Pack Block received input:", in_val)
+        # Dummy processing logic
+        out_val = text_payload(f"Packed: {in_val.text}")
+        self.set_interface(name='output_0', value=out_val)
+        sink.write("Pack Block set output:", out_val)
+    else:
+        sink.write("Pack Block received no input.")
+
+def combine_block_compute(self):
+    """
+    Compute function for the Combine Block.
+    """
+    sink = get_sink()
+    # Collect inputs
+    inputs = [
+        as_payload(self.get_interface(name='input_1')),
+        as_payload(self.get_interface(name='input_2')),
+        as_payload(self.get_interface(name='input_3'))
+    ]
+
+    # Filter out missing inputs and join the texts
+    combined_val = " + ".join(val.text for val in inputs if val)
+
+    if combined_val:
+        sink.write("Combine Block received inputs:", *[val for val in inputs if val])
+        out_val = text_payload(combined_val)
+        self.set_interface(name='output_0', value=out_val)
+        sink.result("Combine Block set output:", out_val)
+    else:
+        sink.write("Combine Block received no valid inputs.")
+
+def _documents(value):
+    """
+    Splits a block output into (source, text) pairs for indexing: one pair
+    per search result (web results as {"url": ..., "content": ...}) or
+    retrieved passage, and a single pair for model output and text.
+
+    Search results are indexed under a fetched_source, so other sessions'
+    Retrieval blocks can find them again; passages keep the source they
+    were retrieved from. Model output and text are never shared that way.
+    """
+    if not value:
+        return []
+    if value.kind == SEARCH:
+        documents = []
+        for item in value.body:
+            if isinstance(item, dict):
+                source = item.get("url") or item.get("source") or value.meta.get("query") or "search"
+                documents.append((fetched_source(source), str(item.get("content", item.get("text", item)))))
+            elif item:
+                documents.append((fetched_source(value.meta.get("query") or "search"), str(item)))
+        return documents
+    if value.kind == PASSAGES:
+        documents = []
+        for item in value.body:
+            if isinstance(item, dict):
+                source = item.get("source") or "passage"
+                if item.get("fetched"):
+                    source = fetched_source(source)
+                documents.append((source, str(item.get("text", item))))
+            elif item:
+                documents.append(("passage", str(item)))
+        return documents
+    if value.kind == COMPLETION:
+        return [("model output", value.text)]
+    return [("text", value.text)]
+
+
+def retrieval_compute(self):
+    """
+    Compute function for the Retrieval Block: indexes the documents it
+    receives (see vector_index) and passes on only the chunks most relevant
+    to its query, as numbered passages.
+    """
+    sink = get_sink()
+    query = as_payload(self.get_interface(name='query'))
+    if not query:
+        sink.write("Retrieval block received no query.")
+        return
+    query = query.text
+    sink.write("Retrieval block received query:", query)
+
+    index = get_index()
+    ids = []
+    received = 0
+    for name in ('documents_1', 'documents_2', 'documents_3'):
+        for source, text in _documents(as_payload(self.get_interface(name=name))):
+            received += len(text)
+            ids.extend(index.add(text, source=source))
+
+    scope = self.get_option(name='search')
+    uploads = None
+    if scope != 'Inputs':
+        # Reading the upload list makes incremental reruns recompute the
+        # block after an upload.
+        sink.get_value("retrieval_uploads", [])
+        owner = sink.get_value("username") or sink.get_value("usage_session")
+        uploads = upload_prefix(owner) if owner else None
+    chunks = index.search(query, k=self.get_option(name='top_k') or 4, ids=ids, source_prefix=uploads,
+                          fetched=scope == 'Inputs, uploads and past searches')
+
+    out_val = passages_payload(query, chunks)
+    self.set_interface(name='output_0', value=out_val)
+    sink.write(f"Retrieval block kept {len(chunks)} chunks: {len(out_val.text):,} of "
+               f"{received:,} characters received.")
+    sink.result("Retrieval block set output:", out_val)
+
+###############################################################################
+# 2. Compute Function Factory for Prompt Block
+###############################################################################
+
+def prompt_compute_factory(template):
+    """
+    Creates a compute function for the Prompt Block from a compiled template
+    (see template_engine.compile_template).
+    """
+    def prompt_compute(self):
+        sink = get_sink()
+        # Collect inputs for each variable
+        input_values = {}
+        for var in template.variables:
+            input_val = as_payload(self.get_interface(name=var))
+            if input_val:
+                input_values[var] = input_val.text
+            else:
+                sink.error(f"Missing input for variable: {var}")
+                return  # Exit if any input is missing
+
+        # Inject variables into the prompt template
+        try:
+            final_prompt = template.render(input_values)
+            sink.write("### Final Prompt:")
+            sink.code(final_prompt, language="markdown")
+
+            # Set the output interface with the formatted prompt
+            self.set_interface(name='output_0', value=text_payload(final_prompt))
+
+        except Exception as e:
+            sink.error(f"Error generating prompt: {e}")
+
+    return prompt_compute
+
+###############################################################################
+# 3. Block Catalog
+###############################################################################
+
+def _add_routing_options(block):
+    """Adds the routing policy and backup route options of model blocks."""
+    # Answering from another model changes price and quality, so it is
+    # opt-in per block.
+    block.add_option(name='routing', type='select', value='Single model', items=list(ROUTING_POLICIES))
+    block.add_option(name='backup_model', type='select', value=NEXT_IN_CATALOG,
+                     items=[NEXT_IN_CATALOG] + model_ids())
+    block.add_option(name='backup_region', type='input', value='')
+
+
+def build_blocks(templates=None, include_pack=False):
+    """
+    Builds the Barfi blocks available in the editor.
+
+    Args:
+        templates (dict): Saved templates by name; one Prompt block is
+            created per template
+        include_pack (bool): Whether to include the login-only Pack Block
+
+    Returns:
+        list: Block objects, in the order they appear in the editor
+    """
+    # -----------------------------------------------------------------
+    # Create the standard blocks: Final Output, Anthropic, Web Search, etc.
+    # -----------------------------------------------------------------
+    final_output = Block(name="Final Output")
+    final_output.add_input(name='input_0')
+    final_output.add_compute(final_output_compute)
+
+    web_search_block = Block(name='Web Search (Tool)')
+    web_search_block.add_input(name='input_0')
+    web_search_block.add_output(name='output_0')
+    web_search_block.add_compute(web_search_compute)
+
+    init_block = Block(name="Init Block")
+    init_block.add_output(name="output_0")
+    init_block.add_compute(init_block_compute)
+
+    pubmed_block = Block(name='PubMed Search (Tool)')
+    pubmed_block.add_input(name='input_0')
+    pubmed_block.add_output(name='output_0')
+    pubmed_block.add_compute(pubmed_search_compute)
+
+    wikipedia_block = Block(name='Wikipedia Search (Tool)')
+    wikipedia_block.add_input(name='input_0')
+    wikipedia_block.add_output(name='output_0')
+    wikipedia_block.add_compute(wikipedia_search_compute)
+
+    combine_block = Block(name='Combine Block')
+    combine_block.add_input(name='input_1')
+    combine_block.add_input(name='input_2')
+    combine_block.add_input(name='input_3')
+    combine_block.add_output(name='output_0')
+    combine_block.add_compute(combine_block_compute)
+
+    retrieval_block = Block(name='Retrieval Block')
+    retrieval_block.add_input(name='query')
+    retrieval_block.add_input(name='documents_1')
+    retrieval_block.add_input(name='documents_2')
+    retrieval_block.add_input(name='documents_3')
+    retrieval_block.add_output(name='output_0')
+    retrieval_block.add_option(name='top_k', type='integer', value=4)
+    retrieval_block.add_option(name='search', type='select', value='Inputs',
+                               items=['Inputs', 'Inputs and uploads', 'Inputs, uploads and past searches'])
+    retrieval_block.add_compute(retrieval_compute)
+
+    # -----------------------------------------------------------------
+    # Create base blocks list - all blocks except Pack Block which is conditional
+    # -----------------------------------------------------------------
+    base_blocks = [
+        init_block,
+        web_search_block,
+        pubmed_block,
+        wikipedia_block,
+        final_output,
+        combine_block,
+        retrieval_block
+    ]
+
+    # -----------------------------------------------------------------
+    # One model block per catalog entry that names a block, plus a block
+    # that routes to the cheapest model within a latency budget
+    # -----------------------------------------------------------------
+    for spec in get_catalog().values():
+        if not spec["block"]:
+            continue
+        model_block = Block(name=spec["block"])
+        model_block.add_input(name='input_0')
+        model_block.add_output(name='output_0')
+        _add_routing_options(model_block)
+        model_block.add_compute(model_compute_factory(spec))
+        base_blocks.append(model_block)
+
+    auto_block = Block(name='Auto (Model)')
+    auto_block.add_input(name='input_0')
+    auto_block.add_output(name='output_0')
+    auto_block.add_option(name='latency_budget', type='number', value=5.0)
+    _add_routing_options(auto_block)
+    auto_block.add_compute(auto_model_compute)
+    base_blocks.append(auto_block)
+
+    # Conditionally add Pack Block (only for logged-in users in the app)
+    if include_pack:
+        pack_block = Block(name='Pack Block')
+        pack_block.add_input(name='input_0')
+        pack_block.add_output(name='output_0')
+        pack_block.add_compute(pack_block_compute)
+
+        # Add to base blocks
+        base_blocks.append(pack_block)
+
+    # ------------------------------------------------
+    # Create a Prompt block PER saved template
+    # ------------------------------------------------
+    for tmpl_name, tmpl_data in (templates or {}).items():
+        # Compiled templates are cached, so reruns do not re-parse them
+        try:
+            template = compile_template(tmpl_data["prompt_template"])
+        except TemplateError as e:
+            logger.warning(f"Skipping Prompt block for template '{tmpl_name}': {e}")
+            continue
+
+        block_title = f"Prompt: {tmpl_name}"
+        new_block = Block(name=block_title)
+
+        for var in template.variables:
+            new_block.add_input(name=var)
+
+        new_block.add_output(name='output_0')
+        new_block.add_compute(prompt_compute_factory(template))
+
+        base_blocks.append(new_block)
+
+    return base_blocks
+
+
+def cached_blocks(state, templates, version, include_pack=False):
+    """
+    Returns build_blocks(templates, include_pack), kept in `state` and
+    rebuilt only when the template set, the model catalog or include_pack
+    changes.
+
+    Blocks hold their option and interface values, so give every session
+    its own `state` rather than sharing one catalog between sessions.
+
+    Args:
+        state (dict): Per-session storage such as st.session_state; the
+            catalog is kept under CATALOG_STATE_KEY
+        templates (dict): Saved templates by name
+        version: Anything that changes whenever `templates` does, such as
+            the revision from TemplateStore.snapshot()
+        include_pack (bool): Whether to include the login-only Pack Block
+
+    Returns:
+        list: Block objects
+    """
+    key = (version, catalog_version(), include_pack)
+    cached = state.get(CATALOG_STATE_KEY)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    blocks = build_blocks(templates=templates, include_pack=include_pack)
+    state[CATALOG_STATE_KEY] = (key, blocks)
+    return blocks
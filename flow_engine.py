@@ -0,0 +1,386 @@
+import copy
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from graphlib import CycleError, TopologicalSorter
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from flow_sinks import RecordingSink, get_sink, read_digest, use_sink
+from payload import Payload
+from response_cache import make_key
+from tracing import span, use_context
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on blocks computing at the same time within one flow run.
+MAX_WORKERS = int(os.environ.get("FLOW_MAX_WORKERS", "8"))
+# Block results a FlowMemo keeps for reuse between runs.
+MEMO_ENTRIES = int(os.environ.get("FLOW_MEMO_ENTRIES", "256"))
+
+
+def _input_key(value):
+    return {"payload": value.digest} if isinstance(value, Payload) else value
+
+
+def block_fingerprint(block):
+    """
+    Fingerprints a block's configuration and current input values.
+
+    Configuration is the block type, its option values and its compute
+    function, including the values it closes over (so a Prompt block whose
+    template was edited gets a new fingerprint even if its name did not
+    change). Payload inputs count by their digest, so large search results
+    are not serialized again for every block they reach.
+
+    Returns:
+        str: Hex digest
+    """
+    func = getattr(block._on_compute, "__func__", block._on_compute)
+    return make_key(
+        type=block._type,
+        compute=f"{func.__module__}.{func.__qualname__}",
+        closure=[repr(cell.cell_contents) for cell in (func.__closure__ or ())],
+        options={name: option.get("value") for name, option in block._options.items()},
+        inputs={name: _input_key(interface["value"]) for name, interface in block._inputs.items()},
+    )
+
+
+class FlowMemo(object):
+    """
+    Remembers block outputs between flow runs, by block fingerprint.
+
+    An entry also records the session values and secrets the block read
+    while computing (e.g. the Init Block's prompt); it is only reused while
+    they are unchanged. Keep one per session and pass it to every run_flow
+    call: unchanged blocks are then reused and only the part of the flow
+    downstream of an edit is recomputed.
+    """
+
+    def __init__(self, max_entries=MEMO_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key, sink):
+        """Returns a copy of the outputs stored for a fingerprint, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            try:
+                fresh = all(read_digest(sink, kind, name, default) == digest
+                            for kind, name, default, digest in entry["reads"])
+            except KeyError:
+                fresh = False
+            if fresh:
+                self.hits += 1
+                return copy.deepcopy(entry["outputs"])
+        self.misses += 1
+        return None
+
+    def reads(self, key):
+        """Returns the external reads stored with a fingerprint's outputs."""
+        with self._lock:
+            entry = self._entries.get(key)
+        return list(entry["reads"]) if entry is not None else []
+
+    def store(self, key, outputs, reads):
+        """Remembers a block's outputs and the external values it read."""
+        with self._lock:
+            self._entries[key] = {"outputs": copy.deepcopy(outputs), "reads": list(reads)}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Forgets every stored result."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def build_graph(base_blocks, editor_state):
+    """
+    Builds the active blocks and their dependencies from a Barfi editor state.
+
+    Mirrors barfi's ComputeEngine: every node in the schema gets an
+    independent deep copy of the base block of the same type.
+
+    Args:
+        base_blocks (list): The Block objects the editor was rendered with
+        editor_state (dict): Saved Barfi schema with 'nodes' and 'connections'
+
+    Returns:
+        tuple: (nodes, links, deps) where nodes maps node id to
+            {'block', 'name', 'type'}, links maps an output interface id to
+            a list of (node id, input name), and deps maps node id to the set
+            of upstream node ids
+    """
+    blocks_by_type = {block._type: block for block in base_blocks}
+    nodes = {}
+    interface_owner = {}
+
+    for node in editor_state.get("nodes", []):
+        parent = blocks_by_type.get(node["type"])
+        if parent is None:
+            raise ValueError(f"Flow uses unknown block type: {node['type']}")
+        child = copy.deepcopy(parent)
+        child._name = node["name"]
+        for interface_name, interface in node["interfaces"]:
+            child._set_interface_id(name=interface_name, id=interface["id"])
+            interface_owner[interface["id"]] = (node["id"], interface_name)
+        for option_name, option_value in node.get("options", []):
+            child.set_option(name=option_name, value=option_value)
+        nodes[node["id"]] = {"block": child, "name": node["name"], "type": node["type"]}
+
+    links = {}
+    deps = {node_id: set() for node_id in nodes}
+    for connection in editor_state.get("connections", []):
+        from_node, _ = interface_owner[connection["from"]]
+        to_node, to_name = interface_owner[connection["to"]]
+        links.setdefault(connection["from"], []).append((to_node, to_name))
+        deps[to_node].add(from_node)
+
+    return nodes, links, deps
+
+
+def _critical_path(deps, timings):
+    """Returns the longest chain of dependent blocks by measured duration."""
+    finish = {}
+    previous = {}
+    for node_id in TopologicalSorter(deps).static_order():
+        best = max(deps[node_id], key=lambda d: finish[d], default=None)
+        finish[node_id] = timings[node_id]["duration"] + (finish[best] if best else 0.0)
+        previous[node_id] = best
+
+    if not finish:
+        return [], 0.0
+    node_id = max(finish, key=finish.get)
+    total = finish[node_id]
+    path = []
+    while node_id is not None:
+        path.append(node_id)
+        node_id = previous[node_id]
+    return list(reversed(path)), total
+
+
+def run_flow(base_blocks, editor_state, max_workers=None, sink=None, memo=None, replay=None):
+    """
+    Executes a Barfi flow, running independent branches concurrently.
+
+    A block starts as soon as every block feeding it has finished, so a
+    fan-out from the Init Block to several model and search blocks costs
+    roughly the slowest branch rather than the sum of all of them. When a
+    block raises, its descendants are skipped, as in barfi's own engine.
+    With a memo, blocks whose fingerprint matches a previous run are not
+    computed again; their stored outputs are passed on instead. A replay
+    does the same from one recorded run (see run_store): a block is served
+    from the record while its fingerprint and the session values it read
+    still match, so blocks left out of the replay and everything
+    downstream of them are computed again.
+    Blocks without outputs (such as Final Output) only display, and always
+    run.
+
+    Args:
+        base_blocks (list): The Block objects the editor was rendered with
+        editor_state (dict): Saved Barfi schema with 'nodes' and 'connections'
+        max_workers (int): Thread pool size, defaults to MAX_WORKERS
+        sink: Where block output goes (see flow_sinks); defaults to the
+            Streamlit sidebar
+        memo (FlowMemo): Results of earlier runs to reuse, updated in place
+        replay (dict): Node id -> {"fingerprint", "reads", "outputs"}
+            recorded for the blocks to serve from a previous run (see
+            run_store.replay_plan)
+
+    Returns:
+        dict: 'results' (block name -> node_id, block, type, status, reused,
+            replayed, fingerprint, reads, inputs, outputs), 'timings' (one entry per
+            block, in start order), 'wall_time', 'serial_time',
+            'critical_path', 'critical_path_time', 'reused' (number of blocks
+            taken from the memo), 'replayed' (number served from the replay)
+            and 'trace_id' (see tracing.get_spans)
+    """
+    nodes, links, deps = build_graph(base_blocks, editor_state)
+    sorter = TopologicalSorter(deps)
+    try:
+        sorter.prepare()
+    except CycleError as e:
+        raise ValueError(f"Cycle(s) detected in flow: {e.args[1]}") from e
+
+    # Compute functions write to the Streamlit sidebar, so worker threads
+    # need the script run context of the session that started the flow.
+    ctx = get_script_run_ctx()
+    flow_start = time.perf_counter()
+    timings = {}
+    status = {}
+    fingerprints = {}
+    reused = set()
+    replayed = set()
+    recorders = {}
+    reads = {}
+    # Memo lookups re-read session values on this thread, so resolve the
+    # sink the same way blocks would.
+    lookup_sink = sink or get_sink()
+
+    def compute(node_id):
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        block = nodes[node_id]["block"]
+        start = time.perf_counter()
+        try:
+            with use_sink(recorders.get(node_id) or sink, block=nodes[node_id]["name"]), \
+                    use_context(flow_context), \
+                    span(nodes[node_id]["name"], "block", type=nodes[node_id]["type"]):
+                block._on_compute()
+        finally:
+            end = time.perf_counter()
+            timings[node_id] = {
+                "block": nodes[node_id]["name"],
+                "start": start - flow_start,
+                "end": end - flow_start,
+                "duration": end - start,
+            }
+
+    def skip(node_id, parent_name):
+        status[node_id] = "Skipped"
+        nodes[node_id]["block"]._state["info"] = {
+            "status": "Errored", "message": "Parent block errored", "parent": parent_name}
+        timings[node_id] = {
+            "block": nodes[node_id]["name"], "start": None, "end": None,
+            "duration": 0.0, "status": "Skipped"}
+
+    def propagate(node_id):
+        # Runs on the coordinating thread, so downstream inputs are never
+        # written concurrently.
+        block = nodes[node_id]["block"]
+        status[node_id] = "Computed"
+        block._state["info"] = {"status": "Computed"}
+        for output in block._outputs.values():
+            for to_node, to_name in links.get(output["id"], []):
+                nodes[to_node]["block"].set_interface(name=to_name, value=output["value"])
+
+    def fresh(recorded_reads):
+        try:
+            return all(read_digest(lookup_sink, kind, name, default) == digest
+                       for kind, name, default, digest in recorded_reads)
+        except KeyError:
+            return False
+
+    def serve(node_id, outputs, source, recorded_reads):
+        # Passes on stored outputs in place of computing the block.
+        block = nodes[node_id]["block"]
+        reads[node_id] = list(recorded_reads)
+        for name, value in outputs.items():
+            block.set_interface(name=name, value=value)
+        with span(nodes[node_id]["name"], "block", parent=flow_context, detached=True,
+                  type=nodes[node_id]["type"], **{source: True}):
+            pass
+        now = time.perf_counter() - flow_start
+        timings[node_id] = {
+            "block": nodes[node_id]["name"], "start": now, "end": now,
+            "duration": 0.0, "status": "Computed", source: True}
+        propagate(node_id)
+
+    def reuse(node_id):
+        block = nodes[node_id]["block"]
+        fingerprints[node_id] = block_fingerprint(block)
+        if not block._outputs:
+            # Nothing to pass on: the block is only run for what it displays.
+            return False
+        if replay is not None:
+            recorded = replay.get(node_id)
+            if (recorded is not None and recorded["fingerprint"] == fingerprints[node_id]
+                    and fresh(recorded["reads"])):
+                replayed.add(node_id)
+                serve(node_id, recorded["outputs"], "replayed", recorded["reads"])
+                return True
+        if memo is None:
+            return False
+        outputs = memo.lookup(fingerprints[node_id], lookup_sink)
+        if outputs is None:
+            return False
+        reused.add(node_id)
+        serve(node_id, outputs, "reused", memo.reads(fingerprints[node_id]))
+        return True
+
+    workers = max_workers or MAX_WORKERS
+    with span("flow", "flow", blocks=len(nodes), workers=workers) as flow_trace, \
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="flow") as pool:
+        # Block spans (and the model and search calls inside them) nest
+        # under the flow span, whichever worker thread they run on.
+        flow_context = (flow_trace["trace_id"], flow_trace["span_id"])
+        running = {}
+        while sorter.is_active():
+            for node_id in sorter.get_ready():
+                upstream_failed = next((d for d in deps[node_id] if status.get(d) != "Computed"), None)
+                if upstream_failed is not None:
+                    parent = nodes[upstream_failed]["block"]._state["info"].get("parent", nodes[upstream_failed]["name"])
+                    skip(node_id, parent)
+                    sorter.done(node_id)
+                    continue
+                if (memo is not None or replay is not None) and reuse(node_id):
+                    sorter.done(node_id)
+                    continue
+                recorders[node_id] = RecordingSink(lookup_sink)
+                running[pool.submit(compute, node_id)] = node_id
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                node_id = running.pop(future)
+                block = nodes[node_id]["block"]
+                error = future.exception()
+                if error is None:
+                    propagate(node_id)
+                    if memo is not None and block._outputs:
+                        memo.store(
+                            fingerprints[node_id],
+                            {name: out["value"] for name, out in block._outputs.items()},
+                            recorders[node_id].reads,
+                        )
+                else:
+                    status[node_id] = "Errored"
+                    block._state["info"] = {"status": "Errored", "exception": error.args}
+                    logger.error(f"Block '{nodes[node_id]['name']}' failed: {error}")
+                timings[node_id]["status"] = status[node_id]
+                sorter.done(node_id)
+
+    wall_time = time.perf_counter() - flow_start
+    path, path_time = _critical_path(deps, timings)
+    ordered = sorted(timings.values(), key=lambda t: (t["start"] is None, t["start"] or 0.0))
+
+    return {
+        "results": {
+            info["name"]: {
+                "node_id": node_id,
+                "block": info["block"],
+                "type": info["type"],
+                "status": status[node_id],
+                "reused": node_id in reused,
+                "replayed": node_id in replayed,
+                "fingerprint": fingerprints.get(node_id) or block_fingerprint(info["block"]),
+                "reads": reads.get(node_id, recorders[node_id].reads if node_id in recorders else []),
+                "inputs": {name: inp["value"] for name, inp in info["block"]._inputs.items()},
+                "outputs": {name: out["value"] for name, out in info["block"]._outputs.items()},
+            }
+            for node_id, info in nodes.items()
+        },
+        "timings": ordered,
+        "wall_time": wall_time,
+        "serial_time": sum(t["duration"] for t in timings.values()),
+        "critical_path": [nodes[n]["name"] for n in path],
+        "critical_path_time": path_time,
+        "reused": len(reused),
+        "replayed": len(replayed),
+        "trace_id": flow_trace["trace_id"],
+    }
@@ -0,0 +1,253 @@
+"""
+Runs saved Barfi flows without the Streamlit UI.
+
+Examples:
+    python flow_runner.py --schema "Research Flow" --input "What is CRISPR?"
+    python flow_runner.py --schema flow.json --inputs-file inputs.jsonl --output results.jsonl
+    python flow_runner.py --replay 3f2a... --changed "Prompt: Summary"
+
+A schema is either the name of a flow saved from the editor (schemas.barfi)
+or a JSON file holding the editor state. Each line of an inputs file is a
+JSON string (the Init Block prompt) or an object whose "input" key is the
+prompt; any other keys are passed to blocks as values (e.g. "flow_cache").
+Every run is recorded in the run store (see run_store); --replay runs a
+recorded one again, serving unchanged blocks from the record.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from barfi.manage_schema import load_schema_name
+
+from blocks import build_blocks, cached_blocks
+from flow_engine import run_flow
+from flow_sinks import ResultSink
+from payload import to_jsonable
+from run_store import get_run_store, replay_plan
+from template_store import get_store
+
+logger = logging.getLogger(__name__)
+
+
+def load_schema(schema):
+    """
+    Resolves a schema argument to a Barfi editor state.
+
+    Args:
+        schema (str | dict): Editor state, path to a JSON file, or the name
+            of a schema saved from the editor
+
+    Returns:
+        dict: Editor state with 'nodes' and 'connections'
+    """
+    if isinstance(schema, dict):
+        return schema
+    if os.path.isfile(schema):
+        with open(schema, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+    return load_schema_name(schema)
+
+
+def _row_values(row):
+    if isinstance(row, dict):
+        values = {k: v for k, v in row.items() if k != "input"}
+        values["init_input"] = row.get("input", "")
+        return values
+    return {"init_input": row}
+
+
+# Headless runs only read their base blocks (run_flow builds each flow from
+# copies), so runs from the template store share one catalog.
+_catalog_state = {}
+_catalog_lock = threading.Lock()
+
+
+def _base_blocks(templates):
+    if templates is not None:
+        return build_blocks(templates=templates, include_pack=True)
+    version, templates = get_store().snapshot()
+    with _catalog_lock:
+        return cached_blocks(_catalog_state, templates, version, include_pack=True)
+
+
+def run_schema(schema, row, templates=None, secrets=None, max_workers=None, owner=None, replay=None,
+               changed=(), base_blocks=None):
+    """
+    Runs a flow once, headless, records it in the run store and returns a
+    JSON-serializable record.
+
+    Args:
+        schema (str | dict): See load_schema
+        row (str | dict): The Init Block prompt, or a dict with "input" and
+            any extra values for the blocks
+        templates (dict): Templates for "Prompt:" blocks, by name; defaults
+            to the shared template store
+        secrets (dict): Secrets such as TAVILY_API_KEY; defaults to the
+            environment
+        max_workers (int): Blocks computed concurrently within the flow
+        owner (str): Who the recorded run belongs to; defaults to the
+            row's username or usage_session
+        replay (dict): A recorded run (see RunStore.get) to serve unchanged
+            blocks from
+        changed (iterable): Names of blocks to execute again when replaying
+        base_blocks (list): Blocks to build the flow from, as returned by
+            build_blocks; built from `templates` when not given. They are
+            only read, so one list can serve many runs at once.
+
+    Returns:
+        dict: run_id, input, status, final_outputs (what each Final Output
+            block received), blocks (status, inputs and outputs per block),
+            events (everything blocks would have shown in the sidebar),
+            timings, wall_time and critical_path_time
+    """
+    values = _row_values(row)
+    sink = ResultSink(values=values, secrets=secrets)
+    if base_blocks is None:
+        base_blocks = _base_blocks(templates)
+    editor_state = load_schema(schema)
+    report = run_flow(base_blocks, editor_state, max_workers=max_workers, sink=sink,
+                      replay=replay_plan(replay, changed) if replay else None)
+    run_id = get_run_store().record(
+        report, editor_state, values,
+        owner=owner or values.get("username") or values.get("usage_session"),
+        replay_of=replay["id"] if replay else None)
+
+    results = report["results"]
+    return {
+        "run_id": run_id,
+        "input": row,
+        "status": "error" if any(r["status"] != "Computed" for r in results.values()) else "ok",
+        "final_outputs": to_jsonable({
+            name: r["inputs"].get("input_0")
+            for name, r in results.items() if r["type"] == "Final Output"
+        }),
+        "blocks": {
+            name: {"status": r["status"], "inputs": to_jsonable(r["inputs"]),
+                   "outputs": to_jsonable(r["outputs"])}
+            for name, r in results.items()
+        },
+        "events": to_jsonable(sink.events),
+        "timings": report["timings"],
+        "wall_time": report["wall_time"],
+        "critical_path_time": report["critical_path_time"],
+    }
+
+
+def run_batch(schema, rows, templates=None, secrets=None, concurrency=4, max_workers=None,
+              replay=None, changed=()):
+    """
+    Runs a flow over many inputs, several flows at a time.
+
+    Rows are pulled lazily, so `rows` may be a generator over a large file.
+    The blocks are built once, and every row's flow is built from them.
+    With a replay (see run_schema), each row's flow reuses the recorded
+    run's blocks wherever their inputs match.
+
+    Yields:
+        tuple: (row index, record from run_schema), in completion order.
+            A flow that raises yields a record with status "error" and
+            the exception message.
+    """
+    editor_state = load_schema(schema)
+    base_blocks = _base_blocks(templates)
+    pending = enumerate(rows)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="flow-batch") as pool:
+        running = {}
+        while True:
+            # Keep the pool busy without reading the whole input up front.
+            for index, row in pending:
+                future = pool.submit(run_schema, editor_state, row, templates, secrets, max_workers,
+                                     replay=replay, changed=changed, base_blocks=base_blocks)
+                running[future] = (index, row)
+                if len(running) >= concurrency * 2:
+                    break
+            if not running:
+                return
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index, row = running.pop(future)
+                try:
+                    yield index, future.result()
+                except Exception as e:
+                    logger.error(f"Flow failed for row {index}: {e}")
+                    yield index, {"input": row, "status": "error", "error": str(e)}
+
+
+def _read_rows(path):
+    with open(path, "r", encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a saved Barfi flow without the UI.")
+    parser.add_argument("--schema",
+                        help="Saved schema name or path to an editor-state JSON file")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--input", help="Prompt for the Init Block")
+    source.add_argument("--inputs-file", help="JSONL file with one input per line")
+    parser.add_argument("--replay", metavar="RUN_ID",
+                        help="Serve blocks from a recorded run; its schema and input are the defaults")
+    parser.add_argument("--changed", action="append", default=[], metavar="BLOCK",
+                        help="With --replay, a block to execute again (repeatable)")
+    parser.add_argument("--templates",
+                        help="JSON file of templates for Prompt blocks (default: the template store)")
+    parser.add_argument("--output", help="Write JSONL results here instead of stdout")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Flows run at the same time in batch mode")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Blocks computed concurrently within one flow")
+    args = parser.parse_args(argv)
+
+    replay = None
+    if args.replay:
+        replay = get_run_store().get(args.replay)
+        if replay is None:
+            parser.error(f"no recorded run {args.replay}")
+    elif args.schema is None or (args.input is None and args.inputs_file is None):
+        parser.error("--schema and one of --input or --inputs-file are required unless replaying")
+
+    templates = None
+    if args.templates:
+        with open(args.templates, "r", encoding="utf-8") as handle:
+            templates = json.load(handle)
+
+    if args.input is not None:
+        rows = [args.input]
+    elif args.inputs_file is not None:
+        rows = _read_rows(args.inputs_file)
+    else:
+        inputs = dict(replay["inputs"])
+        rows = [dict(inputs, input=inputs.pop("init_input", ""))]
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    start = time.perf_counter()
+    count = failed = 0
+    try:
+        for index, record in run_batch(args.schema or replay["schema"], rows, templates=templates,
+                                       concurrency=args.concurrency, max_workers=args.workers,
+                                       replay=replay, changed=args.changed):
+            record["index"] = index
+            out.write(json.dumps(record, default=str) + "\n")
+            out.flush()
+            count += 1
+            failed += record["status"] != "ok"
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Ran {count} flow(s) in {elapsed:.2f}s ({failed} with errors)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,224 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import streamlit as st
+
+from llm import format_call_stats
+from payload import Payload
+from response_cache import make_key
+from result_store import ResultStore, preview
+
+# The sink and block name active on the current thread. Flow workers set
+# these around each compute; everything else falls back to the Streamlit UI.
+_local = threading.local()
+
+_session_store_lock = threading.Lock()
+
+
+def session_result_store():
+    """Returns this Streamlit session's ResultStore, creating it on first use."""
+    with _session_store_lock:
+        if "result_store" not in st.session_state:
+            st.session_state["result_store"] = ResultStore()
+        return st.session_state["result_store"]
+
+
+def _compact(value):
+    # Small values render in full; larger ones (and payloads) as their
+    # possibly truncated text.
+    text, truncated = preview(value)
+    return text if truncated or isinstance(value, Payload) else value
+
+
+class StreamlitSink(object):
+    """
+    Renders block output in the Streamlit sidebar, as the app always has.
+
+    Large values are shown as short previews; results go to the session's
+    ResultStore, where the Output Inspector pages through them.
+    """
+
+    def get_value(self, name, default=None):
+        return st.session_state.get(name, default)
+
+    def get_secret(self, name):
+        return st.secrets[name]
+
+    def write(self, *args):
+        st.sidebar.write(*(_compact(arg) for arg in args))
+
+    def json(self, value):
+        text, truncated = preview(value)
+        if truncated:
+            st.sidebar.code(text, language=None if isinstance(value, Payload) else "json")
+        else:
+            st.sidebar.json(value.value if isinstance(value, Payload) else value)
+
+    def result(self, label, value):
+        """Shows a block's output as a preview and keeps it for the Output Inspector."""
+        entry = session_result_store().put(value, block=current_block(), label=label)
+        st.sidebar.write(label)
+        text, truncated = preview(value)
+        shown = value.value if isinstance(value, Payload) else value
+        if not truncated:
+            if isinstance(shown, str):
+                st.sidebar.write(shown)
+            else:
+                st.sidebar.json(shown)
+            return
+        st.sidebar.code(text, language=None if isinstance(value, (str, Payload)) else "json")
+        st.sidebar.caption(f"{entry['size']:,} characters · result #{entry['id']} in the Output Inspector")
+
+    def code(self, text, language=None):
+        st.sidebar.code(text, language=language)
+
+    def error(self, message):
+        st.error(message)
+
+    def stream(self, heading, chunks, stats=None):
+        """Renders chunks as they arrive and returns the joined text."""
+        placeholder = st.sidebar.empty()
+        text = ""
+        placeholder.markdown(f"{heading}\n\n_Waiting for first token..._")
+        for chunk in chunks:
+            text += chunk
+            placeholder.markdown(f"{heading}\n\n{text}▌")
+        placeholder.markdown(f"{heading}\n\n{text}")
+        if stats:
+            st.sidebar.caption(format_call_stats(stats))
+        return text
+
+
+class ResultSink(object):
+    """
+    Collects block output as structured events instead of rendering it.
+
+    Used to run flows without a browser. Inputs that the UI would read from
+    session state (such as init_input) come from `values`, and secrets come
+    from `secrets` or, failing that, the environment.
+    """
+
+    def __init__(self, values=None, secrets=None):
+        self.values = dict(values or {})
+        self.secrets = secrets
+        self.events = []
+        self._lock = threading.Lock()
+
+    def _emit(self, kind, value):
+        with self._lock:
+            self.events.append({
+                "block": current_block(),
+                "kind": kind,
+                "value": value,
+                "time": time.time(),
+            })
+
+    def get_value(self, name, default=None):
+        return self.values.get(name, default)
+
+    def get_secret(self, name):
+        secrets = self.secrets if self.secrets is not None else os.environ
+        return secrets[name]
+
+    def write(self, *args):
+        self._emit("write", args[0] if len(args) == 1 else list(args))
+
+    def json(self, value):
+        self._emit("json", value)
+
+    def result(self, label, value):
+        self._emit("result", {"label": label, "value": value})
+
+    def code(self, text, language=None):
+        self._emit("code", text)
+
+    def error(self, message):
+        self._emit("error", message)
+
+    def stream(self, heading, chunks, stats=None):
+        text = "".join(chunks)
+        self._emit("stream", {"text": text, "stats": dict(stats or {})})
+        return text
+
+
+class RecordingSink(object):
+    """
+    Passes everything through to another sink, noting which values and
+    secrets a block reads.
+
+    `reads` holds (kind, name, default, digest) tuples; digests rather than
+    values, so secrets are never kept. FlowMemo uses them to tell whether a
+    block whose inputs are unchanged would still compute the same output.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.reads = []
+
+    def get_value(self, name, default=None):
+        value = self.sink.get_value(name, default)
+        self.reads.append(("value", name, default, make_key(value=value)))
+        return value
+
+    def get_secret(self, name):
+        value = self.sink.get_secret(name)
+        self.reads.append(("secret", name, None, make_key(value=value)))
+        return value
+
+    def __getattr__(self, name):
+        return getattr(self.sink, name)
+
+
+class PresetSink(object):
+    """
+    Passes everything through to another sink, but answers value reads
+    from `values`, as a headless run would (see ResultSink); only the
+    names in `live` are still read from the wrapped sink. Replays use it
+    to give blocks a recorded run's inputs.
+    """
+
+    def __init__(self, sink, values, live=()):
+        self.sink = sink
+        self.values = dict(values)
+        self.live = set(live)
+
+    def get_value(self, name, default=None):
+        if name in self.live:
+            return self.sink.get_value(name, default)
+        return self.values.get(name, default)
+
+    def __getattr__(self, name):
+        return getattr(self.sink, name)
+
+
+def read_digest(sink, kind, name, default=None):
+    """Digest of what a RecordingSink read would return from `sink` now."""
+    if kind == "secret":
+        return make_key(value=sink.get_secret(name))
+    return make_key(value=sink.get_value(name, default))
+
+
+_default_sink = StreamlitSink()
+
+
+def get_sink():
+    """Returns the sink block output should go to on this thread."""
+    return getattr(_local, "sink", None) or _default_sink
+
+
+def current_block():
+    """Returns the name of the block computing on this thread, if any."""
+    return getattr(_local, "block", None)
+
+
+@contextmanager
+def use_sink(sink, block=None):
+    """Routes block output on this thread to `sink` for the duration."""
+    previous = (getattr(_local, "sink", None), getattr(_local, "block", None))
+    _local.sink, _local.block = sink, block
+    try:
+        yield sink
+    finally:
+        _local.sink, _local.block = previous
@@ -0,0 +1,363 @@
+"""
+Background execution of flow runs and prompt runs.
+
+The UI submits a job and returns at once; worker threads execute it and
+record its status and result in SQLite, so the UI can poll for it and a
+reloaded page can find it again by owner.
+Jobs run in priority order, first come first served within a priority,
+with a cap on how many run at once overall and per owner.
+
+Several app processes may share one job database. A running job is leased
+to the worker that claimed it, which keeps renewing the lease; only jobs
+whose lease ran out, because their process stopped, are queued again.
+"""
+import heapq
+import itertools
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Like the response cache and template store, the job database defaults to
+# the working directory the app was started from.
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", "jobs.sqlite3")
+# Jobs executed at once, overall and per owner.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_MAX_PER_OWNER = int(os.environ.get("JOB_MAX_PER_OWNER", "2"))
+# Seconds a running job stays claimed without its worker renewing the
+# lease; leases are renewed every third of that.
+JOB_LEASE = float(os.environ.get("JOB_LEASE", "60"))
+
+# Lower runs first.
+PRIORITY_PREMIUM = 0
+PRIORITY_DEFAULT = 10
+
+ACTIVE_STATUSES = ("queued", "running")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    owner TEXT,
+    label TEXT,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    worker TEXT,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created);
+"""
+# Columns added after the first release, for databases created before them.
+_ADDED_COLUMNS = {"worker": "TEXT", "lease_until": "REAL"}
+
+_COLUMNS = ("id", "kind", "owner", "label", "priority", "status", "payload", "result", "error",
+            "created", "started", "finished")
+
+
+class _Secrets(object):
+    """Secrets for jobs: the environment first, then Streamlit's secrets.toml."""
+
+    def __getitem__(self, name):
+        if name in os.environ:
+            return os.environ[name]
+        import streamlit as st
+        return st.secrets[name]
+
+
+def _run_flow_job(payload):
+    from flow_runner import run_schema
+
+    return run_schema(payload["schema"], payload["row"], secrets=_Secrets(), owner=payload.get("owner"))
+
+
+def _run_prompt_job(payload):
+    from llm import call_llm
+    from token_budget import get_ledger, usage_scopes
+
+    message = call_llm(prompt=payload["prompt"], model=payload["model"],
+                       temperature=payload.get("temperature", 0.7), cache=payload.get("cache"))
+    usage = getattr(message, "usage_metadata", None) or {}
+    get_ledger().record(
+        usage_scopes(payload.get("usage_session"), payload.get("username")), payload["model"],
+        usage.get("input_tokens"), usage.get("output_tokens"),
+        cached=message.response_metadata.get("cached", False))
+    return {
+        "prompt": payload["prompt"],
+        "model": payload["model"],
+        "output": message.content,
+        "usage": usage,
+    }
+
+
+# Job kinds and the functions that run them: payload dict -> JSON-serializable result.
+HANDLERS = {
+    "flow": _run_flow_job,
+    "prompt": _run_prompt_job,
+}
+
+
+class JobQueue(object):
+    """
+    A persistent, prioritized job queue with a pool of worker threads.
+
+    Jobs are dicts with id, kind, owner, label, priority, status ("queued",
+    "running", "done", "error" or "cancelled"), payload, result, error and
+    created/started/finished times. Queued jobs are picked up on start, and
+    running jobs whose lease has expired are queued again, on start and
+    while the workers run.
+    """
+
+    def __init__(self, path=JOB_DB_PATH, workers=JOB_WORKERS, max_per_owner=JOB_MAX_PER_OWNER,
+                 handlers=None, lease=JOB_LEASE):
+        self.path = path
+        self.workers = workers
+        self.max_per_owner = max_per_owner
+        self.handlers = dict(HANDLERS if handlers is None else handlers)
+        self.lease = lease
+        # Identifies this queue's claims among every process sharing the database.
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for name, kind in _ADDED_COLUMNS.items():
+            if name not in columns:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+        self._db.commit()
+        self._db_lock = threading.Lock()
+        self._ready = threading.Condition()
+        self._heap = []  # (priority, sequence, job id, owner)
+        self._sequence = itertools.count()
+        self._running = {}  # owner -> jobs running
+        self._threads = []
+        self._stopping = False
+        self._stopped = threading.Event()
+
+        self._recover()
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT id, owner, priority FROM jobs WHERE status = 'queued' ORDER BY created").fetchall()
+        for job_id, owner, priority in rows:
+            heapq.heappush(self._heap, (priority, next(self._sequence), job_id, owner))
+
+    def _recover(self):
+        """
+        Queues again the running jobs whose lease has expired (or that
+        predate leases), and returns them as (id, owner, priority) rows.
+        """
+        with self._db_lock, self._db:
+            # Taken before reading, so two processes never recover the same job.
+            self._db.execute("BEGIN IMMEDIATE")
+            rows = self._db.execute(
+                "SELECT id, owner, priority FROM jobs WHERE status = 'running' "
+                "AND (lease_until IS NULL OR lease_until < ?) ORDER BY created", (time.time(),)).fetchall()
+            self._db.executemany(
+                "UPDATE jobs SET status = 'queued', started = NULL, worker = NULL, lease_until = NULL "
+                "WHERE id = ?", [(row[0],) for row in rows])
+        for job_id, _, _ in rows:
+            logger.warning(f"Job {job_id} lost its worker; queued again")
+        return rows
+
+    def _renew(self):
+        # Extends this queue's leases, and takes over jobs whose worker is gone.
+        while not self._stopped.wait(self.lease / 3):
+            with self._db_lock, self._db:
+                self._db.execute(
+                    "UPDATE jobs SET lease_until = ? WHERE worker = ? AND status = 'running'",
+                    (time.time() + self.lease, self.worker_id))
+            rows = self._recover()
+            if rows:
+                with self._ready:
+                    for job_id, owner, priority in rows:
+                        heapq.heappush(self._heap, (priority, next(self._sequence), job_id, owner))
+                    self._ready.notify_all()
+
+    def start(self):
+        """Starts the worker threads, if they are not running yet."""
+        with self._ready:
+            if self._threads:
+                return self
+            self._stopping = False
+            self._stopped.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._renew, name="job-leases", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        """Stops the workers once their current jobs finish; queued jobs stay queued."""
+        with self._ready:
+            self._stopping = True
+            self._ready.notify_all()
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, kind, payload, owner=None, label=None, priority=PRIORITY_DEFAULT):
+        """
+        Queues a job.
+
+        Args:
+            kind (str): A key of `handlers`, e.g. "flow" or "prompt"
+            payload (dict): JSON-serializable job input
+            owner (str): Who the job belongs to (a username or client id)
+            label (str): Short description for listings
+            priority (int): Lower runs first, e.g. PRIORITY_PREMIUM
+
+        Returns:
+            str: The job id
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, owner, label, priority, status, payload, created) "
+                "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, owner, label, priority, json.dumps(payload, default=str), time.time()))
+        with self._ready:
+            heapq.heappush(self._heap, (priority, next(self._sequence), job_id, owner))
+            self._ready.notify()
+        return job_id
+
+    def _record(self, row):
+        job = dict(zip(_COLUMNS, row))
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def get(self, job_id):
+        """Returns a job by id, or None."""
+        with self._db_lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._record(row) if row else None
+
+    def jobs(self, owner, limit=20):
+        """Returns an owner's most recent jobs, newest first."""
+        with self._db_lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE owner = ? "
+                "ORDER BY created DESC LIMIT ?", (owner, limit)).fetchall()
+        return [self._record(row) for row in rows]
+
+    def cancel(self, job_id):
+        """
+        Cancels a job that has not started yet.
+
+        Returns:
+            bool: Whether the job was cancelled
+        """
+        with self._ready:
+            with self._db_lock, self._db:
+                cancelled = self._db.execute(
+                    "UPDATE jobs SET status = 'cancelled', finished = ? "
+                    "WHERE id = ? AND status = 'queued'", (time.time(), job_id)).rowcount
+            if cancelled:
+                self._heap = [entry for entry in self._heap if entry[2] != job_id]
+                heapq.heapify(self._heap)
+        return bool(cancelled)
+
+    def wait(self, job_id, timeout=None, poll=0.05):
+        """Blocks until a job finishes (or the timeout passes) and returns it."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] not in ACTIVE_STATUSES:
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(poll)
+
+    def stats(self):
+        """Returns the number of queued and running jobs."""
+        with self._ready:
+            return {"queued": len(self._heap), "running": sum(self._running.values())}
+
+    def _next_job(self):
+        # Highest priority job whose owner is under the per-owner limit.
+        for entry in sorted(self._heap):
+            owner = entry[3]
+            if self._running.get(owner, 0) < self.max_per_owner:
+                self._heap.remove(entry)
+                heapq.heapify(self._heap)
+                self._running[owner] = self._running.get(owner, 0) + 1
+                return entry
+        return None
+
+    def _work(self):
+        while True:
+            with self._ready:
+                entry = None
+                while not self._stopping and entry is None:
+                    entry = self._next_job()
+                    if entry is None:
+                        self._ready.wait()
+                if entry is None:
+                    return
+            _, _, job_id, owner = entry
+            try:
+                self._execute(job_id)
+            finally:
+                with self._ready:
+                    self._running[owner] -= 1
+                    if not self._running[owner]:
+                        del self._running[owner]
+                    # A job of this owner may have been held back by the limit.
+                    self._ready.notify_all()
+
+    def _execute(self, job_id):
+        now = time.time()
+        with self._db_lock, self._db:
+            started = self._db.execute(
+                "UPDATE jobs SET status = 'running', started = ?, worker = ?, lease_until = ? "
+                "WHERE id = ? AND status = 'queued'",
+                (now, self.worker_id, now + self.lease, job_id)).rowcount
+            row = self._db.execute("SELECT kind, payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not started:
+            return  # Cancelled, or claimed by another process, meanwhile
+        kind, payload = row
+        try:
+            result = self.handlers[kind](json.loads(payload))
+        except Exception as e:
+            logger.exception(f"Job {job_id} ({kind}) failed")
+            status, result, error = "error", None, str(e)
+        else:
+            status, result, error = "done", json.dumps(result, default=str), None
+        with self._db_lock, self._db:
+            kept = self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, lease_until = NULL "
+                "WHERE id = ? AND worker = ?",
+                (status, result, error, time.time(), job_id, self.worker_id)).rowcount
+        if not kept:
+            logger.warning(f"Job {job_id} lost its lease while running; its result was discarded")
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Returns the process-wide JobQueue (see JOB_DB_PATH), with its workers started."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue().start()
+        return _queue
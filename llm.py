@@ -1,15 +1,792 @@
+import logging
+import os
+import queue
+import statistics
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from botocore.config import Config
 from langchain_aws import ChatBedrock
+from langchain_core.messages import AIMessage
+
+from model_catalog import estimate_cost, get_model
+from rate_limit import get_limiter
+from response_cache import get_cache, make_key
+from single_flight import SingleFlight
+from token_budget import fit_prompt, format_cost
+from tracing import end_span, span, start_span, use_context
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "anthropic.claude-3-sonnet-20240229-v1:0"
+SYSTEM_PROMPT = "You are a helpful assistant"
+
+# Upper bound on the number of ChatBedrock clients kept alive at once.
+# Each client holds a boto3 session and its own HTTPS connection pool.
+MAX_CLIENTS = int(os.environ.get("LLM_MAX_CLIENTS", "16"))
+
+# Throttled requests are retried through the model's AdaptiveLimiter (see
+# rate_limit.get_limiter) rather than by botocore, so the limiter sees every
+# throttle and can slow down.
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "8"))
+THROTTLING_ERRORS = {"ThrottlingException", "TooManyRequestsException"}
+
+# Process-wide client registry. Module globals survive Streamlit reruns, so
+# every session and every rerun shares the same warm clients.
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+
+# Identical requests made while one is already in flight share its response
+# (see single_flight). Like caching, this only applies to requests whose
+# response may be reused: temperature 0, or cache=True. Sampled requests
+# each get their own completion. Set LLM_COALESCE=0 to send every request
+# separately.
+COALESCE = os.environ.get("LLM_COALESCE", "1") != "0"
+_invoke_flights = SingleFlight()
+_stream_flights = SingleFlight()
+
+# Timing records for the most recent streamed calls, newest last.
+_call_stats = deque(maxlen=int(os.environ.get("LLM_STATS_HISTORY", "200")))
+
+# Routing policies for stream_routed.
+ROUTE_SINGLE = "single"
+ROUTE_FALLBACK = "fallback"
+ROUTE_HEDGED = "hedged"
+# A hedged request goes to the next route once the current one has gone
+# this quantile of its model's measured time to first token without one.
+HEDGE_QUANTILE = float(os.environ.get("LLM_HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", "5"))
+# With fallback routing, seconds to wait for a first token before a stalled
+# request is abandoned for the next route.
+FIRST_TOKEN_TIMEOUT = float(os.environ.get("LLM_FIRST_TOKEN_TIMEOUT", "30"))
+
+
+def _client_key(model, region, max_tokens, model_kwargs):
+    return (model, region, max_tokens, tuple(sorted(model_kwargs.items())))
+
 
-def call_llm(prompt: str, model="anthropic.claude-3-sonnet-20240229-v1:0", temperature=0.7) -> str:
-    llm = ChatBedrock(
+def _build_client(model, region, max_tokens, model_kwargs):
+    kwargs = {}
+    if region:
+        kwargs["region_name"] = region
+    # Lets benchmarks and local development point at a stub Bedrock endpoint.
+    endpoint_url = os.environ.get("BEDROCK_ENDPOINT_URL")
+    if endpoint_url:
+        kwargs["endpoint_url"] = endpoint_url
+    max_concurrency = (get_model(model)["max_concurrency"]
+                       or int(os.environ.get("LLM_MAX_CONCURRENCY", "16")))
+    return ChatBedrock(
         model_id=model,
-        model_kwargs=dict(temperature=temperature),
-        # other params...
+        # A top-level field, so the adapter sends it under each provider's
+        # own name (max_gen_len, maxTokenCount, ...).
+        max_tokens=max_tokens,
+        model_kwargs=dict(model_kwargs),
+        config=Config(
+            retries={"mode": "standard", "total_max_attempts": 1},
+            # botocore's default pool of 10 would cap concurrent requests;
+            # leave headroom for connections still being returned to the pool.
+            max_pool_connections=2 * max_concurrency,
+        ),
+        **kwargs,
     )
 
-    messages = [
-        ("system", "You are a helpful assistant"),
+
+def get_client(model=DEFAULT_MODEL, region=None, max_tokens=None, **model_kwargs) -> ChatBedrock:
+    """
+    Return a shared ChatBedrock client, building it on first use.
+
+    Clients are keyed by (model, region, max_tokens, model_kwargs) and the
+    least recently used one is dropped once more than MAX_CLIENTS are
+    registered.
+
+    Args:
+        model (str): Bedrock model id
+        region (str): AWS region, or None for the default resolution chain
+        max_tokens (int): Completion length limit, or None for the model's
+        **model_kwargs: Model parameters such as temperature
+
+    Returns:
+        ChatBedrock: A client that is safe to share between threads
+    """
+    key = _client_key(model, region, max_tokens, model_kwargs)
+    with _clients_lock:
+        llm = _clients.get(key)
+        if llm is not None:
+            _clients.move_to_end(key)
+            return llm
+
+    # Build outside the lock so a slow credential lookup for one model does
+    # not stall callers that already have a warm client.
+    llm = _build_client(model, region, max_tokens, model_kwargs)
+
+    with _clients_lock:
+        existing = _clients.get(key)
+        if existing is not None:
+            _clients.move_to_end(key)
+            return existing
+        _clients[key] = llm
+        while len(_clients) > MAX_CLIENTS:
+            _clients.popitem(last=False)
+    return llm
+
+
+def clear_clients():
+    """Drop every cached client so the next call builds a fresh one."""
+    with _clients_lock:
+        _clients.clear()
+
+
+def _model_setup(model, region, temperature):
+    """Returns the client and limiter for a model, set up from its catalog entry."""
+    spec = get_model(model)
+    llm = get_client(model=model, region=region, max_tokens=spec["max_tokens"], temperature=temperature)
+    limiter = get_limiter(model, max_concurrency=spec["max_concurrency"], max_rate=spec["max_rate"])
+    return llm, limiter
+
+
+def _build_messages(prompt):
+    return [
+        ("system", SYSTEM_PROMPT),
         ("human", prompt),
     ]
-    ai_msg = llm.invoke(messages)
-    return ai_msg
\ No newline at end of file
+
+
+def _cache_key(prompt, model, temperature, region):
+    """Content address of a request: everything that determines the response."""
+    return make_key(prompt=prompt, system=SYSTEM_PROMPT, model=model,
+                    temperature=temperature, region=region, max_tokens=get_model(model)["max_tokens"])
+
+
+def _should_cache(temperature, cache):
+    # Only deterministic settings are cached by default; callers can opt in
+    # for sampled responses (or opt out entirely) with cache=True/False.
+    if cache is None:
+        return temperature == 0
+    return cache
+
+
+def _chunk_text(chunk):
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    # Anthropic message chunks may arrive as a list of content blocks.
+    return "".join(
+        block.get("text", "") if isinstance(block, dict) else str(block)
+        for block in content
+    )
+
+
+def _is_throttled(error):
+    response = getattr(error, "response", None) or {}
+    code = response.get("Error", {}).get("Code")
+    return code in THROTTLING_ERRORS or any(name in str(error) for name in THROTTLING_ERRORS)
+
+
+def _record_usage(trace, message):
+    """Copies a response's token counts onto its llm span."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    for field in ("input_tokens", "output_tokens"):
+        if usage.get(field):
+            trace["attributes"][field] = usage[field]
+
+
+@contextmanager
+def _phase(trace, name, total, **attributes):
+    """
+    Times one step of a model call as a child span of `trace` and adds its
+    duration to trace["attributes"][total] (e.g. queue_wait or network_time).
+    """
+    child = start_span(name, "llm." + name, parent=(trace["trace_id"], trace["span_id"]),
+                       detached=True, **attributes)
+    try:
+        yield child
+    except BaseException as e:
+        end_span(child, error=e)
+        raise
+    else:
+        end_span(child)
+    finally:
+        elapsed = (child["end_ns"] - child["start_ns"]) / 1e9
+        trace["attributes"][total] = trace["attributes"].get(total, 0.0) + elapsed
+
+
+def _preflight(prompt, model, budget, trace):
+    """Fits the prompt to the model's token budget before anything is sent."""
+    prompt, fit = fit_prompt(prompt, model, budget)
+    trace["attributes"].update(estimated_input_tokens=fit["estimated_tokens"],
+                               truncated=fit["truncated"])
+    return prompt, fit
+
+
+def _llm_span(model, mode, temperature):
+    # Detached: acall_llm coroutines and stream_llm generators interleave on
+    # one thread, so the span must not sit on that thread's span stack.
+    return span(model, "llm", detached=True, model=model, mode=mode, temperature=temperature,
+                cached=False, attempts=0, throttles=0, queue_wait=0.0, network_time=0.0)
+
+
+def _invoke(prompt, model, temperature, region, trace):
+    """Sends one request, retrying throttled attempts through the model's limiter."""
+    llm, limiter = _model_setup(model, region, temperature)
+    attributes = trace["attributes"]
+    for attempt in range(MAX_RETRIES + 1):
+        with _phase(trace, "queue", "queue_wait"):
+            limiter.acquire()
+        attributes["attempts"] += 1
+        throttled = False
+        try:
+            with _phase(trace, "request", "network_time", attempt=attempt):
+                return llm.invoke(_build_messages(prompt))
+        except Exception as e:
+            throttled = _is_throttled(e)
+            if not throttled or attempt == MAX_RETRIES:
+                raise
+            attributes["throttles"] += 1
+        finally:
+            limiter.release(throttled=throttled)
+
+
+async def _ainvoke(prompt, model, temperature, region, trace):
+    """Async counterpart of _invoke."""
+    llm, limiter = _model_setup(model, region, temperature)
+    attributes = trace["attributes"]
+    for attempt in range(MAX_RETRIES + 1):
+        with _phase(trace, "queue", "queue_wait"):
+            await limiter.acquire_async()
+        attributes["attempts"] += 1
+        throttled = False
+        try:
+            with _phase(trace, "request", "network_time", attempt=attempt):
+                return await llm.ainvoke(_build_messages(prompt))
+        except Exception as e:
+            throttled = _is_throttled(e)
+            if not throttled or attempt == MAX_RETRIES:
+                raise
+            attributes["throttles"] += 1
+        finally:
+            limiter.release(throttled=throttled)
+
+
+def _stream_request(prompt, model, temperature, region, trace):
+    """
+    Streams one request's message chunks. A throttled request is retried
+    through the model's limiter as long as nothing has been received yet.
+    """
+    llm, limiter = _model_setup(model, region, temperature)
+    attributes = trace["attributes"]
+    received = False
+    for attempt in range(MAX_RETRIES + 1):
+        with _phase(trace, "queue", "queue_wait"):
+            limiter.acquire()
+        attributes["attempts"] += 1
+        throttled = False
+        try:
+            # Covers the whole stream, including time the consumer
+            # spends between chunks.
+            with _phase(trace, "request", "network_time", attempt=attempt):
+                for chunk in llm.stream(_build_messages(prompt)):
+                    received = True
+                    yield chunk
+            return
+        except Exception as e:
+            # Throttling is reported before the first chunk; a stream
+            # that fails midway cannot be retried transparently.
+            throttled = _is_throttled(e) and not received
+            if not throttled or attempt == MAX_RETRIES:
+                raise
+            attributes["throttles"] += 1
+        finally:
+            limiter.release(throttled=throttled)
+
+
+def _shared_message(trace, message):
+    """
+    A response shared from another caller's identical request. Like a cached
+    response it is marked cached, so it is not counted as a second model call.
+    """
+    trace["attributes"]["cached"] = trace["attributes"]["coalesced"] = True
+    return message.model_copy(update={
+        "response_metadata": dict(message.response_metadata, cached=True, coalesced=True)})
+
+
+def call_llm(prompt: str, model=DEFAULT_MODEL, temperature=0.7, region=None, cache=None,
+             budget=None) -> AIMessage:
+    """
+    Sends a prompt to a Bedrock model through its shared client and returns
+    the whole response.
+
+    Throttled requests are retried with backoff under the model's
+    AdaptiveLimiter (see get_limiter). Identical concurrent calls share a
+    single request when their response may be cached (see COALESCE); the
+    response of a shared call is marked cached and coalesced in its
+    response_metadata, and one served from the response cache is marked
+    cached.
+
+    Args:
+        prompt (str): The user prompt
+        model (str): Bedrock model id
+        temperature (float): Sampling temperature
+        region (str): AWS region, or None for the default resolution chain
+        cache (bool): Force (True) or bypass (False) the response cache;
+            by default only temperature 0 responses are cached
+        budget (int): Prompt token budget; longer prompts are truncated
+            (see token_budget.fit_prompt). Defaults to the model's.
+
+    Returns:
+        AIMessage: The model response; its text is in `content`
+    """
+    with _llm_span(model, "invoke", temperature) as trace:
+        prompt, _ = _preflight(prompt, model, budget, trace)
+        key = _cache_key(prompt, model, temperature, region) if _should_cache(temperature, cache) else None
+        if key:
+            cached = get_cache().get(key)
+            if cached is not None:
+                trace["attributes"]["cached"] = True
+                return AIMessage(content=cached["text"], response_metadata={"cached": True})
+
+        request = lambda: _invoke(prompt, model, temperature, region, trace)
+        if not COALESCE or key is None:
+            ai_msg, shared = request(), False
+        else:
+            ai_msg, shared = _invoke_flights.do(key, request)
+        _record_usage(trace, ai_msg)
+        if shared:
+            return _shared_message(trace, ai_msg)
+        if key:
+            get_cache().set(key, {"text": _chunk_text(ai_msg)})
+        return ai_msg
+
+
+async def acall_llm(prompt: str, model=DEFAULT_MODEL, temperature=0.7, region=None, cache=None,
+                    budget=None):
+    """
+    Async counterpart of call_llm built on ChatBedrock.ainvoke.
+
+    Concurrent calls for the same model share its AdaptiveLimiter, so
+    `asyncio.gather` over many prompts keeps as many requests in flight as
+    the account quota allows and backs off when Bedrock throttles.
+    ChatBedrock runs the request in the event loop's default executor, whose
+    size also bounds how many calls are truly in flight. Identical calls on
+    one event loop share a single request when their response may be cached
+    (see COALESCE); the response of a shared call is marked cached and
+    coalesced in its response_metadata.
+
+    Args:
+        prompt (str): The user prompt
+        model (str): Bedrock model id
+        temperature (float): Sampling temperature
+        region (str): AWS region, or None for the default resolution chain
+        cache (bool): Force (True) or bypass (False) the response cache;
+            by default only temperature 0 responses are cached
+        budget (int): Prompt token budget; longer prompts are truncated
+            (see token_budget.fit_prompt). Defaults to the model's.
+
+    Returns:
+        AIMessage: The model response
+    """
+    with _llm_span(model, "ainvoke", temperature) as trace:
+        prompt, _ = _preflight(prompt, model, budget, trace)
+        key = _cache_key(prompt, model, temperature, region) if _should_cache(temperature, cache) else None
+        if key:
+            cached = get_cache().get(key)
+            if cached is not None:
+                trace["attributes"]["cached"] = True
+                return AIMessage(content=cached["text"], response_metadata={"cached": True})
+
+        request = lambda: _ainvoke(prompt, model, temperature, region, trace)
+        if not COALESCE or key is None:
+            ai_msg, shared = await request(), False
+        else:
+            ai_msg, shared = await _invoke_flights.ado(key, request)
+        _record_usage(trace, ai_msg)
+        if shared:
+            return _shared_message(trace, ai_msg)
+        if key:
+            get_cache().set(key, {"text": _chunk_text(ai_msg)})
+        return ai_msg
+
+
+def stream_llm(prompt: str, model=DEFAULT_MODEL, temperature=0.7, region=None, stats=None, cache=None,
+               budget=None):
+    """
+    Streaming counterpart of call_llm that yields text chunks as they arrive.
+
+    The stream holds one of the model's limiter slots (see get_limiter) until
+    it ends, and a throttled request is retried before any text is yielded.
+
+    Once the stream ends (or the consumer stops early) a timing record is
+    appended to the shared history returned by get_call_stats. Tokens per
+    second is measured from the first token, so it reflects generation speed
+    rather than queueing. Cached responses are yielded as a single chunk.
+    The record also carries input and output token counts (reported by the
+    model, else estimated), the call's cost, and whether the prompt had to
+    be truncated to fit the model's budget.
+
+    Identical streams requested while one is in flight share it, when their
+    response may be cached (see COALESCE): every caller receives all of its
+    chunks, and the callers that joined are recorded as cached and coalesced.
+
+    Args:
+        prompt (str): The user prompt
+        model (str): Bedrock model id
+        temperature (float): Sampling temperature
+        region (str): AWS region, or None for the default resolution chain
+        stats (dict): Optional dict that is filled in with the timing record
+        cache (bool): Force (True) or bypass (False) the response cache;
+            by default only temperature 0 responses are cached
+        budget (int): Prompt token budget; longer prompts are truncated
+            (see token_budget.fit_prompt). Defaults to the model's.
+
+    Yields:
+        str: Text chunks of the completion
+    """
+    record = {
+        "model": model,
+        "ttft": None,
+        "total_time": None,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "tokens_per_sec": None,
+        "cost": 0.0,
+        "cached": False,
+        "coalesced": False,
+        "truncated": False,
+    }
+    chunk_count = 0
+    usage_tokens = None
+    start = time.perf_counter()
+    with _llm_span(model, "stream", temperature) as trace:
+        attributes = trace["attributes"]
+        prompt, fit = _preflight(prompt, model, budget, trace)
+        record["truncated"] = fit["truncated"]
+        key = _cache_key(prompt, model, temperature, region) if _should_cache(temperature, cache) else None
+        try:
+            cached = get_cache().get(key) if key else None
+            if cached is not None:
+                record["cached"] = attributes["cached"] = True
+                record["ttft"] = time.perf_counter() - start
+                usage_tokens = cached.get("output_tokens")
+                chunk_count = 1
+                yield cached["text"]
+                return
+
+            request = lambda: _stream_request(prompt, model, temperature, region, trace)
+            if not COALESCE or key is None:
+                chunks, shared = request(), False
+            else:
+                chunks, shared = _stream_flights.stream(key, request)
+            if shared:
+                record["cached"] = record["coalesced"] = True
+                attributes["cached"] = attributes["coalesced"] = True
+            parts = []
+            for chunk in chunks:
+                usage = getattr(chunk, "usage_metadata", None)
+                if usage and usage.get("input_tokens"):
+                    attributes["input_tokens"] = usage["input_tokens"]
+                if usage and usage.get("output_tokens"):
+                    usage_tokens = usage["output_tokens"]
+                text = _chunk_text(chunk)
+                if not text:
+                    continue
+                if record["ttft"] is None:
+                    record["ttft"] = time.perf_counter() - start
+                chunk_count += 1
+                parts.append(text)
+                yield text
+
+            # Only complete responses are cached, by the caller that made the request.
+            if key and not shared:
+                get_cache().set(key, {"text": "".join(parts), "output_tokens": usage_tokens})
+        finally:
+            record["total_time"] = time.perf_counter() - start
+            # Fall back to the chunk count when the model reports no usage.
+            record["output_tokens"] = usage_tokens or chunk_count
+            record["input_tokens"] = attributes.get("input_tokens") or fit["estimated_tokens"]
+            if not record["cached"]:
+                record["cost"] = estimate_cost(model, record["input_tokens"], record["output_tokens"]) or 0.0
+            if record["ttft"] is not None:
+                generation_time = record["total_time"] - record["ttft"]
+                if generation_time > 0:
+                    record["tokens_per_sec"] = record["output_tokens"] / generation_time
+            attributes["output_tokens"] = record["output_tokens"]
+            attributes["ttft"] = record["ttft"]
+            _call_stats.append(record)
+            if stats is not None:
+                stats.update(record)
+
+
+def stream_many(prompt: str, models, temperature=0.7, region=None, stats=None, cache=None, budget=None):
+    """
+    Streams one prompt from several models at once.
+
+    Each model is streamed by stream_llm on its own thread, so the whole
+    call takes about as long as the slowest model rather than the sum.
+    Chunks are yielded as they arrive, tagged with their model. A model
+    that fails does not stop the others; its error is recorded instead.
+    If the consumer stops early, the remaining streams are abandoned.
+
+    Args:
+        prompt (str): The user prompt
+        models (list): Bedrock model ids
+        stats (dict): Optional dict that is filled in with each model's
+            timing record (see stream_llm), plus "error" if it failed
+        temperature, region, cache, budget: As for stream_llm
+
+    Yields:
+        tuple: (model id, text chunk)
+    """
+    models = list(dict.fromkeys(models))
+    events = queue.Queue()
+    finished = object()
+    stop = threading.Event()
+    trace = start_span("llm fan-out", "llm", detached=True, models=len(models))
+    context = (trace["trace_id"], trace["span_id"])
+
+    def run(model):
+        record = {}
+        try:
+            with use_context(context):
+                for chunk in stream_llm(prompt=prompt, model=model, temperature=temperature, region=region,
+                                        stats=record, cache=cache, budget=budget):
+                    if stop.is_set():
+                        break
+                    events.put((model, chunk))
+        except Exception as e:
+            record["error"] = str(e)
+        finally:
+            if stats is not None:
+                stats[model] = dict(record, model=model)
+            events.put((model, finished))
+
+    for model in models:
+        threading.Thread(target=run, args=(model,), name=f"stream-{model}", daemon=True).start()
+    try:
+        pending = len(models)
+        while pending:
+            model, chunk = events.get()
+            if chunk is finished:
+                pending -= 1
+            else:
+                yield model, chunk
+    finally:
+        stop.set()
+        end_span(trace)
+
+
+def hedge_delay(model, quantile=HEDGE_QUANTILE, min_samples=HEDGE_MIN_SAMPLES):
+    """
+    Seconds to wait for a model's first token before hedging: the given
+    quantile of its measured times to first token, or, with fewer than
+    `min_samples` uncached calls on record, the catalog's latency_p50.
+    """
+    samples = [record["ttft"] for record in list(_call_stats)
+               if record["model"] == model and not record["cached"] and record["ttft"] is not None]
+    if len(samples) >= max(min_samples, 2):
+        return statistics.quantiles(samples, n=100, method="inclusive")[min(max(round(quantile * 100), 1), 99) - 1]
+    return get_model(model)["latency_p50"] or FIRST_TOKEN_TIMEOUT
+
+
+def stream_routed(prompt: str, routes, policy=ROUTE_FALLBACK, temperature=0.7, stats=None, cache=None,
+                  budget=None, hedge_after=None, first_token_timeout=FIRST_TOKEN_TIMEOUT):
+    """
+    Streams a prompt from the first of several routes (model, region) to
+    answer, for blocks that must not hang on one slow or throttled model.
+
+    With ROUTE_FALLBACK the routes are tried in order: the next one starts
+    when the current one fails (throttled past its retries, or any other
+    error) or goes `first_token_timeout` seconds without a first token.
+    With ROUTE_HEDGED the next route also starts, without stopping the
+    current one, after `hedge_after` seconds (default: hedge_delay of the
+    route's model), or at most `first_token_timeout`, without a first
+    token; whichever answers first is streamed and the others are
+    abandoned. ROUTE_SINGLE uses the first
+    route alone, like stream_llm. A route that has started streaming is
+    kept: an error midway through its answer is raised.
+
+    Args:
+        prompt (str): The user prompt
+        routes (list): Model ids or (model id, region) pairs, primary first
+        policy (str): ROUTE_SINGLE, ROUTE_FALLBACK or ROUTE_HEDGED
+        stats (dict): Optional dict that is filled in with the answering
+            route's timing record (see stream_llm), plus region, policy,
+            hedged (a second route was started), fallback (a route other
+            than the primary answered) and attempts (one dict per route
+            started: model, region, outcome, error and its timing record
+            so far; abandoned routes may still be finishing)
+        temperature, cache, budget: As for stream_llm
+        hedge_after (float): Seconds before hedging, for ROUTE_HEDGED
+        first_token_timeout (float): Seconds before falling back, and
+            the longest ROUTE_HEDGED waits before hedging
+
+    Yields:
+        str: Text chunks of the completion
+
+    Raises:
+        ValueError: If `routes` is empty
+    """
+    routes = [(route, None) if isinstance(route, str) else tuple(route) for route in routes]
+    routes = list(dict.fromkeys(routes))
+    if not routes:
+        raise ValueError("stream_routed needs at least one route")
+    if policy == ROUTE_SINGLE:
+        routes = routes[:1]
+    events = queue.Queue()
+    finished = object()
+    stops = []
+    records = []
+    launched = []
+    outcomes = {}
+    winner = None
+    trace = start_span("llm routing", "llm", detached=True, policy=policy, routes=len(routes))
+    context = (trace["trace_id"], trace["span_id"])
+
+    def run(index):
+        model, region = routes[index]
+        try:
+            with use_context(context):
+                for chunk in stream_llm(prompt=prompt, model=model, temperature=temperature, region=region,
+                                        stats=records[index], cache=cache, budget=budget):
+                    if stops[index].is_set():
+                        return
+                    events.put((index, chunk))
+        except Exception as e:
+            events.put((index, e))
+        else:
+            events.put((index, finished))
+
+    def launch():
+        index = len(launched)
+        stops.append(threading.Event())
+        records.append({})
+        launched.append(time.monotonic())
+        threading.Thread(target=run, args=(index,), name=f"route-{routes[index][0]}", daemon=True).start()
+
+    def next_launch():
+        # When the next route should start if no first token arrives first.
+        if winner is not None or len(launched) >= len(routes):
+            return None
+        if policy == ROUTE_HEDGED:
+            delay = hedge_after if hedge_after is not None else hedge_delay(routes[len(launched) - 1][0])
+            # Never wait longer than falling back would.
+            delay = min(delay, first_token_timeout)
+        else:
+            delay = first_token_timeout
+        return launched[-1] + delay
+
+    try:
+        launch()
+        while True:
+            deadline = next_launch()
+            try:
+                index, item = events.get(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                if policy == ROUTE_FALLBACK:
+                    stops[-1].set()
+                    outcomes[len(launched) - 1] = ("timeout", f"no first token in {first_token_timeout:.1f}s")
+                launch()
+                continue
+            if index in outcomes:
+                continue
+            if isinstance(item, Exception):
+                outcomes[index] = ("failed", str(item))
+                if index == winner:
+                    raise item
+                logger.warning(f"Route {routes[index][0]} failed before answering: {item}")
+                if len(launched) < len(routes):
+                    launch()
+                elif len(outcomes) == len(launched):
+                    raise item
+                continue
+            if winner is None:
+                winner = index
+                for other, stop in enumerate(stops):
+                    if other != index:
+                        stop.set()
+                        outcomes.setdefault(other, ("abandoned", None))
+            if item is finished:
+                break
+            yield item
+    finally:
+        for stop in stops:
+            stop.set()
+        if winner is not None:
+            outcomes.setdefault(winner, ("answered", None))
+        model, region = routes[winner if winner is not None else 0]
+        trace["attributes"].update(model=model, hedged=policy == ROUTE_HEDGED and len(launched) > 1,
+                                   fallback=bool(winner))
+        end_span(trace)
+        if stats is not None:
+            stats.update(records[winner] if winner is not None else {})
+            stats.update(
+                model=model, region=region, policy=policy,
+                hedged=policy == ROUTE_HEDGED and len(launched) > 1,
+                fallback=bool(winner),
+                attempts=[
+                    dict(records[index], model=routes[index][0], region=routes[index][1],
+                         outcome=outcomes.get(index, ("running", None))[0],
+                         error=outcomes.get(index, (None, None))[1])
+                    for index in range(len(launched))
+                ],
+            )
+
+
+def coalescing_stats():
+    """
+    Returns, for invoke and stream calls, how many went through request
+    coalescing, how many shared another caller's request, and how many
+    requests are in flight.
+    """
+    return {"invoke": _invoke_flights.stats(), "stream": _stream_flights.stats()}
+
+
+def get_call_stats(model=None):
+    """
+    Return recorded streaming timings, optionally filtered by model id.
+
+    Returns:
+        list: Dicts with model, ttft, total_time, output_tokens,
+            tokens_per_sec, cached and coalesced
+    """
+    return [dict(r) for r in list(_call_stats) if model is None or r["model"] == model]
+
+
+def observed_latencies(min_samples=3):
+    """
+    Returns the median measured request time per model, for models with at
+    least `min_samples` uncached streaming calls on record.
+    """
+    samples = {}
+    for record in list(_call_stats):
+        if not record["cached"] and record["total_time"] is not None:
+            samples.setdefault(record["model"], []).append(record["total_time"])
+    return {model: statistics.median(times)
+            for model, times in samples.items() if len(times) >= min_samples}
+
+
+def format_call_stats(stats):
+    """
+    Formats a stream_llm timing record as a one-line caption.
+    """
+    if not stats or stats.get("ttft") is None:
+        return ""
+    if stats.get("coalesced"):
+        return f"⚡ Shared an identical in-flight request, done in {stats['total_time']:.2f}s"
+    if stats.get("cached"):
+        return f"⚡ Served from cache in {stats['total_time'] * 1000:.0f} ms"
+    caption = f"⏱️ First token {stats['ttft']:.2f}s · total {stats['total_time']:.2f}s"
+    if stats.get("tokens_per_sec"):
+        caption += f" · {stats['tokens_per_sec']:.1f} tokens/s"
+    if stats.get("input_tokens"):
+        caption += f" · {stats['input_tokens']} → {stats['output_tokens']} tokens"
+    if stats.get("cost"):
+        caption += f" · {format_cost(stats['cost'])}"
+    if stats.get("truncated"):
+        caption += " · ✂️ prompt truncated to fit the model's budget"
+    if stats.get("fallback") or stats.get("hedged"):
+        caption += f" · ↪️ answered by {get_model(stats['model'])['label']}"
+        if stats.get("region"):
+            caption += f" in {stats['region']}"
+        caption += " (hedged)" if stats.get("hedged") else " (fallback)"
+    return caption
@@ -0,0 +1,140 @@
+"""
+The Bedrock models the app offers, loaded from a YAML catalog.
+
+The catalog (models.yaml next to this file, or MODEL_CATALOG_PATH) lists
+each model's id, display label, optional flow block name, default
+max_tokens and prompt budget, concurrency and rate limits, and cost and
+latency metadata. It is re-read when the file changes, so models can be
+added or tuned without code edits.
+"""
+import logging
+import os
+import threading
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+CATALOG_PATH = os.environ.get(
+    "MODEL_CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models.yaml"))
+
+# Every catalog entry has these keys; missing ones default to None.
+FIELDS = ("id", "label", "block", "max_tokens", "context_window", "max_input_tokens",
+          "max_concurrency", "max_rate", "input_cost_per_1k", "output_cost_per_1k", "latency_p50")
+
+_loaded = (None, None, {})  # (path, mtime, catalog)
+_loaded_lock = threading.Lock()
+
+
+def load_catalog(path=CATALOG_PATH):
+    """
+    Reads and validates a model catalog file.
+
+    Returns:
+        dict: model id -> entry dict (see FIELDS), in file order
+
+    Raises:
+        ValueError: If an entry has no id, or ids or block names repeat
+    """
+    with open(path, "r", encoding="utf-8") as handle:
+        data = yaml.safe_load(handle) or {}
+
+    catalog = {}
+    blocks = set()
+    for entry in data.get("models", []):
+        if not entry.get("id"):
+            raise ValueError(f"Model catalog entry without an id: {entry}")
+        unknown = set(entry) - set(FIELDS)
+        if unknown:
+            logger.warning(f"Ignoring unknown model catalog keys for {entry['id']}: {sorted(unknown)}")
+        spec = {field: entry.get(field) for field in FIELDS}
+        spec["label"] = spec["label"] or spec["id"]
+        if spec["id"] in catalog:
+            raise ValueError(f"Model {spec['id']} is listed twice in the catalog")
+        if spec["block"]:
+            if spec["block"] in blocks:
+                raise ValueError(f"Block name {spec['block']} is used by two catalog models")
+            blocks.add(spec["block"])
+        catalog[spec["id"]] = spec
+    return catalog
+
+
+def get_catalog():
+    """Returns the current catalog, re-reading the file if it changed."""
+    global _loaded
+    mtime = os.path.getmtime(CATALOG_PATH)
+    with _loaded_lock:
+        path, loaded_mtime, catalog = _loaded
+        if path != CATALOG_PATH or loaded_mtime != mtime:
+            catalog = load_catalog(CATALOG_PATH)
+            _loaded = (CATALOG_PATH, mtime, catalog)
+        return catalog
+
+
+def catalog_version():
+    """Returns a value that changes whenever the catalog file does."""
+    return os.path.getmtime(CATALOG_PATH)
+
+
+def model_ids():
+    """Returns the catalog's model ids, in file order."""
+    return list(get_catalog())
+
+
+def get_model(model_id):
+    """
+    Returns a model's catalog entry. Models missing from the catalog get an
+    entry with only the id and label set, so any Bedrock id can be used.
+    """
+    spec = get_catalog().get(model_id)
+    if spec is None:
+        spec = dict.fromkeys(FIELDS)
+        spec.update(id=model_id, label=model_id)
+    return spec
+
+
+def estimate_cost(model_id, input_tokens, output_tokens):
+    """
+    Returns the USD cost of a request, or None without cost metadata.
+    """
+    spec = get_model(model_id)
+    if spec["input_cost_per_1k"] is None or spec["output_cost_per_1k"] is None:
+        return None
+    return (input_tokens * spec["input_cost_per_1k"] + output_tokens * spec["output_cost_per_1k"]) / 1000
+
+
+def route_model(latency_budget=None, models=None, observed=None, input_tokens=1000, output_tokens=None):
+    """
+    Picks the cheapest model expected to answer within a latency budget.
+
+    Args:
+        latency_budget (float): Seconds a request may take; None for no limit
+        models (list): Candidate model ids, defaults to the whole catalog
+        observed (dict): Measured median latency by model id, preferred over
+            the catalog's latency_p50 (see llm.observed_latencies)
+        input_tokens (int): Expected prompt size, for the cost estimate
+        output_tokens (int): Expected completion size; defaults to each
+            model's max_tokens
+
+    Returns:
+        str: The chosen model id. When no model meets the budget, the
+            fastest one is returned instead.
+    """
+    observed = observed or {}
+    candidates = []
+    for model_id in models or model_ids():
+        spec = get_model(model_id)
+        latency = observed.get(model_id, spec["latency_p50"])
+        cost = estimate_cost(model_id, input_tokens, output_tokens or spec["max_tokens"] or 1000)
+        candidates.append((model_id, latency, cost))
+    if not candidates:
+        raise ValueError("No models to route between")
+
+    within = [c for c in candidates
+              if latency_budget is None or (c[1] is not None and c[1] <= latency_budget)]
+    if within:
+        # Unknown costs sort last; ties go to the faster model.
+        return min(within, key=lambda c: (c[2] is None, c[2] or 0.0, c[1] or 0.0))[0]
+    fastest = min(candidates, key=lambda c: (c[1] is None, c[1] or 0.0))[0]
+    logger.info(f"No model meets a {latency_budget}s latency budget; using the fastest, {fastest}")
+    return fastest
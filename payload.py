@@ -0,0 +1,246 @@
+"""
+The envelope flow blocks pass data in.
+
+Every block output is a Payload: a kind, the text downstream prompts use,
+small metadata, and optionally a structured body (search results, ranked
+passages, a completion with its prompt). Payloads are immutable, so flows
+and the FlowMemo pass them by reference instead of copying them, and each
+one is serialized at most once, for its digest. Large bodies live in a
+shared, content-addressed BlobStore: identical search results fetched by
+several blocks, runs or sessions are held in memory once.
+"""
+import hashlib
+import json
+import os
+import threading
+import weakref
+
+# Bodies whose serialized size is at least this many characters are kept
+# in the shared BlobStore rather than inline.
+BLOB_MIN_CHARS = int(os.environ.get("PAYLOAD_BLOB_MIN_CHARS", "4096"))
+
+# Payload kinds.
+TEXT = "text"
+COMPLETION = "completion"
+SEARCH = "search"
+PASSAGES = "passages"
+
+
+def _serialize(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str, ensure_ascii=False)
+
+
+class Blob(object):
+    """A large body and its digest; shared by every payload holding it."""
+
+    __slots__ = ("digest", "value", "size", "__weakref__")
+
+    def __init__(self, digest, value, size):
+        self.digest = digest
+        self.value = value
+        self.size = size
+
+
+class BlobStore(object):
+    """
+    Content-addressed store of large payload bodies.
+
+    Holds blobs only while some payload (in a flow, the FlowMemo or a
+    result store) still references them, so it needs no eviction policy.
+    """
+
+    def __init__(self):
+        self._blobs = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self._stats = {"puts": 0, "shared": 0}
+
+    def put(self, value, serialized):
+        """
+        Returns the Blob for a body, reusing the stored one if an identical
+        body is already held.
+        """
+        digest = hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+        with self._lock:
+            self._stats["puts"] += 1
+            blob = self._blobs.get(digest)
+            if blob is not None:
+                self._stats["shared"] += 1
+                return blob
+            blob = self._blobs[digest] = Blob(digest, value, len(serialized))
+            return blob
+
+    def stats(self):
+        """Returns puts, shared (puts that found the body already stored), blobs and chars held."""
+        with self._lock:
+            blobs = list(self._blobs.values())
+            return dict(self._stats, blobs=len(blobs), chars=sum(blob.size for blob in blobs))
+
+
+_blob_store = BlobStore()
+
+
+def get_blob_store():
+    """Returns the process-wide BlobStore."""
+    return _blob_store
+
+
+def _render_item(item):
+    if isinstance(item, dict):
+        if "text" in item and "source" in item:
+            return f"({item['source']}) {item['text']}"
+        if "content" in item:
+            return f"{item['url']}\n{item['content']}" if item.get("url") else str(item["content"])
+        return _serialize(item)
+    return str(item)
+
+
+class Payload(object):
+    """
+    One block output. Immutable: build a new payload rather than changing one.
+
+    `text` is what a downstream prompt receives; for search results and
+    passages it is rendered from the body on first use. `body` is the
+    structured data, if any, and `value` the body or else the text, for
+    inspection. `digest` identifies the content (FlowMemo fingerprints
+    inputs by it) and `size` approximates its rendered length.
+    """
+
+    __slots__ = ("kind", "meta", "_text", "_body", "_blob", "_digest", "_size")
+
+    def __init__(self, kind, text=None, body=None, **meta):
+        self.kind = kind
+        self.meta = meta
+        self._text = text
+        self._body = None
+        self._blob = None
+        self._digest = None
+        self._size = None
+        if body is not None:
+            serialized = _serialize(body)
+            if len(serialized) >= BLOB_MIN_CHARS:
+                self._blob = get_blob_store().put(body, serialized)
+            else:
+                self._body = body
+            self._size = len(serialized) + len(text or "")
+
+    @property
+    def body(self):
+        return self._blob.value if self._blob is not None else self._body
+
+    @property
+    def text(self):
+        if self._text is None:
+            body = self.body
+            items = body if isinstance(body, (list, tuple)) else [] if body is None else [body]
+            self._text = "\n\n".join(_render_item(item) for item in items)
+        return self._text
+
+    @property
+    def value(self):
+        body = self.body
+        return self.text if body is None else body
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = len(self.text)
+        return self._size
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            body = self._blob.digest if self._blob is not None else self._body
+            content = self._text if body is None else None
+            self._digest = hashlib.sha256(
+                _serialize([self.kind, self.meta, content, body]).encode("utf-8")).hexdigest()
+        return self._digest
+
+    def preview(self, limit):
+        """Returns (text, truncated): the text cut to `limit` characters."""
+        text = self.text
+        if len(text) <= limit:
+            return text, False
+        return text[:limit] + "…", True
+
+    def to_json(self):
+        """A JSON-serializable dict with kind, text, meta and (if any) body."""
+        record = {"kind": self.kind, "text": self.text, "meta": self.meta}
+        if self.body is not None:
+            record["body"] = self.body
+        return record
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f"<Payload {self.kind} {self.size:,} chars>"
+
+    def __bool__(self):
+        return bool(self.text) or self.body is not None
+
+    # Immutable, so copies are the payload itself.
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def text_payload(value, **meta):
+    """A plain text payload."""
+    return Payload(TEXT, text=str(value), **meta)
+
+
+def completion_payload(prompt, model, output, **meta):
+    """
+    A model block's output: the completion text, with the prompt and the
+    model that answered in the body. `meta` adds details such as routing.
+    """
+    return Payload(COMPLETION, text=output, body={"input": prompt, "model": model, "output": output},
+                   model=model, **meta)
+
+
+def search_payload(tool, query, results):
+    """A search tool's results: a list of strings or {"url", "content"} dicts."""
+    if isinstance(results, str):
+        results = [results]
+    return Payload(SEARCH, body=list(results), tool=tool, query=query, count=len(results))
+
+
+def passages_payload(query, chunks):
+    """Ranked chunks from a retrieval search (see vector_index.VectorIndex.search)."""
+    rendered = "\n\n".join(f"[{i}] {_render_item(chunk)}" for i, chunk in enumerate(chunks, 1))
+    return Payload(PASSAGES, text=rendered, body=list(chunks), query=query, count=len(chunks))
+
+
+def as_payload(value):
+    """
+    Wraps a value in a Payload, if it is not one already: model output
+    dicts become completions, {"query", "results"} dicts and lists become
+    search results, anything else text. None stays None.
+    """
+    if value is None or isinstance(value, Payload):
+        return value
+    if isinstance(value, dict) and "output" in value:
+        return completion_payload(value.get("input"), value.get("model"), str(value["output"]))
+    if isinstance(value, dict) and "results" in value:
+        return search_payload(None, value.get("query"), value["results"])
+    if isinstance(value, (list, tuple)):
+        return search_payload(None, None, value)
+    return text_payload(value)
+
+
+def from_json(record):
+    """Rebuilds a payload from its to_json() dict."""
+    return Payload(record["kind"], text=record.get("text"), body=record.get("body"), **record.get("meta", {}))
+
+
+def to_jsonable(value):
+    """Replaces payloads nested in dicts, lists and tuples by their to_json()."""
+    if isinstance(value, Payload):
+        return value.to_json()
+    if isinstance(value, dict):
+        return {key: to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    return value
@@ -1,8 +1,169 @@
 import streamlit as st
 import json
-from llm import call_llm
+from llm import format_call_stats, stream_llm, stream_many
+from model_catalog import get_model, model_ids
+from response_cache import get_cache
+from speculation import get_speculator
+from template_batch import parse_rows, results_path, run_template_batch
+from template_engine import TemplateError, compile_template
+from template_store import get_store
+from job_queue import PRIORITY_DEFAULT, PRIORITY_PREMIUM, get_job_queue
+from token_budget import format_cost, format_usage, get_ledger, usage_scopes
 from auth import login_page, logout, login_user  # Import auth functions
+import os
 import time
+import uuid
+
+# Templates shown per page in the Saved Templates tab
+TEMPLATE_PAGE_SIZE = 10
+
+def stream_response(placeholder, prompt, model, temperature=0.7, heading="#### Response:", cache=None):
+    """
+    Streams a completion into a placeholder element as tokens arrive.
+
+    Returns the full response text and the timing record for the call,
+    whose tokens and cost are added to the session's and user's totals.
+    """
+    stats = {}
+    text = ""
+    placeholder.markdown(f"{heading}\n\n_Waiting for first token..._")
+    for chunk in stream_llm(prompt=prompt, model=model, temperature=temperature, stats=stats, cache=cache):
+        text += chunk
+        placeholder.markdown(f"{heading}\n\n{text}▌")
+    placeholder.markdown(f"{heading}\n\n{text}")
+    get_ledger().record(current_usage_scopes(), model, stats.get("input_tokens"),
+                        stats.get("output_tokens"), cached=stats.get("cached", False))
+    return text, stats
+
+
+def compare_responses(prompt, models, temperature=0.7, cache=None):
+    """
+    Streams one prompt from several models concurrently, one column each.
+
+    Returns a dict with each model's output and timing record and the wall
+    time of the whole comparison; tokens and cost are added to the usage
+    totals like any other call.
+    """
+    placeholders = {}
+    for column, model in zip(st.columns(len(models)), models):
+        with column:
+            st.markdown(f"#### {get_model(model)['label']}")
+            placeholders[model] = st.empty()
+            placeholders[model].markdown("_Waiting for first token..._")
+    outputs = dict.fromkeys(models, "")
+    stats = {}
+    start = time.perf_counter()
+    for model, chunk in stream_many(prompt, models, temperature=temperature, stats=stats, cache=cache):
+        outputs[model] += chunk
+        placeholders[model].markdown(f"{outputs[model]}▌")
+    wall_time = time.perf_counter() - start
+    for model in models:
+        record = stats[model]
+        if record.get("error"):
+            placeholders[model].error(record["error"])
+        else:
+            placeholders[model].markdown(outputs[model])
+        get_ledger().record(current_usage_scopes(), model, record.get("input_tokens"),
+                            record.get("output_tokens"), cached=record.get("cached", False))
+    return {"outputs": outputs, "stats": stats, "wall_time": wall_time}
+
+
+def show_comparison(comparison, outputs=True):
+    """
+    Renders a compare_responses result: the outputs side by side (unless
+    they are already on screen) and a table of per-model timings and cost.
+    """
+    models = list(comparison["stats"])
+    if outputs:
+        for column, model in zip(st.columns(len(models)), models):
+            with column:
+                st.markdown(f"#### {get_model(model)['label']}")
+                error = comparison["stats"][model].get("error")
+                if error:
+                    st.error(error)
+                else:
+                    st.markdown(comparison["outputs"][model])
+    rows = []
+    for model in models:
+        record = comparison["stats"][model]
+        rows.append({
+            "Model": get_model(model)["label"],
+            "First token (s)": record.get("ttft"),
+            "Total (s)": record.get("total_time"),
+            "Output tokens": record.get("output_tokens"),
+            "Characters": len(comparison["outputs"][model]),
+            "Tokens/s": record.get("tokens_per_sec"),
+            "Cost": format_cost(record.get("cost") or 0.0),
+            "Status": ("error" if record.get("error") else "shared" if record.get("coalesced")
+                       else "cached" if record.get("cached") else "ok"),
+        })
+    st.dataframe(rows, hide_index=True, use_container_width=True)
+    slowest = max((record.get("total_time") or 0.0 for record in comparison["stats"].values()), default=0.0)
+    st.caption(f"Wall time {comparison['wall_time']:.2f}s · slowest model {slowest:.2f}s")
+
+
+def current_usage_scopes():
+    """Ledger scopes for calls made from this session (see token_budget)."""
+    return usage_scopes(st.session_state.get("usage_session"), st.session_state.get("username"))
+
+
+def current_job_owner():
+    """
+    Who background jobs belong to: the logged-in user, or else a client id
+    kept in the page URL, so jobs can still be found after a reload.
+    """
+    if st.session_state.get("logged_in") and st.session_state.get("username"):
+        return st.session_state["username"]
+    if "client" not in st.query_params:
+        st.query_params["client"] = uuid.uuid4().hex
+    return st.query_params["client"]
+
+
+def submit_job(kind, payload, label):
+    """Queues a background job for this session; premium users' jobs run first."""
+    priority = PRIORITY_PREMIUM if st.session_state.get("premium_status") else PRIORITY_DEFAULT
+    return get_job_queue().submit(kind, payload, owner=current_job_owner(), label=label, priority=priority)
+
+
+def show_background_jobs(limit=10):
+    """
+    Lists this owner's recent background jobs with their results, checking
+    for updates every few seconds while any are still queued or running.
+    """
+    queue = get_job_queue()
+    jobs = queue.jobs(current_job_owner(), limit=limit)
+    if not jobs:
+        st.caption("No background jobs yet.")
+        return
+    active = any(job["status"] in ("queued", "running") for job in jobs)
+
+    @st.fragment(run_every=2 if active else None)
+    def job_list():
+        for job in queue.jobs(current_job_owner(), limit=limit):
+            started = time.strftime("%H:%M:%S", time.localtime(job["created"]))
+            with st.container(border=True):
+                st.markdown(f"**{job['label'] or job['kind']}** · {job['status']} · {started}")
+                if job["status"] == "queued":
+                    if st.button("Cancel", key=f"cancel_job_{job['id']}"):
+                        queue.cancel(job["id"])
+                        st.rerun(scope="fragment")
+                elif job["status"] == "error":
+                    st.error(job["error"])
+                elif job["status"] == "done" and job["kind"] == "prompt":
+                    st.markdown(job["result"]["output"])
+                elif job["status"] == "done":
+                    st.json(job["result"]["final_outputs"], expanded=False)
+
+    job_list()
+
+
+def show_usage():
+    """Shows running token and cost totals for this session and the logged-in user."""
+    ledger = get_ledger()
+    for kind, key in current_usage_scopes():
+        label = "This session" if kind == "session" else f"User {key}"
+        st.markdown(f"{label}: " + format_usage(ledger.totals((kind, key))))
+
 
 def prompt_templates_app():
     """
@@ -38,14 +199,14 @@ def prompt_templates_app():
     """, unsafe_allow_html=True)
     
     # Initialize session state variables if not present
-    if "templates" not in st.session_state:
-        st.session_state["templates"] = {}
     if "active_template" not in st.session_state:
         st.session_state["active_template"] = None
     if "model_output" not in st.session_state:
         st.session_state["model_output"] = ""
     if "final_prompt" not in st.session_state:
         st.session_state["final_prompt"] = ""
+    if "model_stats" not in st.session_state:
+        st.session_state["model_stats"] = {}
     
     # Handle navigation
     if st.sidebar.button("← Back to Main App", use_container_width=True):
@@ -111,11 +272,36 @@ def prompt_templates_app():
             with st.expander("Final Prompt", expanded=False):
                 st.code(st.session_state["final_prompt"], language="markdown")
         
+        # Placeholder that the Generate/Test/Run buttons stream tokens into
+        response_placeholder = st.empty()
         if st.session_state["model_output"]:
-            st.markdown("#### Response:")
-            st.markdown(st.session_state["model_output"])
+            response_placeholder.markdown(f"#### Response:\n\n{st.session_state['model_output']}")
         else:
-            st.info("Generate a response using the controls in the main panel")
+            response_placeholder.info("Generate a response using the controls in the main panel")
+        
+        stats_placeholder = st.empty()
+        stats_placeholder.caption(format_call_stats(st.session_state["model_stats"]))
+        
+        with st.expander("Response Cache", expanded=False):
+            cache_stats = get_cache().stats()
+            st.markdown(
+                f"**Hits:** {cache_stats['hits']} · **Misses:** {cache_stats['misses']} · "
+                f"**Evictions:** {cache_stats['evictions']}  \n"
+                f"**Hit rate:** {cache_stats['hit_rate']:.0%} · "
+                f"**Stored:** {cache_stats['bytes_stored'] / 1024:.1f} KB"
+            )
+            spec_stats = get_speculator().stats()
+            if spec_stats["launched"] or spec_stats["claims"]:
+                st.markdown(
+                    f"**Speculative prefetch:** {spec_stats['hits']} of {spec_stats['claims']} tests served "
+                    f"({spec_stats['hit_rate']:.0%}) · {spec_stats['launched']} sent, "
+                    f"{spec_stats['used']:.0%} used · {spec_stats['tokens']:,} tokens  \n"
+                    f"**Skipped:** {spec_stats['skipped_concurrency']} at the concurrency limit, "
+                    f"{spec_stats['skipped_budget']} over the token budget"
+                )
+
+        with st.expander("Token Usage", expanded=False):
+            show_usage()
     
     # Main content area
     st.markdown("# 🤖 Prompt Engineer Workbench")
@@ -135,7 +321,8 @@ def prompt_templates_app():
         with template_col2:
             model_name = st.selectbox(
                 "Model",
-                ["anthropic.claude-3-sonnet-20240229-v1:0"],
+                model_ids(),
+                format_func=lambda model_id: get_model(model_id)["label"],
                 help="Select the AI model to use for this template"
             )
         
@@ -164,20 +351,56 @@ def prompt_templates_app():
                 min_value=0.0, max_value=1.0, value=0.7, step=0.1,
                 help="Higher values produce more creative but less predictable results"
             )
+            use_cache = st.checkbox(
+                "Cache responses",
+                value=False,
+                help="Reuse stored responses for identical prompts. Always on at temperature 0."
+            )
+            speculate = st.checkbox(
+                "Speculative prefetch",
+                value=False,
+                key="speculative_prefetch",
+                help="Send the prompt in the background once it stops changing, so Test Template "
+                     "returns at once. Uses tokens on prompts you may not test."
+            )
+            
+            # Report the rendered prompt; the speculator sends it once it is stable.
+            speculator = get_speculator()
+            if speculate:
+                try:
+                    speculator.observe(
+                        current_job_owner(),
+                        compile_template(prompt_template).render(json.loads(placeholder_json)),
+                        model_name,
+                        temperature,
+                        scopes=current_usage_scopes()
+                    )
+                except (TemplateError, ValueError, KeyError):
+                    pass
+            else:
+                speculator.cancel(current_job_owner())
             
             st.markdown("#### Template Actions")
             save_col1, save_col2 = st.columns(2)
             
             with save_col1:
                 if st.button("💾 Save Template", use_container_width=True):
-                    if template_name.strip():
-                        st.session_state["templates"][template_name] = {
+                    try:
+                        compile_template(prompt_template)
+                        template_error = None
+                    except TemplateError as e:
+                        template_error = e
+                    if template_error:
+                        st.error(str(template_error))
+                    elif template_name.strip():
+                        version = get_store().save(template_name, {
                             "prompt_template": prompt_template,
                             "placeholder_json": placeholder_json,
                             "model_name": model_name,
                             "temperature": temperature,
-                        }
-                        st.success(f"Template '{template_name}' saved!")
+                            "cache": use_cache,
+                        }, author=st.session_state.get("username"))
+                        st.success(f"Template '{template_name}' saved (version {version})!")
                     else:
                         st.error("Please provide a template name")
             
@@ -185,16 +408,22 @@ def prompt_templates_app():
                 if st.button("🧪 Test Template", use_container_width=True):
                     try:
                         placeholders = json.loads(placeholder_json)
-                        final_prompt = prompt_template.format(**placeholders)
+                        final_prompt = compile_template(prompt_template).render(placeholders)
                         st.session_state["final_prompt"] = final_prompt
                         
-                        with st.spinner("Generating response..."):
-                            output = call_llm(
-                                prompt=final_prompt,
-                                model=model_name,
-                                temperature=temperature
-                            )
-                            st.session_state["model_output"] = output
+                        # A prefetched response is read from the cache (or joined in flight).
+                        prefetched = speculate and speculator.claim(
+                            current_job_owner(), final_prompt, model_name, temperature)
+                        output, stats = stream_response(
+                            response_placeholder,
+                            prompt=final_prompt,
+                            model=model_name,
+                            temperature=temperature,
+                            cache=True if prefetched else use_cache or None
+                        )
+                        st.session_state["model_output"] = output
+                        st.session_state["model_stats"] = stats
+                        stats_placeholder.caption(format_call_stats(stats))
                         
                         st.success("Response generated!")
                     except json.JSONDecodeError:
@@ -203,6 +432,68 @@ def prompt_templates_app():
                         st.error(f"Missing placeholder in parameters: {e}")
                     except Exception as e:
                         st.error(f"Error: {e}")
+        
+        with st.expander("📊 Batch Evaluation", expanded=False):
+            st.markdown("Run this template over a CSV or JSONL file of parameter rows.")
+            rows_file = st.file_uploader("Parameter rows", type=["csv", "jsonl"], key="batch_rows")
+            batch_col1, batch_col2, batch_col3 = st.columns([2, 1, 1])
+            with batch_col1:
+                batch_name = st.text_input(
+                    "Results name",
+                    value="batch_results.jsonl",
+                    help="Rows already completed under this name are skipped, so a stopped batch can be resumed"
+                )
+            with batch_col2:
+                batch_concurrency = st.number_input("Concurrency", min_value=1, max_value=64, value=8)
+            with batch_col3:
+                batch_rate = st.number_input(
+                    "Requests/sec", min_value=0.0, value=0.0, step=1.0,
+                    help="0 means no rate limit"
+                )
+            batch_output = results_path(batch_name, owner=current_job_owner())
+            
+            if st.button("▶️ Run Batch", use_container_width=True, disabled=rows_file is None):
+                try:
+                    fmt = "csv" if rows_file.name.lower().endswith(".csv") else "jsonl"
+                    rows = parse_rows(rows_file.getvalue().decode("utf-8"), fmt)
+                    progress_bar = st.progress(0.0, text="Starting batch...")
+                    
+                    def on_progress(done, total, record):
+                        progress_bar.progress(done / total, text=f"{done}/{total} rows completed")
+                    
+                    result = run_template_batch(
+                        prompt_template,
+                        rows,
+                        batch_output,
+                        models=[model_name],
+                        temperature=temperature,
+                        concurrency=int(batch_concurrency),
+                        rate=batch_rate or None,
+                        progress=on_progress,
+                        usage_scopes=current_usage_scopes()
+                    )
+                    progress_bar.progress(1.0, text="Batch complete")
+                    st.success(
+                        f"Ran {result['total']} rows in {result['elapsed']:.1f}s "
+                        f"({result['skipped']} already completed, skipped)"
+                    )
+                    st.dataframe(
+                        [{"Model": model, **stats} for model, stats in result["models"].items()],
+                        hide_index=True,
+                        use_container_width=True
+                    )
+                except Exception as e:
+                    st.error(f"Error: {e}")
+            
+            if os.path.exists(batch_output):
+                with open(batch_output, "rb") as handle:
+                    st.download_button(
+                        "⬇️ Download results",
+                        data=handle.read(),
+                        file_name=os.path.basename(batch_output),
+                        mime="application/jsonl",
+                        use_container_width=True
+                    )
 
     with tab2:
         st.markdown("### Prompt Testing Lab")
@@ -219,11 +510,26 @@ def prompt_templates_app():
         
         with test_col2:
             st.markdown("#### Test Settings")
-            test_model = st.selectbox(
-                "Model",
-                ["anthropic.claude-3-sonnet-20240229-v1:0"],
-                key="test_model"
+            compare_mode = st.toggle(
+                "Compare models",
+                key="test_compare",
+                help="Send the prompt to several models at once and compare them side by side"
             )
+            if compare_mode:
+                test_models = st.multiselect(
+                    "Models",
+                    model_ids(),
+                    default=model_ids()[:2],
+                    format_func=lambda model_id: get_model(model_id)["label"],
+                    key="test_models"
+                )
+            else:
+                test_model = st.selectbox(
+                    "Model",
+                    model_ids(),
+                    format_func=lambda model_id: get_model(model_id)["label"],
+                    key="test_model"
+                )
             
             test_temp = st.slider(
                 "Temperature", 
@@ -231,46 +537,97 @@ def prompt_templates_app():
                 key="test_temp"
             )
             
+            test_cache = st.checkbox(
+                "Cache responses",
+                value=False,
+                key="test_cache",
+                help="Reuse stored responses for identical prompts. Always on at temperature 0."
+            )
+            
             st.markdown("#### Actions")
-            if st.button("🚀 Generate Response", use_container_width=True):
-                with st.spinner("Generating response..."):
-                    st.session_state["final_prompt"] = test_prompt
-                    output = call_llm(
-                        prompt=test_prompt,
-                        model=test_model,
-                        temperature=test_temp
-                    )
-                    st.session_state["model_output"] = output
-                st.success("Response generated!")
+            generate_clicked = st.button(
+                "🚀 Compare Responses" if compare_mode else "🚀 Generate Response",
+                use_container_width=True,
+                disabled=compare_mode and not test_models
+            )
         
-        if st.session_state.get("model_output"):
+        if compare_mode:
+            st.markdown("#### Comparison:")
+            if generate_clicked:
+                st.session_state["final_prompt"] = test_prompt
+                comparison = compare_responses(
+                    test_prompt,
+                    test_models,
+                    temperature=test_temp,
+                    cache=test_cache or None
+                )
+                st.session_state["model_comparison"] = comparison
+                show_comparison(comparison, outputs=False)
+            elif st.session_state.get("model_comparison"):
+                show_comparison(st.session_state["model_comparison"])
+        else:
             st.markdown("#### Preview:")
             with st.expander("View Response", expanded=True):
-                st.markdown(st.session_state["model_output"])
+                preview_placeholder = st.empty()
+                if st.session_state.get("model_output"):
+                    preview_placeholder.markdown(st.session_state["model_output"])
+        
+            if generate_clicked:
+                st.session_state["final_prompt"] = test_prompt
+                output, stats = stream_response(
+                    preview_placeholder,
+                    prompt=test_prompt,
+                    model=test_model,
+                    temperature=test_temp,
+                    heading="",
+                    cache=test_cache or None
+                )
+                st.session_state["model_output"] = output
+                st.session_state["model_stats"] = stats
+                response_placeholder.markdown(f"#### Response:\n\n{output}")
+                stats_placeholder.caption(format_call_stats(stats))
+                st.success("Response generated!")
 
     with tab3:
         st.markdown("### Template Library")
         
-        if not st.session_state["templates"]:
+        store = get_store()
+        if not store.count():
             st.info("No templates saved yet. Create a new template in the Template Editor tab.")
         else:
-            # Search box for templates
+            # Search box for templates; a new search starts from the first page
             st.text_input("🔍 Search templates", key="template_search", 
-                        placeholder="Type to filter templates...")
+                        placeholder="Search names, prompt text and variables...",
+                        on_change=lambda: st.session_state.update(template_page=0))
+            
+            # Only the current page is fetched from the index and rendered
+            page = st.session_state.get("template_page", 0)
+            page_templates, total = store.search(
+                st.session_state.get("template_search", ""),
+                limit=TEMPLATE_PAGE_SIZE,
+                offset=page * TEMPLATE_PAGE_SIZE
+            )
+            page_count = max(1, -(-total // TEMPLATE_PAGE_SIZE))
+            if page >= page_count:
+                # Deletions elsewhere can leave us past the last page
+                st.session_state["template_page"] = page_count - 1
+                st.rerun()
             
-            search_term = st.session_state.get("template_search", "").lower()
-            filtered_templates = {
-                name: template for name, template in st.session_state["templates"].items()
-                if search_term in name.lower()
-            }
+            if not total:
+                st.info("No templates match your search.")
             
             # Display templates in a grid
             cols = st.columns(2)
-            for idx, (temp_name, temp_data) in enumerate(filtered_templates.items()):
+            for idx, (temp_name, temp_data) in enumerate(page_templates):
                 col = cols[idx % 2]
                 with col:
                     with st.container(border=True):
                         st.markdown(f"**{temp_name}**")
+                        st.caption(
+                            f"Version {temp_data['version']}"
+                            + (f" · saved by {temp_data['author']}" if temp_data.get("author") else "")
+                            + f" · {time.strftime('%Y-%m-%d %H:%M', time.localtime(temp_data['updated']))}"
+                        )
                         st.text_area(
                             "Prompt",
                             value=temp_data["prompt_template"],
@@ -279,6 +636,11 @@ def prompt_templates_app():
                             key=f"view_{temp_name}"
                         )
                         
+                        run_background = st.checkbox(
+                            "Run in background",
+                            key=f"background_{temp_name}",
+                            help="Queue the run on a background worker; see Background Jobs below"
+                        )
                         action_col1, action_col2, action_col3 = st.columns(3)
                         with action_col1:
                             if st.button("Load", key=f"load_{temp_name}", use_container_width=True):
@@ -290,31 +652,62 @@ def prompt_templates_app():
                             if st.button("Run", key=f"run_{temp_name}", use_container_width=True):
                                 try:
                                     placeholders = json.loads(temp_data["placeholder_json"])
-                                    final_prompt = temp_data["prompt_template"].format(**placeholders)
+                                    final_prompt = compile_template(temp_data["prompt_template"]).render(placeholders)
                                     st.session_state["final_prompt"] = final_prompt
                                     
-                                    with st.spinner("Generating response..."):
-                                        output = call_llm(
+                                    if run_background:
+                                        submit_job("prompt", {
+                                            "prompt": final_prompt,
+                                            "model": temp_data["model_name"],
+                                            "temperature": temp_data["temperature"],
+                                            "cache": temp_data.get("cache") or None,
+                                            "usage_session": st.session_state.get("usage_session"),
+                                            "username": st.session_state.get("username"),
+                                        }, label=f"Template: {temp_name}")
+                                        st.success("Run queued")
+                                    else:
+                                        output, stats = stream_response(
+                                            response_placeholder,
                                             prompt=final_prompt,
                                             model=temp_data["model_name"],
-                                            temperature=temp_data["temperature"]
+                                            temperature=temp_data["temperature"],
+                                            cache=temp_data.get("cache") or None
                                         )
                                         st.session_state["model_output"] = output
-                                    
-                                    st.success("Response generated!")
+                                        st.session_state["model_stats"] = stats
+                                        stats_placeholder.caption(format_call_stats(stats))
+                                        
+                                        st.success("Response generated!")
                                 except Exception as e:
                                     st.error(f"Error: {e}")
                         
                         with action_col3:
                             if st.button("Delete", key=f"delete_{temp_name}", use_container_width=True):
-                                del st.session_state["templates"][temp_name]
+                                store.delete(temp_name)
                                 st.success(f"Template '{temp_name}' deleted!")
                                 st.rerun()
+            
+            # Pagination controls
+            if page_count > 1:
+                prev_col, page_col, next_col = st.columns([1, 2, 1])
+                with prev_col:
+                    if st.button("← Previous", disabled=page == 0, use_container_width=True):
+                        st.session_state["template_page"] = page - 1
+                        st.rerun()
+                with page_col:
+                    st.markdown(f"Page {page + 1} of {page_count} · {total} templates")
+                with next_col:
+                    if st.button("Next →", disabled=page + 1 >= page_count, use_container_width=True):
+                        st.session_state["template_page"] = page + 1
+                        st.rerun()
+        
+        with st.expander("Background Jobs", expanded=True):
+            show_background_jobs()
     
     # Handle loading a template if selected
     if st.session_state["active_template"]:
         temp_name = st.session_state["active_template"]
-        temp_data = st.session_state["templates"].get(temp_name)
+        temp_data = get_store().get(temp_name)
         
         if temp_data:
             # Switch to the first tab
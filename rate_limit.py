@@ -0,0 +1,199 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+
+
+class RateLimiter(object):
+    """
+    Thread-safe token bucket.
+
+    Allows `rate` acquisitions per second on average with bursts of up to
+    `burst`. A rate of None or 0 disables limiting.
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        """Blocks until `tokens` are available and takes them."""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter(RateLimiter):
+    """
+    Concurrency cap plus token bucket whose rate adapts to throttling.
+
+    Starts without a rate limit (only `max_concurrency` applies). Each
+    throttled request cuts the rate multiplicatively (to `decrease` times the
+    recent admission rate, or the current rate) and pauses admissions with
+    exponential backoff; each successful request raises it by `increase`
+    per second, up to `max_rate`. Shared by threads and event loops alike.
+    """
+
+    def __init__(self, max_concurrency=16, max_rate=None, min_rate=0.5, increase=2.0,
+                 decrease=0.5, backoff=0.25, max_backoff=10.0, window=2.0):
+        super(AdaptiveLimiter, self).__init__(rate=max_rate)
+        self.max_concurrency = max_concurrency
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.window = window
+        self.in_flight = 0
+        self.admitted = 0
+        self.throttles = 0
+        self._streak = 0
+        self._paused_until = 0.0
+        self._recent = deque()
+        self._lock = threading.Condition()
+
+    def _set_rate(self, rate):
+        if self.max_rate:
+            rate = min(rate, self.max_rate)
+        self.rate = max(self.min_rate, rate)
+        # Keep bursts small so a recovering rate is not spent all at once.
+        self.burst = max(1.0, self.rate / 4)
+        self._tokens = min(self._tokens, self.burst)
+
+    def _try_acquire(self, now):
+        """Admits a request, or returns how long to wait before trying again."""
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.in_flight >= self.max_concurrency:
+            return 0  # Wait for a release
+        if self.rate:
+            self._refill(now)
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            self._tokens -= 1
+        self.in_flight += 1
+        self.admitted += 1
+        self._recent.append(now)
+        while self._recent and self._recent[0] < now - self.window:
+            self._recent.popleft()
+        return None
+
+    def acquire(self, tokens=1):
+        """Blocks until a request may be sent. Pair with release()."""
+        with self._lock:
+            while True:
+                wait = self._try_acquire(time.monotonic())
+                if wait is None:
+                    return
+                self._lock.wait(timeout=wait or None)
+
+    async def acquire_async(self, poll=0.005):
+        """Awaits until a request may be sent. Pair with release()."""
+        while True:
+            with self._lock:
+                wait = self._try_acquire(time.monotonic())
+            if wait is None:
+                return
+            # Releases may come from other threads, so poll for free slots.
+            await asyncio.sleep(wait or poll)
+
+    def release(self, throttled=False):
+        """Frees a slot and adapts the rate to the request's outcome."""
+        with self._lock:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if throttled:
+                self.throttles += 1
+                # Requests already in flight when the rate was cut tend to be
+                # throttled too; count them, but cut only once per backoff.
+                if now >= self._paused_until:
+                    self._streak += 1
+                    recent = len(self._recent) / self.window
+                    current = self.rate or recent or self.max_concurrency
+                    self._set_rate(min(current, recent or current) * self.decrease)
+                    delay = min(self.max_backoff, self.backoff * 2 ** (self._streak - 1))
+                    self._paused_until = now + delay * random.uniform(0.5, 1.0)
+            else:
+                self._streak = 0
+                if self.rate and self.rate != self.max_rate:
+                    self._refill(now)
+                    self._set_rate(self.rate + self.increase / self.rate)
+            self._lock.notify_all()
+
+    def configure(self, max_concurrency, max_rate):
+        """Changes the concurrency cap and rate ceiling."""
+        with self._lock:
+            self.max_concurrency = max_concurrency
+            self.max_rate = max_rate
+            if self.rate and max_rate:
+                self._set_rate(self.rate)
+            elif max_rate:
+                self._set_rate(max_rate)
+            self._lock.notify_all()
+
+    def stats(self):
+        """Returns the current rate, in-flight count and throttle totals."""
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "admitted": self.admitted,
+                "throttles": self.throttles,
+            }
+
+
+# Bedrock quotas are per model, so each model id gets its own limiter.
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(model, max_concurrency=None, max_rate=None):
+    """
+    Returns the process-wide AdaptiveLimiter for a model id.
+
+    Args:
+        model (str): Bedrock model id
+        max_concurrency (int): Concurrency cap; defaults to
+            LLM_MAX_CONCURRENCY
+        max_rate (float): Requests per second ceiling; defaults to
+            LLM_MAX_RATE, or no ceiling
+
+    Limits that differ from the existing limiter's are applied to it, so
+    retuned catalog values take effect without losing the learned rate.
+    """
+    if max_concurrency is None:
+        max_concurrency = int(os.environ.get("LLM_MAX_CONCURRENCY", "16"))
+    if max_rate is None and os.environ.get("LLM_MAX_RATE"):
+        max_rate = float(os.environ["LLM_MAX_RATE"])
+    with _limiters_lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            limiter = _limiters[model] = AdaptiveLimiter(
+                max_concurrency=max_concurrency, max_rate=max_rate)
+        elif (limiter.max_concurrency, limiter.max_rate) != (max_concurrency, max_rate):
+            limiter.configure(max_concurrency, max_rate)
+        return limiter
+
+
+def reset_limiters():
+    """Forgets every model's learned rate."""
+    with _limiters_lock:
+        _limiters.clear()
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Where the on-disk tier lives; like barfi's schemas.barfi it defaults to
+# the working directory the app was started from.
+CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "llm_cache.sqlite3")
+# Entries older than this many seconds are treated as missing.
+CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# Limits for the in-memory tier (entries) and the on-disk tier (bytes).
+MEMORY_ENTRIES = int(os.environ.get("LLM_CACHE_MEMORY_ENTRIES", "256"))
+DISK_BYTES = int(os.environ.get("LLM_CACHE_DISK_BYTES", str(64 * 1024 * 1024)))
+
+
+def make_key(**fields):
+    """
+    Builds a content address for a request from its defining fields.
+
+    Returns:
+        str: Hex SHA-256 of the fields serialized as canonical JSON
+    """
+    payload = json.dumps(fields, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache(object):
+    """
+    Two-tier response cache: an in-memory LRU in front of a SQLite file.
+
+    Values are JSON-serializable dicts. Both tiers honour the TTL; the disk
+    tier drops its least recently used rows once it grows past max_bytes.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, memory_entries=MEMORY_ENTRIES,
+                 max_bytes=DISK_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0,
+                       "misses": 0, "evictions": 0, "expired": 0}
+        self._db = None
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                    "created REAL NOT NULL, accessed REAL NOT NULL)"
+                )
+                self._db.execute(
+                    "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache disk tier disabled: {e}")
+                self._db = None
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key):
+        """
+        Looks a key up in memory, then on disk.
+
+        Returns:
+            dict: The cached value, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self._stats["hits"] += 1
+                    self._stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+                self._stats["expired"] += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    if not self._expired(row[1], now):
+                        self._db.execute(
+                            "UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        value = json.loads(row[0])
+                        self._remember(key, value, row[1])
+                        self._stats["hits"] += 1
+                        self._stats["disk_hits"] += 1
+                        return value
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                    self._stats["expired"] += 1
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key, value):
+        """Stores a JSON-serializable value in both tiers."""
+        now = time.time()
+        data = json.dumps(value)
+        with self._lock:
+            self._remember(key, value, now)
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data.encode("utf-8")), now, now),
+            )
+            self._evict_disk()
+            self._db.commit()
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _evict_disk(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self._stats["evictions"] += 1
+
+    def clear(self):
+        """Empties both tiers. Counters are kept."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self):
+        """
+        Returns hit/miss/eviction counters and the storage footprint.
+
+        Returns:
+            dict: Counters plus hit_rate, memory_entries, disk_entries and
+                bytes_stored (size of the disk tier)
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_entries"] = 0
+            stats["bytes_stored"] = 0
+            if self._db is not None:
+                count, size = self._db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+                stats["disk_entries"] = count
+                stats["bytes_stored"] = size
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Returns the process-wide response cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -0,0 +1,156 @@
+"""
+Bounded storage for block outputs, shown as previews and pages.
+
+Search results and completions can run to hundreds of kilobytes. Rather
+than rendering them in full every time a block writes to the sidebar, the
+Streamlit sink stores each result here and renders a short preview; the
+Output Inspector then shows one page of one result at a time.
+"""
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from payload import Payload
+
+# Results kept per session, and their combined size in characters; the
+# oldest results are dropped first once either is exceeded.
+MAX_RESULTS = int(os.environ.get("RESULT_STORE_ENTRIES", "200"))
+MAX_CHARS = int(os.environ.get("RESULT_STORE_CHARS", str(20 * 1024 * 1024)))
+
+# Characters of a result rendered inline in the sidebar.
+PREVIEW_CHARS = int(os.environ.get("RESULT_PREVIEW_CHARS", "400"))
+
+# Inspector page sizes: list items or dict keys, and characters of text.
+PAGE_ITEMS = 10
+PAGE_CHARS = 3000
+
+
+def result_size(value):
+    """Approximate rendered size of a value, in characters."""
+    if isinstance(value, Payload):
+        return value.size
+    if isinstance(value, str):
+        return len(value)
+    return len(json.dumps(value, default=str))
+
+
+def preview(value, limit=PREVIEW_CHARS):
+    """
+    Returns (text, truncated): a value rendered as text, cut to `limit`
+    characters. Strings and payloads are shown as text, anything else as
+    compact JSON.
+    """
+    if isinstance(value, Payload):
+        return value.preview(limit)
+    text = value if isinstance(value, str) else json.dumps(value, default=str, ensure_ascii=False)
+    if len(text) <= limit:
+        return text, False
+    return text[:limit] + "…", True
+
+
+def _list_field(value):
+    """
+    The key of a small dict's longest list, if that list needs paging;
+    search blocks output {"query": ..., "results": [...]}.
+    """
+    if not isinstance(value, dict) or len(value) > PAGE_ITEMS:
+        return None
+    lists = [key for key, item in value.items() if isinstance(item, (list, tuple))]
+    key = max(lists, key=lambda k: len(value[k]), default=None)
+    return key if key is not None and len(value[key]) > PAGE_ITEMS else None
+
+
+def page_count(value):
+    """Number of inspector pages a value spans."""
+    if isinstance(value, Payload):
+        value = value.value
+    key = _list_field(value)
+    if key is not None:
+        value = value[key]
+    if isinstance(value, (list, tuple, dict)):
+        return max(1, -(-len(value) // PAGE_ITEMS))
+    return max(1, -(-result_size(value) // PAGE_CHARS))
+
+
+def get_page(value, page):
+    """
+    Returns one inspector page of a value (pages count from 0): a slice of
+    a list, a sub-dict of a dict, or a chunk of text for anything else.
+    A small dict holding a long list keeps its other keys on every page.
+    Payloads are paged by their body, or their text if they have none.
+    """
+    if isinstance(value, Payload):
+        value = value.value
+    key = _list_field(value)
+    if key is not None:
+        return dict(value, **{key: get_page(value[key], page)})
+    if isinstance(value, (list, tuple)):
+        return list(value[page * PAGE_ITEMS:(page + 1) * PAGE_ITEMS])
+    if isinstance(value, dict):
+        keys = itertools.islice(value, page * PAGE_ITEMS, (page + 1) * PAGE_ITEMS)
+        return {key: value[key] for key in keys}
+    text = value if isinstance(value, str) else json.dumps(value, default=str, indent=2)
+    return text[page * PAGE_CHARS:(page + 1) * PAGE_CHARS]
+
+
+class ResultStore(object):
+    """
+    Block results in arrival order, bounded by count and total size.
+
+    Entries are dicts with id, block, label, value, size and time. Values
+    are stored by reference; blocks hand over their outputs and do not
+    modify them afterwards.
+    """
+
+    def __init__(self, max_results=MAX_RESULTS, max_chars=MAX_CHARS):
+        self.max_results = max_results
+        self.max_chars = max_chars
+        self._entries = OrderedDict()
+        self._chars = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def put(self, value, block=None, label=None):
+        """
+        Stores a result.
+
+        Returns:
+            dict: The new entry
+        """
+        entry = {
+            "id": next(self._ids),
+            "block": block,
+            "label": label,
+            "value": value,
+            "size": result_size(value),
+            "time": time.time(),
+        }
+        with self._lock:
+            self._entries[entry["id"]] = entry
+            self._chars += entry["size"]
+            while len(self._entries) > 1 and (
+                    len(self._entries) > self.max_results or self._chars > self.max_chars):
+                _, dropped = self._entries.popitem(last=False)
+                self._chars -= dropped["size"]
+        return entry
+
+    def get(self, entry_id):
+        """Returns an entry by id, or None once it has been dropped."""
+        with self._lock:
+            return self._entries.get(entry_id)
+
+    def entries(self):
+        """Returns every stored entry, oldest first."""
+        with self._lock:
+            return list(self._entries.values())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._chars = 0
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,241 @@
+"""
+An append-only record of flow runs, for inspecting and replaying them.
+
+Every run stores its schema, inputs, timings and each block's status,
+fingerprint and outputs. Runs are never updated or deleted, and identical
+block outputs (the same search results in many runs) are stored once,
+content-addressed. A recorded run can be replayed (see run_flow's
+`replay`): blocks are served from the record instead of calling models
+and search tools again, except those the user marks as changed and
+everything downstream of them.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from payload import from_json, to_jsonable
+from response_cache import make_key
+
+# Like the response cache and job queue, the run database defaults to the
+# working directory the app was started from.
+RUN_DB_PATH = os.environ.get("RUN_DB_PATH", "flow_runs.sqlite3")
+
+# Session values that only attribute token usage. They are not stored with
+# a run, and do not stop its blocks from being replayed in another session.
+ATTRIBUTION_VALUES = ("usage_session", "username")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    owner TEXT,
+    label TEXT,
+    schema_hash TEXT NOT NULL,
+    schema TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    status TEXT NOT NULL,
+    replay_of TEXT,
+    created REAL NOT NULL,
+    wall_time REAL
+);
+CREATE INDEX IF NOT EXISTS runs_owner ON runs (owner, created);
+CREATE TABLE IF NOT EXISTS run_blocks (
+    run_id TEXT NOT NULL,
+    node_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    fingerprint TEXT,
+    reads TEXT,
+    outputs TEXT,
+    start REAL,
+    duration REAL,
+    reused TEXT,
+    PRIMARY KEY (run_id, node_id)
+);
+CREATE TABLE IF NOT EXISTS run_outputs (
+    digest TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_RUN_COLUMNS = ("id", "owner", "label", "schema_hash", "schema", "inputs", "status", "replay_of",
+                "created", "wall_time")
+
+
+def schema_hash(editor_state):
+    """
+    Identifies a flow by its blocks, their options and connections, so
+    moving blocks around the canvas does not change it.
+    """
+    return make_key(
+        nodes=sorted(
+            [node["id"], node["type"], node["name"], node.get("options", [])]
+            for node in editor_state.get("nodes", [])
+        ),
+        connections=sorted(
+            [connection["from"], connection["to"]] for connection in editor_state.get("connections", [])
+        ),
+    )
+
+
+def _restore(value):
+    # Outputs are stored as to_jsonable() left them: payloads as dicts.
+    if isinstance(value, dict) and {"kind", "text", "meta"} <= value.keys():
+        return from_json(value)
+    return value
+
+
+class RunStore(object):
+    """
+    Flow runs in SQLite.
+
+    A run is a dict with id, owner, label, schema_hash, schema (the editor
+    state), inputs, status, replay_of (the run it replayed, if any),
+    created, wall_time and blocks: node id -> name, type, status,
+    fingerprint, reads (digests of the session values the block read, as
+    kept by FlowMemo; secrets and ATTRIBUTION_VALUES are left out),
+    outputs, start, duration and reused ("memo", "replay" or None).
+    """
+
+    def __init__(self, path=RUN_DB_PATH):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def record(self, report, editor_state, inputs, owner=None, label=None, replay_of=None):
+        """
+        Appends a finished run.
+
+        Args:
+            report (dict): What run_flow returned
+            editor_state (dict): The schema that was run
+            inputs (dict): The values blocks read, such as init_input
+            owner (str): Who the run belongs to
+            label (str): Shown in run lists; defaults to the Init Block input
+            replay_of (str): Id of the run this one replayed
+
+        Returns:
+            str: The new run's id
+        """
+        run_id = uuid.uuid4().hex
+        timings = {t["block"]: t for t in report["timings"]}
+        results = report["results"]
+        blocks = []
+        outputs = {}
+        for name, result in results.items():
+            serialized = None
+            if result["status"] == "Computed":
+                serialized = json.dumps(to_jsonable(result["outputs"]), sort_keys=True, default=str)
+                digest = hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+                outputs[digest] = serialized
+                serialized = digest
+            timing = timings.get(name, {})
+            reads = [list(read) for read in result.get("reads", ())
+                     if read[0] == "value" and read[1] not in ATTRIBUTION_VALUES]
+            blocks.append((
+                run_id, result["node_id"], name, result["type"], result["status"],
+                result.get("fingerprint"), json.dumps(reads, default=str), serialized,
+                timing.get("start"), timing.get("duration"),
+                "replay" if result.get("replayed") else "memo" if result.get("reused") else None,
+            ))
+        status = "ok" if all(r["status"] == "Computed" for r in results.values()) else "error"
+        inputs = {name: value for name, value in (inputs or {}).items() if name not in ATTRIBUTION_VALUES}
+        if label is None:
+            label = str(inputs.get("init_input") or "")[:80]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO run_outputs (digest, value) VALUES (?, ?)", outputs.items())
+            self._db.execute(
+                f"INSERT INTO runs ({', '.join(_RUN_COLUMNS)}) VALUES ({', '.join('?' * len(_RUN_COLUMNS))})",
+                (run_id, owner, label, schema_hash(editor_state), json.dumps(editor_state),
+                 json.dumps(to_jsonable(inputs), default=str), status, replay_of, time.time(),
+                 report.get("wall_time")))
+            self._db.executemany(
+                "INSERT INTO run_blocks (run_id, node_id, name, type, status, fingerprint, reads, "
+                "outputs, start, duration, reused) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", blocks)
+        return run_id
+
+    def _run(self, row):
+        run = dict(zip(_RUN_COLUMNS, row))
+        run["schema"] = json.loads(run["schema"])
+        run["inputs"] = json.loads(run["inputs"])
+        return run
+
+    def runs(self, owner, limit=20):
+        """Returns an owner's most recent runs, newest first, without their blocks."""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(_RUN_COLUMNS)} FROM runs WHERE owner IS ? "
+                "ORDER BY created DESC LIMIT ?", (owner, limit)).fetchall()
+        return [self._run(row) for row in rows]
+
+    def get(self, run_id):
+        """Returns a run with its blocks, outputs restored as payloads, or None."""
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(_RUN_COLUMNS)} FROM runs WHERE id = ?", (run_id,)).fetchone()
+            if row is None:
+                return None
+            blocks = self._db.execute(
+                "SELECT b.node_id, b.name, b.type, b.status, b.fingerprint, b.reads, o.value, b.start, "
+                "b.duration, b.reused FROM run_blocks b LEFT JOIN run_outputs o ON o.digest = b.outputs "
+                "WHERE b.run_id = ? ORDER BY b.start", (run_id,)).fetchall()
+        run = self._run(row)
+        run["blocks"] = {
+            node_id: {
+                "name": name, "type": block_type, "status": status, "fingerprint": fingerprint,
+                "reads": [tuple(read) for read in json.loads(reads or "[]")],
+                "outputs": ({key: _restore(value) for key, value in json.loads(value).items()}
+                            if value is not None else None),
+                "start": start, "duration": duration, "reused": reused,
+            }
+            for node_id, name, block_type, status, fingerprint, reads, value, start, duration, reused in blocks
+        }
+        return run
+
+    def stats(self):
+        """Returns the number of runs and of distinct block outputs stored."""
+        with self._lock:
+            runs = self._db.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+            outputs = self._db.execute("SELECT COUNT(*) FROM run_outputs").fetchone()[0]
+        return {"runs": runs, "outputs": outputs}
+
+
+def replay_plan(run, changed=()):
+    """
+    What run_flow should serve from a recorded run.
+
+    Args:
+        run (dict): A run from RunStore.get
+        changed (iterable): Names of blocks to execute again
+
+    Returns:
+        dict: node id -> {"fingerprint", "reads", "outputs"} for every
+            block that computed in the run and is not marked as changed
+    """
+    changed = set(changed)
+    return {
+        node_id: {"fingerprint": block["fingerprint"], "reads": block["reads"], "outputs": block["outputs"]}
+        for node_id, block in run["blocks"].items()
+        if block["status"] == "Computed" and block["outputs"] is not None and block["name"] not in changed
+    }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_run_store():
+    """Returns the process-wide RunStore (see RUN_DB_PATH)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RunStore()
+        return _store
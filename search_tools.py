@@ -0,0 +1,297 @@
+import logging
+import os
+import threading
+import time
+
+import requests
+from cachetools import TTLCache
+from langchain_community.tools import WikipediaQueryRun
+from langchain_community.tools.pubmed.tool import PubmedQueryRun
+from langchain_community.tools.tavily_search import TavilySearchResults
+from langchain_community.utilities import WikipediaAPIWrapper
+from langchain_community.utilities.pubmed import PubMedAPIWrapper
+from langchain_community.utilities.tavily_search import TavilySearchAPIWrapper
+from langchain_community.utilities.wikipedia import WIKIPEDIA_MAX_QUERY_LENGTH
+from pydantic import model_validator
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from single_flight import SingleFlight
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Endpoints can be overridden to point the tools at local stand-in servers.
+TAVILY_API_URL = os.environ.get("TAVILY_API_URL", "https://api.tavily.com")
+PUBMED_API_URL = os.environ.get("PUBMED_API_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils")
+WIKIPEDIA_API_URL = os.environ.get("WIKIPEDIA_API_URL")
+# Wikimedia asks API clients to identify themselves.
+WIKIPEDIA_USER_AGENT = "Prompt Engineer Workbench (python-requests)"
+
+HTTP_TIMEOUT = float(os.environ.get("SEARCH_HTTP_TIMEOUT", "15"))
+# Query results are shared by every session for this many seconds.
+RESULT_TTL = float(os.environ.get("SEARCH_CACHE_TTL", "900"))
+RESULT_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", "1024"))
+
+
+class _PooledSession(requests.Session):
+    """A requests.Session that applies a default timeout to every request."""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", HTTP_TIMEOUT)
+        return super().request(method, url, **kwargs)
+
+
+def _build_session():
+    session = _PooledSession()
+    retry = Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 502, 503, 504],
+                  allowed_methods=None)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# One keep-alive connection pool shared by all search tools.
+_session = _build_session()
+
+
+class PooledTavilySearchAPIWrapper(TavilySearchAPIWrapper):
+    """TavilySearchAPIWrapper that sends requests through the shared session."""
+
+    def raw_results(self, query, max_results=5, search_depth="advanced", include_domains=[],
+                    exclude_domains=[], include_answer=False, include_raw_content=False,
+                    include_images=False):
+        params = {
+            "api_key": self.tavily_api_key.get_secret_value(),
+            "query": query,
+            "max_results": max_results,
+            "search_depth": search_depth,
+            "include_domains": include_domains,
+            "exclude_domains": exclude_domains,
+            "include_answer": include_answer,
+            "include_raw_content": include_raw_content,
+            "include_images": include_images,
+        }
+        response = _session.post(f"{TAVILY_API_URL}/search", json=params)
+        response.raise_for_status()
+        return response.json()
+
+
+class PooledPubMedAPIWrapper(PubMedAPIWrapper):
+    """
+    PubMedAPIWrapper that sends requests through the shared session.
+
+    Throttling (HTTP 429) is retried with backoff by the session adapter.
+    """
+
+    base_url_esearch: str = f"{PUBMED_API_URL}/esearch.fcgi?"
+    base_url_efetch: str = f"{PUBMED_API_URL}/efetch.fcgi?"
+
+    def lazy_load(self, query):
+        params = {"db": "pubmed", "term": query, "retmode": "json",
+                  "retmax": self.top_k_results, "usehistory": "y"}
+        if self.api_key:
+            params["api_key"] = self.api_key
+        response = _session.get(self.base_url_esearch, params=params)
+        response.raise_for_status()
+        result = response.json()["esearchresult"]
+        for uid in result["idlist"]:
+            yield self.retrieve_article(uid, result["webenv"])
+
+    def retrieve_article(self, uid, webenv):
+        params = {"db": "pubmed", "retmode": "xml", "id": uid, "webenv": webenv}
+        if self.api_key:
+            params["api_key"] = self.api_key
+        response = _session.get(self.base_url_efetch, params=params)
+        response.raise_for_status()
+        return self._parse_article(uid, self.parse(response.text))
+
+
+class PooledWikipediaAPIWrapper(WikipediaAPIWrapper):
+    """
+    WikipediaAPIWrapper that queries the MediaWiki API through the shared
+    session.
+
+    The base wrapper drives the `wikipedia` package, which sends requests
+    with module-level state (requests.get, API_URL, language); this one
+    leaves that package alone. Only `run`, which WikipediaQueryRun uses,
+    is supported.
+    """
+
+    @model_validator(mode="before")
+    @classmethod
+    def validate_environment(cls, values):
+        # Replaces the base validator, which imports `wikipedia` and sets
+        # its language for the whole process.
+        values.setdefault("wiki_client", None)
+        return values
+
+    def _query(self, **params):
+        url = WIKIPEDIA_API_URL or f"https://{self.lang}.wikipedia.org/w/api.php"
+        response = _session.get(url, params=dict(params, action="query", format="json"),
+                                headers={"User-Agent": WIKIPEDIA_USER_AGENT})
+        response.raise_for_status()
+        result = response.json()
+        if "error" in result:
+            raise RuntimeError(f"Wikipedia API error: {result['error'].get('info')}")
+        return result["query"]
+
+    def _summary(self, title):
+        # Like the base wrapper, missing and disambiguation pages are skipped.
+        pages = self._query(titles=title, prop="extracts|pageprops", exintro="", explaintext="",
+                            ppprop="disambiguation", redirects="")["pages"]
+        for page in pages.values():
+            if "missing" in page or "disambiguation" in page.get("pageprops", {}):
+                return None
+            return page.get("extract") or None
+        return None
+
+    def run(self, query):
+        hits = self._query(list="search", srprop="", srlimit=self.top_k_results,
+                           srsearch=query[:WIKIPEDIA_MAX_QUERY_LENGTH])["search"]
+        summaries = []
+        for hit in hits[: self.top_k_results]:
+            summary = self._summary(hit["title"])
+            if summary:
+                summaries.append(f"Page: {hit['title']}\nSummary: {summary}")
+        if not summaries:
+            return "No good Wikipedia Search Result was found"
+        return "\n\n".join(summaries)[: self.doc_content_chars_max]
+
+
+_tools = {}
+_tools_lock = threading.Lock()
+
+
+def _get_tool(name, factory):
+    with _tools_lock:
+        tool = _tools.get(name)
+        if tool is None:
+            tool = _tools[name] = factory()
+        return tool
+
+
+_results = TTLCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_TTL)
+_results_lock = threading.Lock()
+# Concurrent cache misses for the same query share one request.
+_flights = SingleFlight()
+_stats = {}
+
+
+def _tool_stats(tool):
+    return _stats.setdefault(tool, {"calls": 0, "hits": 0, "misses": 0, "shared": 0, "errors": 0,
+                                    "total_latency": 0.0, "max_latency": 0.0})
+
+
+def _fetch(tool, key, query, run, cacheable):
+    """Runs one search for a cache miss and stores a cacheable result."""
+    with _results_lock:
+        _tool_stats(tool)["misses"] += 1
+    start = time.perf_counter()
+    try:
+        result = run(query)
+    except Exception:
+        with _results_lock:
+            _tool_stats(tool)["errors"] += 1
+        raise
+    latency = time.perf_counter() - start
+
+    with _results_lock:
+        entry = _tool_stats(tool)
+        entry["total_latency"] += latency
+        entry["max_latency"] = max(entry["max_latency"], latency)
+        if cacheable is None or cacheable(result):
+            _results[key] = result
+    return result
+
+
+def _cached_search(tool, query, run, cacheable=None, variant=None):
+    with span(f"search: {tool}", "search", tool=tool, query=query, cache_hit=False) as trace:
+        key = (tool, query, variant)
+        with _results_lock:
+            entry = _tool_stats(tool)
+            entry["calls"] += 1
+            if key in _results:
+                entry["hits"] += 1
+                trace["attributes"]["cache_hit"] = True
+                return _results[key]
+
+        result, shared = _flights.do(key, lambda: _fetch(tool, key, query, run, cacheable))
+        if shared:
+            with _results_lock:
+                _tool_stats(tool)["shared"] += 1
+        trace["attributes"]["shared"] = shared
+        return result
+
+
+def web_search(query, api_key, max_results=2):
+    """
+    Searches the web with Tavily, serving repeated queries from the cache.
+
+    Args:
+        query (str): Search query
+        api_key (str): Tavily API key
+        max_results (int): Number of results to return
+
+    Returns:
+        list: Result dicts with url and content
+    """
+    tool = _get_tool(
+        ("tavily", api_key, max_results),
+        lambda: TavilySearchResults(
+            max_results=max_results,
+            api_wrapper=PooledTavilySearchAPIWrapper(tavily_api_key=api_key),
+        ),
+    )
+    # TavilySearchResults reports failures as a string instead of raising.
+    return _cached_search("web", query, lambda q: tool.invoke({"query": q}),
+                          cacheable=lambda result: isinstance(result, list),
+                          variant=max_results)
+
+
+def pubmed_search(query):
+    """
+    Searches PubMed, serving repeated queries from the cache.
+
+    Returns:
+        str: Article summaries separated by blank lines
+    """
+    tool = _get_tool("pubmed", lambda: PubmedQueryRun(api_wrapper=PooledPubMedAPIWrapper()))
+    # PubmedQueryRun reports failures as text instead of raising; never cache those.
+    return _cached_search("pubmed", query, tool.invoke,
+                          cacheable=lambda result: not result.startswith("PubMed exception"))
+
+
+def wikipedia_search(query):
+    """
+    Searches Wikipedia, serving repeated queries from the cache.
+
+    Returns:
+        str: Page summaries separated by blank lines
+    """
+    tool = _get_tool("wikipedia", lambda: WikipediaQueryRun(api_wrapper=PooledWikipediaAPIWrapper()))
+    return _cached_search("wikipedia", query, tool.invoke)
+
+
+def search_stats():
+    """
+    Returns cache hit rate and network latency per search tool.
+
+    Returns:
+        dict: tool name -> calls, hits, misses, shared (calls that joined
+            an identical search already in flight), errors, hit_rate,
+            mean_latency and max_latency (seconds, cache misses only)
+    """
+    with _results_lock:
+        stats = {tool: dict(entry) for tool, entry in _stats.items()}
+    for entry in stats.values():
+        entry["hit_rate"] = entry["hits"] / entry["calls"] if entry["calls"] else 0.0
+        entry["mean_latency"] = entry["total_latency"] / entry["misses"] if entry["misses"] else 0.0
+    return stats
+
+
+def clear_search_cache():
+    """Empties the shared query-result cache."""
+    with _results_lock:
+        _results.clear()
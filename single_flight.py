@@ -0,0 +1,156 @@
+"""
+Coalescing of identical in-flight requests ("single flight").
+
+When several callers make the same request at the same time, only the
+first one goes to the network; the others wait for it and receive the
+same result (or the same exception). Nothing is kept once the call
+completes, so this complements the response and search caches rather than
+replacing them: it covers the window before the first response is stored,
+and calls that are not cached at all.
+"""
+import asyncio
+import threading
+
+
+class _Flight(object):
+    """One in-flight call: its outcome, or its chunks so far for a stream."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.cond = threading.Condition()
+        self.chunks = []
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    A group of calls deduplicated by key.
+
+    Callers of `do` and `stream` with the same key while a call is in
+    flight share that call. `ado` does the same for coroutines on one event
+    loop. Keys must be hashable and capture everything that determines the
+    result.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "shared": 0}
+
+    def _join(self, key):
+        # Returns (flight, leader): the existing flight, or a new one that
+        # the caller must run.
+        with self._lock:
+            self._stats["calls"] += 1
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._stats["shared"] += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def _land(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.cond:
+            flight.done.set()
+            flight.cond.notify_all()
+
+    def do(self, key, fn):
+        """
+        Calls `fn()`, unless the same key is already in flight, in which case
+        waits for that call instead.
+
+        Returns:
+            tuple: (result, shared), where shared says whether the result
+                came from another caller's call. Exceptions are re-raised
+                in every caller.
+        """
+        flight, leader = self._join(key)
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight)
+        return flight.result, False
+
+    def stream(self, key, fn):
+        """
+        Streams the chunks of the iterable returned by `fn()`, sharing one
+        stream between concurrent callers with the same key.
+
+        The stream is consumed on a background thread, so a caller that
+        stops early does not cut it short for the others. Every caller sees
+        every chunk from the start, however late it joins.
+
+        Returns:
+            tuple: (iterator of chunks, shared)
+        """
+        flight, leader = self._join(key)
+        if leader:
+            threading.Thread(target=self._pump, args=(key, flight, fn), name="single-flight-stream",
+                             daemon=True).start()
+        return self._follow(flight), not leader
+
+    def _pump(self, key, flight, fn):
+        try:
+            for chunk in fn():
+                with flight.cond:
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            self._land(key, flight)
+
+    def _follow(self, flight):
+        position = 0
+        while True:
+            with flight.cond:
+                while position == len(flight.chunks) and not flight.done.is_set():
+                    flight.cond.wait()
+                chunks = flight.chunks[position:]
+                finished = flight.done.is_set()
+            for chunk in chunks:
+                yield chunk
+            position += len(chunks)
+            if finished and position == len(flight.chunks):
+                if flight.error is not None:
+                    raise flight.error
+                return
+
+    async def ado(self, key, coro_fn):
+        """
+        Awaits `coro_fn()`, unless the same key is already in flight on this
+        event loop, in which case awaits that call instead.
+
+        Returns:
+            tuple: (result, shared)
+        """
+        key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            self._stats["calls"] += 1
+            task = self._tasks.get(key)
+            shared = task is not None
+            if shared:
+                self._stats["shared"] += 1
+            else:
+                task = self._tasks[key] = asyncio.ensure_future(coro_fn())
+                task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        # A caller that is cancelled must not cancel the call for the others.
+        return await asyncio.shield(task), shared
+
+    def stats(self):
+        """Returns calls, shared (calls that joined another's) and in_flight."""
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._flights) + len(self._tasks))
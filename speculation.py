@@ -0,0 +1,226 @@
+"""
+Speculative prefetch of the Template Editor's next test call.
+
+While speculative mode is on, the editor reports its rendered prompt on
+every rerun. Once a prompt has stayed the same for SPECULATE_DEBOUNCE
+seconds, it is sent to the model in the background and the response is
+parked in the response cache. When "Test Template" is clicked for that
+prompt, the response comes from the cache, or, if the call is still
+running, the click joins it (see llm.COALESCE) instead of starting
+another.
+
+Speculation spends real tokens on calls that may never be used, so it is
+capped per owner: SPECULATE_MAX_PER_OWNER calls at once and
+SPECULATE_TOKENS_PER_HOUR tokens in any hour. A call's completion is
+reserved at the model's max_tokens until the call reports its usage.
+Owners that have been idle for SPECULATE_IDLE_TTL seconds, with nothing in
+flight and no spend left in the hour, are forgotten.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from llm import stream_llm
+from model_catalog import get_model
+from token_budget import estimate_tokens, get_ledger
+
+logger = logging.getLogger(__name__)
+
+# Seconds a rendered prompt must stay unchanged before it is sent.
+SPECULATE_DEBOUNCE = float(os.environ.get("SPECULATE_DEBOUNCE", "1.5"))
+# Speculative calls in flight at once, per owner.
+SPECULATE_MAX_PER_OWNER = int(os.environ.get("SPECULATE_MAX_PER_OWNER", "1"))
+# Tokens (prompt and completion) speculative calls may use per owner per hour.
+SPECULATE_TOKENS_PER_HOUR = int(os.environ.get("SPECULATE_TOKENS_PER_HOUR", "20000"))
+# Parked responses remembered per owner, oldest dropped first.
+SPECULATE_PARKED = 8
+# Seconds after an owner's last prompt or claim that its state may be dropped.
+SPECULATE_IDLE_TTL = float(os.environ.get("SPECULATE_IDLE_TTL", "3600"))
+
+_WINDOW = 3600.0
+
+
+class _Owner(object):
+    """One owner's latest prompt, calls in flight, parked keys and spend."""
+
+    def __init__(self):
+        self.touched = 0.0
+        self.latest = None
+        self.sequence = 0
+        self.running = 0
+        self.parked = OrderedDict()  # key -> "running" or "ready"
+        self.spend = deque()  # [time, tokens]
+
+
+class Speculator(object):
+    """
+    Sends prompts ahead of the click that will need them.
+
+    `observe` is called with the current prompt whenever it may have
+    changed, and `claim` when the user asks for the response; a claim that
+    finds the prompt prefetched counts as a hit.
+    """
+
+    def __init__(self, debounce=SPECULATE_DEBOUNCE, max_per_owner=SPECULATE_MAX_PER_OWNER,
+                 tokens_per_hour=SPECULATE_TOKENS_PER_HOUR, idle_ttl=SPECULATE_IDLE_TTL):
+        self.debounce = debounce
+        self.max_per_owner = max_per_owner
+        self.tokens_per_hour = tokens_per_hour
+        self.idle_ttl = idle_ttl
+        self._owners = {}
+        self._pruned = time.time()
+        self._lock = threading.Lock()
+        self._stats = {"launched": 0, "claims": 0, "hits": 0, "errors": 0,
+                       "skipped_concurrency": 0, "skipped_budget": 0, "tokens": 0}
+
+    def _owner(self, owner):
+        now = time.time()
+        if now - self._pruned >= min(self.idle_ttl, 60.0):
+            self._prune(now)
+        state = self._owners.get(owner)
+        if state is None:
+            state = self._owners[owner] = _Owner()
+        state.touched = now
+        return state
+
+    def _prune(self, now):
+        # Drops idle owners. One with a call in flight is kept, so the call
+        # still counts against its limits, and so is one whose spend is
+        # still within the hour, so forgetting it cannot reset its budget.
+        self._pruned = now
+        for owner, state in list(self._owners.items()):
+            if (not state.running and state.touched <= now - self.idle_ttl
+                    and all(entry[0] <= now - _WINDOW for entry in state.spend)):
+                del self._owners[owner]
+
+    def observe(self, owner, prompt, model, temperature, scopes=()):
+        """
+        Notes an owner's current prompt; it is sent once it has been
+        stable for the debounce interval, unless already sent.
+
+        Args:
+            owner (str): Whose editor this is; limits apply per owner
+            prompt (str): The rendered prompt
+            model (str): Bedrock model id
+            temperature (float): Sampling temperature
+            scopes (list): Ledger scopes to record the call's usage under
+        """
+        key = (prompt, model, temperature)
+        with self._lock:
+            state = self._owner(owner)
+            if state.latest == key:
+                return
+            state.latest = key
+            state.sequence += 1
+            sequence = state.sequence
+        timer = threading.Timer(self.debounce, self._fire, args=(owner, sequence, key, list(scopes)))
+        timer.daemon = True
+        timer.start()
+
+    def cancel(self, owner):
+        """Drops an owner's pending prompt, e.g. when speculative mode is turned off."""
+        with self._lock:
+            state = self._owners.get(owner)
+            if state is None:
+                return
+            if not state.running and not state.spend:
+                # Nothing in flight or to account for: forget the owner.
+                del self._owners[owner]
+                return
+            state.latest = None
+            state.sequence += 1
+
+    def claim(self, owner, prompt, model, temperature):
+        """
+        Called when the response is needed.
+
+        Returns:
+            bool: Whether the prompt was prefetched (parked in the response
+                cache, or still in flight); if so, read it with cache=True
+        """
+        key = (prompt, model, temperature)
+        with self._lock:
+            state = self._owner(owner)
+            self._stats["claims"] += 1
+            # A pending prefetch of this prompt is no longer needed.
+            state.latest = key
+            state.sequence += 1
+            if state.parked.pop(key, None) is None:
+                return False
+            self._stats["hits"] += 1
+            return True
+
+    def _reserve(self, state, tokens, now):
+        # Returns the spend entry for a new call, or None if over budget.
+        while state.spend and state.spend[0][0] <= now - _WINDOW:
+            state.spend.popleft()
+        if sum(entry[1] for entry in state.spend) + tokens > self.tokens_per_hour:
+            return None
+        entry = [now, tokens]
+        state.spend.append(entry)
+        return entry
+
+    def _fire(self, owner, sequence, key, scopes):
+        prompt, model, temperature = key
+        with self._lock:
+            # A cancelled or forgotten owner has nothing to send.
+            state = self._owners.get(owner)
+            if state is None or state.sequence != sequence or key in state.parked:
+                return
+            if state.running >= self.max_per_owner:
+                self._stats["skipped_concurrency"] += 1
+                return
+            reserved = estimate_tokens(prompt, model) + (get_model(model)["max_tokens"] or 0)
+            entry = self._reserve(state, reserved, time.time())
+            if entry is None:
+                self._stats["skipped_budget"] += 1
+                return
+            state.running += 1
+            state.parked[key] = "running"
+            while len(state.parked) > SPECULATE_PARKED:
+                state.parked.popitem(last=False)
+            self._stats["launched"] += 1
+
+        stats = {}
+        try:
+            for _ in stream_llm(prompt=prompt, model=model, temperature=temperature, stats=stats, cache=True):
+                pass
+        except Exception as e:
+            logger.warning(f"Speculative call for {model} failed: {e}")
+            with self._lock:
+                self._stats["errors"] += 1
+                state.parked.pop(key, None)
+        finally:
+            used = 0 if stats.get("cached") else stats.get("input_tokens", 0) + stats.get("output_tokens", 0)
+            with self._lock:
+                state.running -= 1
+                entry[1] = used
+                self._stats["tokens"] += used
+                if state.parked.get(key) == "running":
+                    state.parked[key] = "ready"
+        if stats:
+            get_ledger().record(scopes, model, stats.get("input_tokens"), stats.get("output_tokens"),
+                                cached=stats.get("cached", False))
+
+    def stats(self):
+        """
+        Returns launched, claims, hits, errors, skipped_concurrency,
+        skipped_budget and tokens, plus hit_rate (claims served by a
+        prefetch), used (prefetches that were claimed) and owners (owners
+        whose state is kept).
+        """
+        with self._lock:
+            stats = dict(self._stats, owners=len(self._owners))
+        stats["hit_rate"] = stats["hits"] / stats["claims"] if stats["claims"] else 0.0
+        stats["used"] = stats["hits"] / stats["launched"] if stats["launched"] else 0.0
+        return stats
+
+
+_speculator = Speculator()
+
+
+def get_speculator():
+    """Returns the process-wide Speculator."""
+    return _speculator
@@ -0,0 +1,295 @@
+"""
+Evaluates a prompt template over a dataset of parameter rows.
+
+Example:
+    python template_batch.py --template "Summarize {topic} for {audience}." \\
+        --rows rows.csv --output results.jsonl --concurrency 8 --rate 5
+
+Rows come from a CSV file (one column per placeholder) or a JSONL file (one
+object per line). An "id" field, when present, identifies a row; otherwise
+its position in the file does. Results are appended to the output JSONL as
+they complete, and rows already completed there with the same template and
+temperature are skipped, so an interrupted run picks up where it stopped
+while an edited template is evaluated afresh.
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import re
+import statistics
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from llm import DEFAULT_MODEL, call_llm
+from model_catalog import estimate_cost
+from response_cache import make_key
+from rate_limit import RateLimiter
+from template_engine import compile_template
+from token_budget import estimate_tokens, get_ledger
+
+logger = logging.getLogger(__name__)
+
+# Where batches started from the app write their results, one directory per
+# owner. Like the other stores it defaults to the app's working directory.
+BATCH_RESULTS_DIR = os.environ.get("BATCH_RESULTS_DIR", "batch_results")
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def _safe_name(name, default):
+    name = _UNSAFE.sub("_", os.path.basename(str(name or ""))).strip("._")
+    return name or default
+
+
+def results_path(name, owner=None, directory=None):
+    """
+    Returns the results file for a batch named in the app.
+
+    Names come from web users, so only a sanitized basename is kept and the
+    file always lands under the owner's directory in BATCH_RESULTS_DIR,
+    whatever path the name spells.
+
+    Args:
+        name (str): Results file name, e.g. "summaries.jsonl"
+        owner (str): Who the batch belongs to
+        directory (str): Defaults to BATCH_RESULTS_DIR
+
+    Returns:
+        str: Path to a .jsonl file; its directory is created if needed
+    """
+    name = _safe_name(name, "batch_results")
+    if not name.endswith(".jsonl"):
+        name += ".jsonl"
+    folder = os.path.join(directory or BATCH_RESULTS_DIR, _safe_name(owner, "shared"))
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, name)
+
+
+def parse_rows(text, fmt):
+    """
+    Parses parameter rows from CSV or JSONL text.
+
+    Args:
+        text (str): File contents
+        fmt (str): "csv" or "jsonl"
+
+    Returns:
+        list: One dict of placeholder values per row
+    """
+    if fmt == "csv":
+        return list(csv.DictReader(io.StringIO(text)))
+    if fmt == "jsonl":
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    raise ValueError(f"Unsupported row format: {fmt}")
+
+
+def load_rows(path):
+    """Loads parameter rows from a .csv or .jsonl file."""
+    fmt = "csv" if path.lower().endswith(".csv") else "jsonl"
+    with open(path, "r", encoding="utf-8", newline="") as handle:
+        return parse_rows(handle.read(), fmt)
+
+
+def template_hash(template):
+    """Identifies a template's text in result records."""
+    return make_key(template=template)
+
+
+def completed_jobs(output_path):
+    """
+    Returns the jobs already completed in an output file, as (row id, model,
+    template hash, temperature) tuples. Records written before templates
+    were hashed match no template, so those rows run again.
+    """
+    done = set()
+    if not output_path or not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as handle:
+        for line in handle:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A partially written last line from an interrupted run
+            if record.get("status") == "ok":
+                done.add((str(record["row_id"]), record["model"], record.get("template_hash"),
+                          record.get("temperature")))
+    return done
+
+
+def _row_id(index, row):
+    return str(row.get("id", index))
+
+
+def _run_job(template, digest, row_id, row, model, temperature, limiter):
+    record = {"row_id": row_id, "model": model, "template_hash": digest, "temperature": temperature,
+              "params": row}
+    try:
+        prompt = template.render(row)
+    except (KeyError, IndexError, AttributeError, TypeError, ValueError) as e:
+        record.update(status="error", error=f"Could not render template: {e!r}", latency=0.0)
+        return record
+
+    limiter.acquire()
+    start = time.perf_counter()
+    try:
+        output = call_llm(prompt=prompt, model=model, temperature=temperature)
+        content = getattr(output, "content", output)
+        usage = getattr(output, "usage_metadata", None) or {}
+        cached = bool(getattr(output, "response_metadata", {}).get("cached"))
+        input_tokens = usage.get("input_tokens") or estimate_tokens(prompt, model)
+        output_tokens = usage.get("output_tokens") or estimate_tokens(content, model)
+        record.update(status="ok", prompt=prompt, output=content, cached=cached,
+                      input_tokens=input_tokens, output_tokens=output_tokens,
+                      cost=0.0 if cached else estimate_cost(model, input_tokens, output_tokens))
+    except Exception as e:
+        record.update(status="error", prompt=prompt, error=str(e))
+    record["latency"] = time.perf_counter() - start
+    return record
+
+
+def summarize(records, elapsed):
+    """
+    Computes throughput and latency per model from result records.
+
+    Returns:
+        dict: model -> completed, errors, rows_per_sec,
+            latency_mean/latency_p50/latency_p95 (seconds), input_tokens,
+            output_tokens and cost (USD, None for unpriced models)
+    """
+    summary = {}
+    for model in sorted({r["model"] for r in records}):
+        ok = [r["latency"] for r in records if r["model"] == model and r["status"] == "ok"]
+        errors = sum(1 for r in records if r["model"] == model and r["status"] != "ok")
+        succeeded = [r for r in records if r["model"] == model and r["status"] == "ok"]
+        costs = [r.get("cost") for r in succeeded]
+        latencies = sorted(ok)
+        summary[model] = {
+            "completed": len(ok),
+            "errors": errors,
+            "rows_per_sec": len(ok) / elapsed if elapsed else 0.0,
+            "latency_mean": statistics.mean(latencies) if latencies else 0.0,
+            "latency_p50": statistics.median(latencies) if latencies else 0.0,
+            "latency_p95": latencies[max(0, int(len(latencies) * 0.95) - 1)] if latencies else 0.0,
+            "input_tokens": sum(r.get("input_tokens") or 0 for r in succeeded),
+            "output_tokens": sum(r.get("output_tokens") or 0 for r in succeeded),
+            "cost": None if None in costs else sum(costs),
+        }
+    return summary
+
+
+def run_template_batch(template, rows, output_path, models=(DEFAULT_MODEL,), temperature=0.7,
+                       concurrency=8, rate=None, progress=None, usage_scopes=()):
+    """
+    Renders and runs a template for every row against every model.
+
+    Args:
+        template (str): Prompt template with {placeholders}
+        rows (list): Dicts of placeholder values
+        output_path (str): JSONL file results are appended to; rows it
+            already holds for this template and temperature are skipped
+        models (list): Bedrock model ids to evaluate
+        temperature (float): Sampling temperature
+        concurrency (int): Requests in flight at once
+        rate (float): Maximum requests per second across all models, or None
+        progress (callable): Called as progress(done, total, record) after
+            each job, on the calling thread
+        usage_scopes (list): Ledger scopes the calls' tokens and cost are
+            added to (see token_budget.usage_scopes)
+
+    Returns:
+        dict: total, skipped, elapsed and per-model stats (see summarize)
+    """
+    compiled = compile_template(template)
+    done = completed_jobs(output_path)
+    digest = template_hash(template)
+    jobs = []
+    skipped = 0
+    for index, row in enumerate(rows):
+        row_id = _row_id(index, row)
+        for model in models:
+            if (row_id, model, digest, temperature) in done:
+                skipped += 1
+            else:
+                jobs.append((row_id, row, model))
+    limiter = RateLimiter(rate=rate, burst=concurrency)
+    records = []
+
+    start = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as pool:
+        pending = iter(jobs)
+        running = set()
+        while True:
+            for row_id, row, model in pending:
+                running.add(pool.submit(_run_job, compiled, digest, row_id, row, model, temperature,
+                                        limiter))
+                if len(running) >= concurrency * 2:
+                    break
+            if not running:
+                break
+
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                out.write(json.dumps(record, default=str) + "\n")
+                out.flush()
+                records.append(record)
+                if record["status"] == "ok":
+                    get_ledger().record(usage_scopes, record["model"], record["input_tokens"],
+                                        record["output_tokens"], cached=record["cached"])
+                if progress:
+                    progress(len(records), len(jobs), record)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "total": len(jobs),
+        "skipped": skipped,
+        "elapsed": elapsed,
+        "models": summarize(records, elapsed),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate a prompt template over a dataset.")
+    template = parser.add_mutually_exclusive_group(required=True)
+    template.add_argument("--template", help="Prompt template text")
+    template.add_argument("--template-file", help="File containing the prompt template")
+    parser.add_argument("--rows", required=True, help="CSV or JSONL file of parameter rows")
+    parser.add_argument("--output", required=True, help="JSONL file to append results to")
+    parser.add_argument("--model", action="append", dest="models",
+                        help="Bedrock model id; repeat to compare models")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=None,
+                        help="Maximum requests per second")
+    args = parser.parse_args(argv)
+
+    if args.template_file:
+        with open(args.template_file, "r", encoding="utf-8") as handle:
+            template_text = handle.read()
+    else:
+        template_text = args.template
+
+    result = run_template_batch(
+        template_text, load_rows(args.rows), args.output,
+        models=args.models or [DEFAULT_MODEL], temperature=args.temperature,
+        concurrency=args.concurrency, rate=args.rate,
+    )
+    print(f"{result['total']} jobs in {result['elapsed']:.1f}s "
+          f"({result['skipped']} already completed, skipped)")
+    for model, stats in result["models"].items():
+        print(f"{model}: {stats['completed']} ok, {stats['errors']} errors, "
+              f"{stats['rows_per_sec']:.2f} rows/s, "
+              f"p50 {stats['latency_p50']:.2f}s, p95 {stats['latency_p95']:.2f}s, "
+              f"{stats['input_tokens']} in / {stats['output_tokens']} out tokens"
+              + (f", ${stats['cost']:.4f}" if stats["cost"] is not None else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
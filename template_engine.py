@@ -0,0 +1,137 @@
+"""
+Compiled prompt templates.
+
+Templates use str.format syntax: "{name}" fields, "{{" and "}}" for literal
+braces, attribute/index access ("{user.name}", "{items[0]}"), conversions
+("{name!r}") and format specs, including nested fields ("{score:{width}}").
+A template is parsed once into literal and field segments, and compiled
+templates are cached by source, so a template used on every rerun or every
+batch row is never re-parsed.
+"""
+import functools
+import os
+from string import Formatter
+
+import _string
+
+# Number of compiled templates kept in memory (least recently used go first).
+TEMPLATE_CACHE_SIZE = int(os.environ.get("TEMPLATE_CACHE_SIZE", "512"))
+
+
+class TemplateError(ValueError):
+    """Raised when a template cannot be parsed."""
+
+
+class Template(object):
+    """
+    A parsed template. Use compile_template rather than building one directly.
+
+    Attributes:
+        source (str): The template text
+        variables (list): Top-level field names, in order of first use
+    """
+
+    __slots__ = ("source", "variables", "segments", "_render")
+
+    def __init__(self, source):
+        self.source = source
+        self.variables = []
+        # Literal strings and (name, accessors, conversion, spec) fields, in order
+        self.segments = []
+        try:
+            parsed = list(Formatter().parse(source))
+        except ValueError as e:
+            raise TemplateError(f"Invalid template: {e}") from None
+
+        for text, field_name, spec, conversion in parsed:
+            if text:
+                self.segments.append(text)
+            if field_name is not None:
+                self.segments.append(self._parse_field(field_name, spec, conversion))
+        self._render = self._compile()
+
+    def _parse_field(self, field_name, spec, conversion):
+        name, rest = _string.formatter_field_name_split(field_name)
+        if not isinstance(name, str) or not name:
+            raise TemplateError(f"Template fields must be named, got {{{field_name}}}")
+        if conversion and conversion not in "rsa":
+            raise TemplateError(f"Unknown conversion !{conversion} in {{{field_name}}}")
+        if name not in self.variables:
+            self.variables.append(name)
+
+        if spec and "{" in spec:
+            spec = Template(spec)
+            for var in spec.variables:
+                if var not in self.variables:
+                    self.variables.append(var)
+        return name, tuple(rest), conversion, spec
+
+    def _compile(self):
+        """
+        Turns the segment list into a single f-string function, so rendering
+        runs as bytecode instead of a Python loop over segments. Every
+        template-supplied string is passed in through `_c`, never spliced
+        into the generated source.
+        """
+        constants = []
+
+        def const(value):
+            constants.append(value)
+            return f"_c[{len(constants) - 1}]"
+
+        parts = []
+        for segment in self.segments:
+            if isinstance(segment, str):
+                parts.append(f"{{{const(segment)}}}")
+                continue
+            name, accessors, conversion, spec = segment
+            expr = f"_v[{const(name)}]"
+            for is_attr, key in accessors:
+                expr = f"getattr({expr}, {const(key)})" if is_attr else f"{expr}[{const(key)}]"
+            if conversion:
+                expr += f"!{conversion}"
+            if isinstance(spec, Template):
+                expr += f":{{{const(spec._render)}(_v)}}"
+            elif spec:
+                expr += f":{{{const(spec)}}}"
+            parts.append(f"{{{expr}}}")
+
+        code = f'def render(_v, _c):\n    return f"""{"".join(parts)}"""\n'
+        namespace = {}
+        exec(code, {"__builtins__": {"getattr": getattr}}, namespace)
+        return functools.partial(namespace["render"], _c=tuple(constants))
+
+    def render(self, values=None, **kwargs):
+        """
+        Fills in the template.
+
+        Args:
+            values (dict): Field values by name
+            **kwargs: More field values, overriding `values`
+
+        Returns:
+            str: The rendered text
+
+        Raises:
+            KeyError: If a variable has no value
+        """
+        if kwargs:
+            values = dict(values or {}, **kwargs)
+        return self._render(values)
+
+    def __repr__(self):
+        return f"Template({self.source!r})"
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(source):
+    """
+    Returns the compiled Template for a template string.
+
+    Results are cached by source text (lookups hash the string), so
+    compiling the same template again is a dictionary hit.
+
+    Raises:
+        TemplateError: If the template is malformed, e.g. an unmatched "{"
+    """
+    return Template(source)
@@ -0,0 +1,238 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from template_engine import TemplateError, compile_template
+
+logger = logging.getLogger(__name__)
+
+# Shared by every session and user of the app; like the response cache it
+# defaults to the working directory the app was started from.
+TEMPLATE_DB_PATH = os.environ.get("TEMPLATE_DB_PATH", "templates.sqlite3")
+
+# Template settings stored alongside the prompt text.
+FIELDS = ("prompt_template", "placeholder_json", "model_name", "temperature", "cache")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    author TEXT,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS template_versions (
+    name TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    author TEXT,
+    created REAL NOT NULL,
+    PRIMARY KEY (name, version)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS templates_fts USING fts5 (
+    name, prompt_template, variables, tokenize = 'unicode61'
+);
+CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO store_meta (key, value) VALUES ('revision', 0);
+"""
+
+
+def _variables(prompt_template):
+    try:
+        return compile_template(prompt_template).variables
+    except TemplateError:
+        return []
+
+
+def _fts_query(text):
+    """
+    Turns free text into an FTS5 query: every word must match, as a prefix.
+    Words are quoted, so FTS operators typed by users are searched literally.
+    """
+    words = text.split()
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+class TemplateStore(object):
+    """
+    Durable, versioned prompt templates in a SQLite file.
+
+    Every save adds a version to the template's history; the templates table
+    holds the latest one, and an FTS5 index covers name, prompt text and
+    template variables. A revision counter bumped on every write lets
+    callers (and all()) tell whether anything changed.
+    """
+
+    def __init__(self, path=TEMPLATE_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # WAL lets other app processes read while one of them saves.
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+        self._snapshot = (None, {})
+
+    def _bump(self):
+        self._db.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'revision'")
+
+    def revision(self):
+        """Returns a number that changes whenever any template changes."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT value FROM store_meta WHERE key = 'revision'").fetchone()[0]
+
+    def save(self, name, data, author=None):
+        """
+        Saves a new version of a template.
+
+        Args:
+            name (str): Template name
+            data (dict): prompt_template, placeholder_json, model_name,
+                temperature and cache
+            author (str): Who saved it, if known
+
+        Returns:
+            int: The new version number
+        """
+        data = {field: data.get(field) for field in FIELDS}
+        payload = json.dumps(data)
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT MAX(version) FROM template_versions WHERE name = ?", (name,)).fetchone()
+            version = (row[0] or 0) + 1
+            self._db.execute(
+                "INSERT INTO template_versions (name, version, data, author, created) "
+                "VALUES (?, ?, ?, ?, ?)", (name, version, payload, author, now))
+            self._unindex(name)
+            rowid = self._db.execute(
+                "INSERT INTO templates (name, version, data, author, updated) "
+                "VALUES (?, ?, ?, ?, ?)", (name, version, payload, author, now)).lastrowid
+            prompt_template = data["prompt_template"] or ""
+            self._db.execute(
+                "INSERT INTO templates_fts (rowid, name, prompt_template, variables) "
+                "VALUES (?, ?, ?, ?)",
+                (rowid, name, prompt_template, " ".join(_variables(prompt_template))))
+            self._bump()
+        return version
+
+    def delete(self, name):
+        """Removes a template from the library; its version history is kept."""
+        with self._lock, self._db:
+            self._unindex(name)
+            self._bump()
+
+    def _unindex(self, name):
+        # Index rows share the template row's rowid, so this is a key lookup.
+        row = self._db.execute("SELECT rowid FROM templates WHERE name = ?", (name,)).fetchone()
+        if row:
+            self._db.execute("DELETE FROM templates_fts WHERE rowid = ?", row)
+            self._db.execute("DELETE FROM templates WHERE rowid = ?", row)
+
+    def _record(self, name, version, data, author, updated):
+        record = json.loads(data)
+        record.update(version=version, author=author, updated=updated)
+        return name, record
+
+    def get(self, name, version=None):
+        """
+        Returns a template's settings (plus version, author and updated),
+        the latest version unless one is given, or None if there is none.
+        """
+        with self._lock:
+            if version is None:
+                row = self._db.execute(
+                    "SELECT name, version, data, author, updated FROM templates WHERE name = ?",
+                    (name,)).fetchone()
+            else:
+                row = self._db.execute(
+                    "SELECT name, version, data, author, created FROM template_versions "
+                    "WHERE name = ? AND version = ?", (name, version)).fetchone()
+        return self._record(*row)[1] if row else None
+
+    def versions(self, name):
+        """Returns a template's history, newest first, as dicts of version, author and created."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT version, author, created FROM template_versions WHERE name = ? "
+                "ORDER BY version DESC", (name,)).fetchall()
+        return [{"version": v, "author": a, "created": c} for v, a, c in rows]
+
+    def count(self):
+        """Returns the number of templates in the library."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM templates").fetchone()[0]
+
+    def search(self, query="", limit=20, offset=0):
+        """
+        Finds templates whose name, prompt text or variables match a query.
+
+        Args:
+            query (str): Words to match (as prefixes); empty lists everything
+            limit (int): Page size
+            offset (int): Results to skip
+
+        Returns:
+            tuple: (list of (name, template dict), total number of matches).
+                Matches are ranked by relevance, or sorted by name without
+                a query.
+        """
+        match = _fts_query(query or "")
+        with self._lock:
+            if not match:
+                total = self._db.execute("SELECT COUNT(*) FROM templates").fetchone()[0]
+                rows = self._db.execute(
+                    "SELECT name, version, data, author, updated FROM templates "
+                    "ORDER BY name LIMIT ? OFFSET ?", (limit, offset)).fetchall()
+            else:
+                total = self._db.execute(
+                    "SELECT COUNT(*) FROM templates_fts WHERE templates_fts MATCH ?",
+                    (match,)).fetchone()[0]
+                rows = self._db.execute(
+                    "SELECT t.name, t.version, t.data, t.author, t.updated "
+                    "FROM templates_fts JOIN templates t ON t.rowid = templates_fts.rowid "
+                    "WHERE templates_fts MATCH ? ORDER BY bm25(templates_fts), t.name "
+                    "LIMIT ? OFFSET ?", (match, limit, offset)).fetchall()
+        return [self._record(*row) for row in rows], total
+
+    def all(self):
+        """
+        Returns every template by name, e.g. for building Prompt blocks.
+
+        The result is rebuilt only when the revision changes, so calling
+        this on every rerun is cheap. Treat it as read-only.
+        """
+        return self.snapshot()[1]
+
+    def snapshot(self):
+        """
+        Returns (revision, templates): all() together with the revision it
+        reflects, for callers that cache things derived from the templates.
+        """
+        revision = self.revision()
+        if self._snapshot[0] == revision:
+            return self._snapshot
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT name, version, data, author, updated FROM templates ORDER BY name"
+            ).fetchall()
+        self._snapshot = (revision, dict(self._record(*row) for row in rows))
+        return self._snapshot
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Returns the process-wide TemplateStore (see TEMPLATE_DB_PATH)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = TemplateStore()
+        return _store
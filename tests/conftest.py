@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Module-level paths are read on import, so point every store at a scratch
+# directory before any app module is imported.
+_scratch = tempfile.mkdtemp(prefix="workbench-tests-")
+for name, default in {
+    "LLM_CACHE_PATH": "llm_cache.sqlite3",
+    "TEMPLATE_DB_PATH": "templates.sqlite3",
+    "JOB_DB_PATH": "jobs.sqlite3",
+    "RUN_DB_PATH": "flow_runs.sqlite3",
+    "RETRIEVAL_INDEX_PATH": "retrieval_index",
+    "BATCH_RESULTS_DIR": "batch_results",
+}.items():
+    os.environ[name] = os.path.join(_scratch, default)
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+
+@pytest.fixture
+def bedrock(monkeypatch):
+    """A local stand-in for Bedrock that the llm module's clients talk to."""
+    import llm
+    from benchmarks.stub_bedrock import StubBedrockServer
+
+    server = StubBedrockServer(reply="alpha beta gamma").start()
+    monkeypatch.setenv("BEDROCK_ENDPOINT_URL", server.url)
+    llm.clear_clients()
+    yield server
+    llm.clear_clients()
+    server.stop()
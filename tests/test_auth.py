@@ -0,0 +1,76 @@
+import time
+
+import pytest
+import streamlit as st
+
+import auth
+from auth import ApiClient, token_expiry
+from benchmarks.stub_auth import StubAuthServer, _jwt
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = StubAuthServer().start()
+    client = ApiClient(base_url=server.url)
+    monkeypatch.setattr(auth, "get_api_client", lambda: client)
+    server.users["ada"] = {"email": "ada@example.com", "password": "pw", "user_id": 1}
+    auth.logout()
+    yield server
+    auth.logout()
+    server.stop()
+
+
+def test_expiry_is_read_from_the_token():
+    assert token_expiry(_jwt({"exp": 1234})) == 1234.0
+    assert token_expiry(_jwt({"sub": "ada"})) is None
+    assert token_expiry("not a jwt") is None
+    assert token_expiry(None) is None
+
+
+def test_requests_share_pooled_connections(server):
+    client = ApiClient(base_url=server.url)
+    for _ in range(5):
+        assert client.login({"username": "ada", "password": "pw"}).status_code == 200
+    assert server.request_count["/login"] == 5
+    assert server.connection_count == 1
+
+
+def test_profiles_are_cached_until_forgotten(server):
+    client = ApiClient(base_url=server.url)
+    token = client.login({"username": "ada", "password": "pw"}).json()["access_token"]
+    assert client.profile(token)["username"] == "ada"
+    assert client.profile(token)["username"] == "ada"
+    assert server.request_count["/user"] == 1
+    client.forget(token)
+    client.profile(token)
+    assert server.request_count["/user"] == 2
+
+
+def test_refused_tokens_have_no_profile(server):
+    assert ApiClient(base_url=server.url).profile("bogus") is None
+
+
+def test_login_by_email_fills_the_session(server):
+    assert auth.login_user("ada@example.com", "pw")
+    assert st.session_state.logged_in and st.session_state.username == "ada"
+    assert st.session_state.token_expires_at == token_expiry(st.session_state.access_token)
+    assert not auth.login_user("ada", "wrong")
+
+
+def test_tokens_about_to_expire_are_refreshed(server):
+    server.token_ttl = auth.REFRESH_MARGIN / 2
+    auth.login_user("ada", "pw")
+    old = st.session_state.access_token
+    server.token_ttl = 900
+    token = auth.ensure_access_token()
+    assert token != old and server.request_count["/refresh"] == 1
+    assert st.session_state.token_expires_at > time.time() + auth.REFRESH_MARGIN
+    assert auth.get_user_profile()["username"] == "ada"
+
+
+def test_expired_tokens_that_cannot_be_refreshed_log_out(server):
+    server.token_ttl = -1
+    auth.login_user("ada", "pw")
+    st.session_state.refresh_token = "revoked"
+    assert auth.ensure_access_token() is None
+    assert not st.session_state.logged_in
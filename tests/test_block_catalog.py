@@ -0,0 +1,62 @@
+import blocks
+import flow_runner
+
+
+def _types(catalog):
+    return [block._type for block in catalog]
+
+
+def test_catalog_is_reused_until_the_templates_change():
+    state = {}
+    templates = {"Summary": {"prompt_template": "Summarize {input}"}}
+    catalog = blocks.cached_blocks(state, templates, 1)
+    assert blocks.cached_blocks(state, templates, 1) is catalog
+    assert "Prompt: Summary" in _types(catalog)
+
+    templates = dict(templates, Title={"prompt_template": "Title for {input}"})
+    rebuilt = blocks.cached_blocks(state, templates, 2)
+    assert rebuilt is not catalog
+    assert "Prompt: Title" in _types(rebuilt)
+
+
+def test_catalog_follows_the_model_catalog_and_pack_option(monkeypatch):
+    state = {}
+    catalog = blocks.cached_blocks(state, {}, 1)
+    assert "Pack Block" not in _types(catalog)
+    with_pack = blocks.cached_blocks(state, {}, 1, include_pack=True)
+    assert "Pack Block" in _types(with_pack)
+
+    monkeypatch.setattr(blocks, "catalog_version", lambda: "edited")
+    assert blocks.cached_blocks(state, {}, 1, include_pack=True) is not with_pack
+
+
+def test_sessions_never_share_blocks():
+    first, second = {}, {}
+    assert blocks.cached_blocks(first, {}, 1) is not blocks.cached_blocks(second, {}, 1)
+
+
+def _schema():
+    def node(node_id, block_type, interfaces):
+        return {"id": node_id, "name": node_id, "type": block_type, "options": [],
+                "interfaces": [[name, {"id": f"{node_id}:{name}"}] for name in interfaces]}
+
+    return {
+        "nodes": [node("init", "Init Block", ["output_0"]),
+                  node("final", "Final Output", ["input_0"])],
+        "connections": [{"from": "init:output_0", "to": "final:input_0"}],
+    }
+
+
+def test_a_batch_builds_its_blocks_once(monkeypatch):
+    builds = []
+    build_blocks = flow_runner.build_blocks
+
+    def counting(**kwargs):
+        builds.append(kwargs)
+        return build_blocks(**kwargs)
+
+    monkeypatch.setattr(flow_runner, "build_blocks", counting)
+    records = dict(flow_runner.run_batch(_schema(), ["a", "b", "c"], templates={}, concurrency=2))
+    assert [records[i]["status"] for i in range(3)] == ["ok"] * 3
+    assert [records[i]["final_outputs"]["final"]["text"] for i in range(3)] == ["a", "b", "c"]
+    assert len(builds) == 1
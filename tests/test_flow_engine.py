@@ -0,0 +1,185 @@
+import time
+
+import pytest
+from barfi import Block
+
+from flow_engine import FlowMemo, run_flow
+from flow_sinks import ResultSink, get_sink
+
+computed = []
+
+
+def source_compute(self):
+    computed.append(self._name)
+    self.set_interface(name="output_0", value=get_sink().get_value("init_input", "") + "!")
+
+
+def upper_compute(self):
+    computed.append(self._name)
+    self.set_interface(name="output_0", value=self.get_interface(name="input_0").upper())
+
+
+def fail_compute(self):
+    computed.append(self._name)
+    raise RuntimeError("upper failed")
+
+
+def sleep_compute(self):
+    time.sleep(0.3)
+    self.set_interface(name="output_0", value=self.get_interface(name="input_0"))
+
+
+def output_compute(self):
+    computed.append(self._name)
+    get_sink().result("Final", self.get_interface(name="input_0"))
+
+
+def _blocks(fail=False):
+    source = Block(name="Source")
+    source.add_output(name="output_0")
+    source.add_compute(source_compute)
+    upper = Block(name="Upper")
+    upper.add_input(name="input_0")
+    upper.add_output(name="output_0")
+    upper.add_option(name="suffix", type="input", value="")
+    upper.add_compute(fail_compute if fail else upper_compute)
+    output = Block(name="Output")
+    output.add_input(name="input_0")
+    output.add_compute(output_compute)
+    sleep = Block(name="Sleep")
+    sleep.add_input(name="input_0")
+    sleep.add_output(name="output_0")
+    sleep.add_compute(sleep_compute)
+    return [source, upper, output, sleep]
+
+
+def _node(node_id, block_type, inputs=(), outputs=(), options=()):
+    return {"id": node_id, "name": node_id, "type": block_type, "options": list(options),
+            "interfaces": [[name, {"id": f"{node_id}:{name}"}] for name in (*inputs, *outputs)]}
+
+
+def _schema(suffix=""):
+    return {
+        "nodes": [
+            _node("source", "Source", outputs=["output_0"]),
+            _node("upper", "Upper", inputs=["input_0"], outputs=["output_0"],
+                  options=[["suffix", suffix]]),
+            _node("output", "Output", inputs=["input_0"]),
+        ],
+        "connections": [
+            {"from": "source:output_0", "to": "upper:input_0"},
+            {"from": "upper:output_0", "to": "output:input_0"},
+        ],
+    }
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    computed.clear()
+
+
+def _finals(sink):
+    return [event["value"]["value"] for event in sink.events if event["kind"] == "result"]
+
+
+def test_blocks_run_in_dependency_order():
+    sink = ResultSink(values={"init_input": "hi"})
+    result = run_flow(_blocks(), _schema(), sink=sink)
+    assert computed == ["source", "upper", "output"]
+    assert _finals(sink) == ["HI!"]
+    assert {name: r["status"] for name, r in result["results"].items()} == \
+        {"source": "Computed", "upper": "Computed", "output": "Computed"}
+
+
+def test_descendants_of_a_failed_block_are_skipped():
+    result = run_flow(_blocks(fail=True), _schema(), sink=ResultSink(values={"init_input": "hi"}))
+    assert computed == ["source", "upper"]
+    assert result["results"]["upper"]["status"] == "Errored"
+    assert result["results"]["output"]["status"] == "Skipped"
+
+
+def test_independent_branches_run_concurrently():
+    schema = {
+        "nodes": [_node("source", "Source", outputs=["output_0"]),
+                  _node("left", "Sleep", inputs=["input_0"], outputs=["output_0"]),
+                  _node("right", "Sleep", inputs=["input_0"], outputs=["output_0"])],
+        "connections": [{"from": "source:output_0", "to": "left:input_0"},
+                        {"from": "source:output_0", "to": "right:input_0"}],
+    }
+    result = run_flow(_blocks(), schema, sink=ResultSink(values={"init_input": "hi"}), max_workers=2)
+    assert result["serial_time"] >= 0.6
+    assert result["wall_time"] < 0.55
+    assert result["critical_path"][0] == "source"
+
+
+def test_cycles_are_rejected():
+    schema = _schema()
+    schema["nodes"][0] = _node("source", "Upper", inputs=["input_0"], outputs=["output_0"])
+    schema["connections"].append({"from": "upper:output_0", "to": "source:input_0"})
+    with pytest.raises(ValueError, match="Cycle"):
+        run_flow(_blocks(), schema, sink=ResultSink())
+
+
+def test_memo_reuses_unchanged_blocks():
+    memo = FlowMemo()
+    run_flow(_blocks(), _schema(), sink=ResultSink(values={"init_input": "hi"}), memo=memo)
+    computed.clear()
+
+    sink = ResultSink(values={"init_input": "hi"})
+    result = run_flow(_blocks(), _schema(), sink=sink, memo=memo)
+    assert result["reused"] == 2
+    assert result["results"]["upper"]["reused"]
+    # Blocks without outputs only display, so they run every time.
+    assert computed == ["output"]
+    assert _finals(sink) == ["HI!"]
+
+
+def test_memo_recomputes_downstream_of_an_edit():
+    memo = FlowMemo()
+    run_flow(_blocks(), _schema(), sink=ResultSink(values={"init_input": "hi"}), memo=memo)
+    computed.clear()
+    run_flow(_blocks(), _schema(suffix="edited"), sink=ResultSink(values={"init_input": "hi"}),
+             memo=memo)
+    assert computed == ["upper", "output"]
+
+
+def test_memo_recomputes_when_a_session_value_changes():
+    memo = FlowMemo()
+    run_flow(_blocks(), _schema(), sink=ResultSink(values={"init_input": "hi"}), memo=memo)
+    computed.clear()
+    sink = ResultSink(values={"init_input": "bye"})
+    run_flow(_blocks(), _schema(), sink=sink, memo=memo)
+    assert computed == ["source", "upper", "output"]
+    assert _finals(sink) == ["BYE!"]
+
+
+def test_memo_does_not_keep_output_less_blocks():
+    memo = FlowMemo()
+    run_flow(_blocks(), _schema(), sink=ResultSink(values={"init_input": "hi"}), memo=memo)
+    assert len(memo) == 2
+
+
+def test_replay_serves_recorded_blocks():
+    first = run_flow(_blocks(), _schema(), sink=ResultSink(values={"init_input": "hi"}))
+    replay = {info["node_id"]: {"fingerprint": info["fingerprint"], "reads": info["reads"],
+                                "outputs": info["outputs"]}
+              for info in first["results"].values()}
+    computed.clear()
+
+    sink = ResultSink(values={"init_input": "hi"})
+    result = run_flow(_blocks(), _schema(), sink=sink, replay=replay)
+    assert result["replayed"] == 2
+    assert computed == ["output"]
+    assert _finals(sink) == ["HI!"]
+
+
+def test_replay_recomputes_blocks_left_out_and_downstream():
+    first = run_flow(_blocks(), _schema(), sink=ResultSink(values={"init_input": "hi"}))
+    source = first["results"]["source"]
+    replay = {"source": {"fingerprint": source["fingerprint"], "reads": source["reads"],
+                         "outputs": source["outputs"]}}
+    computed.clear()
+    result = run_flow(_blocks(), _schema(), sink=ResultSink(values={"init_input": "hi"}),
+                      replay=replay)
+    assert result["results"]["source"]["replayed"]
+    assert computed == ["upper", "output"]
@@ -0,0 +1,123 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from job_queue import JobQueue
+
+
+def _echo(payload):
+    return {"echo": payload["value"]}
+
+
+def _fail(payload):
+    raise RuntimeError("handler failed")
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "jobs.sqlite3")
+
+
+def _queue(path, **kwargs):
+    kwargs.setdefault("handlers", {"echo": _echo, "fail": _fail})
+    return JobQueue(path=path, workers=2, **kwargs)
+
+
+def test_jobs_run_and_record_their_result(path):
+    queue = _queue(path).start()
+    try:
+        done = queue.wait(queue.submit("echo", {"value": 1}, owner="ada"), timeout=5)
+        failed = queue.wait(queue.submit("fail", {}, owner="ada"), timeout=5)
+    finally:
+        queue.stop()
+    assert done["status"] == "done" and done["result"] == {"echo": 1}
+    assert failed["status"] == "error" and failed["error"] == "handler failed"
+    assert [job["id"] for job in queue.jobs("ada")] == [failed["id"], done["id"]]
+
+
+def test_unknown_kinds_are_rejected(path):
+    with pytest.raises(ValueError):
+        _queue(path).submit("nope", {})
+
+
+def test_higher_priority_jobs_are_claimed_first(path):
+    order = []
+    queue = _queue(path, handlers={"echo": lambda payload: order.append(payload["value"])})
+    queue.submit("echo", {"value": "default"}, priority=10)
+    queue.submit("echo", {"value": "premium"}, priority=0)
+    queue.workers = 1
+    queue.start()
+    try:
+        while len(order) < 2:
+            time.sleep(0.01)
+    finally:
+        queue.stop()
+    assert order == ["premium", "default"]
+
+
+def test_a_job_is_claimed_only_once(path):
+    first, second = _queue(path), _queue(path)
+    job_id = first.submit("echo", {"value": 1})
+    first._execute(job_id)
+    second._execute(job_id)
+    job = first.get(job_id)
+    assert job["status"] == "done"
+    worker = sqlite3.connect(path).execute("SELECT worker FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+    assert worker == first.worker_id
+
+
+def test_queued_jobs_survive_a_restart(path):
+    job_id = _queue(path).submit("echo", {"value": 2})
+    queue = _queue(path).start()
+    try:
+        assert queue.wait(job_id, timeout=5)["result"] == {"echo": 2}
+    finally:
+        queue.stop()
+
+
+def _running_job(path, lease_until, worker="gone:1:dead"):
+    job_id = _queue(path).submit("echo", {"value": 3})
+    with sqlite3.connect(path) as db:
+        db.execute("UPDATE jobs SET status = 'running', started = ?, worker = ?, lease_until = ? "
+                   "WHERE id = ?", (time.time(), worker, lease_until, job_id))
+    return job_id
+
+
+def test_jobs_with_an_expired_lease_are_recovered(path):
+    job_id = _running_job(path, lease_until=time.time() - 1)
+    queue = _queue(path).start()
+    try:
+        assert queue.wait(job_id, timeout=5)["status"] == "done"
+    finally:
+        queue.stop()
+
+
+def test_jobs_from_before_leases_are_recovered(path):
+    job_id = _running_job(path, lease_until=None, worker=None)
+    assert _queue(path).get(job_id)["status"] == "queued"
+
+
+def test_jobs_with_a_live_lease_are_left_alone(path):
+    job_id = _running_job(path, lease_until=time.time() + 60)
+    queue = _queue(path)
+    assert queue.get(job_id)["status"] == "running"
+    assert queue.stats()["queued"] == 0
+
+
+def test_running_jobs_keep_their_lease_and_orphans_are_taken_over(path):
+    release = threading.Event()
+    owner = _queue(path, handlers={"echo": lambda payload: release.wait(5)}, lease=0.3).start()
+    try:
+        job_id = owner.submit("echo", {"value": 4})
+        time.sleep(1.0)
+        # Renewed past several lease periods, so another process leaves it be.
+        assert _queue(path, lease=0.3).get(job_id)["status"] == "running"
+        orphan = _running_job(path, lease_until=time.time() + 0.2)
+        release.set()
+        assert owner.wait(job_id, timeout=5)["status"] == "done"
+        assert owner.wait(orphan, timeout=5)["status"] == "done"
+    finally:
+        release.set()
+        owner.stop()
@@ -0,0 +1,184 @@
+import threading
+import time
+
+import pytest
+
+import llm
+from model_catalog import get_model
+
+PRIMARY = "anthropic.claude-3-sonnet-20240229-v1:0"
+BACKUP = "anthropic.claude-3-haiku-20240307-v1:0"
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """Records client builds instead of creating ChatBedrock clients."""
+    built = []
+
+    def build(model, region, max_tokens, model_kwargs):
+        built.append((model, region))
+        return object()
+
+    monkeypatch.setattr(llm, "_build_client", build)
+    monkeypatch.setattr(llm, "MAX_CLIENTS", 2)
+    llm.clear_clients()
+    yield built
+    llm.clear_clients()
+
+def test_clients_are_shared_per_configuration(builds):
+    client = llm.get_client(model="a", temperature=0)
+    assert llm.get_client(model="a", temperature=0) is client
+    assert llm.get_client(model="a", temperature=0.5) is not client
+    assert llm.get_client(model="a", max_tokens=10, temperature=0) is not client
+    assert len(builds) == 3
+
+def test_least_recently_used_client_is_dropped(builds):
+    a = llm.get_client(model="a")
+    llm.get_client(model="b")
+    assert llm.get_client(model="a") is a
+    llm.get_client(model="c")  # Over MAX_CLIENTS: "b" goes, "a" was used more recently
+    assert llm.get_client(model="a") is a
+    llm.get_client(model="b")
+    assert [model for model, _ in builds] == ["a", "b", "c", "b"]
+
+
+def test_clients_send_the_catalog_max_tokens(bedrock):
+    model = "meta.llama3-8b-instruct-v1:0"
+    client, _ = llm._model_setup(model, None, 0.5)
+    assert client.max_tokens == get_model(model)["max_tokens"]
+    assert client.temperature == 0.5
+
+
+@pytest.fixture
+def routes(monkeypatch):
+    """
+    Replaces stream_llm with scripted routes: model id -> (delay before the
+    first chunk, chunks, or an exception to raise).
+    """
+    script = {}
+    started = []
+
+    def stream_llm(prompt, model, temperature, region, stats, cache, budget):
+        started.append(model)
+        delay, outcome = script[model]
+        time.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        stats["ttft"] = delay
+        yield from outcome
+
+    monkeypatch.setattr(llm, "stream_llm", stream_llm)
+    return script, started
+
+
+def test_routing_needs_a_route():
+    with pytest.raises(ValueError):
+        list(llm.stream_routed("hi", []))
+
+
+def test_single_route_uses_the_primary_only(routes):
+    script, started = routes
+    script[PRIMARY] = (0, RuntimeError("down"))
+    script[BACKUP] = (0, ["backup"])
+    with pytest.raises(RuntimeError, match="down"):
+        list(llm.stream_routed("hi", [PRIMARY, BACKUP], policy=llm.ROUTE_SINGLE))
+    assert started == [PRIMARY]
+
+
+def test_fallback_after_a_failure(routes):
+    script, started = routes
+    script[PRIMARY] = (0, RuntimeError("throttled"))
+    script[BACKUP] = (0, ["from ", "backup"])
+    stats = {}
+    assert "".join(llm.stream_routed("hi", [PRIMARY, BACKUP], stats=stats)) == "from backup"
+    assert stats["model"] == BACKUP and stats["fallback"]
+    assert [attempt["outcome"] for attempt in stats["attempts"]] == ["failed", "answered"]
+
+
+def test_fallback_after_no_first_token(routes):
+    script, _ = routes
+    script[PRIMARY] = (1.0, ["late"])
+    script[BACKUP] = (0, ["backup"])
+    stats = {}
+    start = time.monotonic()
+    text = "".join(llm.stream_routed("hi", [PRIMARY, BACKUP], first_token_timeout=0.2, stats=stats))
+    assert text == "backup"
+    assert time.monotonic() - start < 0.9
+    assert [attempt["outcome"] for attempt in stats["attempts"]] == ["timeout", "answered"]
+
+
+def test_every_route_failing_raises_the_last_error(routes):
+    script, started = routes
+    script[PRIMARY] = (0, RuntimeError("first"))
+    script[BACKUP] = (0, RuntimeError("second"))
+    with pytest.raises(RuntimeError, match="second"):
+        list(llm.stream_routed("hi", [PRIMARY, BACKUP]))
+    assert started == [PRIMARY, BACKUP]
+
+
+def test_duplicate_routes_are_tried_once(routes):
+    script, started = routes
+    script[PRIMARY] = (0, RuntimeError("down"))
+    with pytest.raises(RuntimeError):
+        list(llm.stream_routed("hi", [PRIMARY, (PRIMARY, None)]))
+    assert started == [PRIMARY]
+
+
+def test_hedged_request_keeps_the_first_answer(routes):
+    script, _ = routes
+    script[PRIMARY] = (0.6, ["slow"])
+    script[BACKUP] = (0, ["fast"])
+    stats = {}
+    text = "".join(llm.stream_routed("hi", [PRIMARY, BACKUP], policy=llm.ROUTE_HEDGED,
+                                     hedge_after=0.1, stats=stats))
+    assert text == "fast"
+    assert stats["hedged"] and stats["fallback"]
+    assert [attempt["outcome"] for attempt in stats["attempts"]] == ["abandoned", "answered"]
+
+
+def test_hedged_primary_that_answers_in_time_is_not_hedged(routes):
+    script, started = routes
+    script[PRIMARY] = (0, ["quick"])
+    script[BACKUP] = (0, ["unused"])
+    stats = {}
+    assert "".join(llm.stream_routed("hi", [PRIMARY, BACKUP], policy=llm.ROUTE_HEDGED,
+                                     hedge_after=0.5, stats=stats)) == "quick"
+    assert started == [PRIMARY] and not stats["hedged"]
+
+
+def test_hedging_waits_no_longer_than_falling_back(routes):
+    script, _ = routes
+    script[PRIMARY] = (1.0, ["slow"])
+    script[BACKUP] = (0, ["fast"])
+    start = time.monotonic()
+    text = "".join(llm.stream_routed("hi", [PRIMARY, BACKUP], policy=llm.ROUTE_HEDGED,
+                                     hedge_after=30, first_token_timeout=0.2))
+    assert text == "fast"
+    assert time.monotonic() - start < 0.9
+
+
+def test_hedged_failures_fall_through_to_the_next_route(routes):
+    script, _ = routes
+    script[PRIMARY] = (0, RuntimeError("down"))
+    script[BACKUP] = (0, ["backup"])
+    assert "".join(llm.stream_routed("hi", [PRIMARY, BACKUP], policy=llm.ROUTE_HEDGED,
+                                     hedge_after=10)) == "backup"
+
+
+def test_an_error_after_the_first_chunk_is_raised(routes):
+    script, started = routes
+    ready = threading.Event()
+
+    def broken():
+        yield "partial"
+        ready.wait(1)
+        raise RuntimeError("cut off")
+
+    script[PRIMARY] = (0, broken())
+    script[BACKUP] = (0, ["backup"])
+    chunks = llm.stream_routed("hi", [PRIMARY, BACKUP])
+    assert next(chunks) == "partial"
+    ready.set()
+    with pytest.raises(RuntimeError, match="cut off"):
+        list(chunks)
+    assert started == [PRIMARY]
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+import model_catalog
+from model_catalog import estimate_cost, get_catalog, get_model, load_catalog, model_ids, route_model
+
+CATALOG = """
+models:
+  - id: fast
+    block: Fast (Model)
+    max_tokens: 256
+    input_cost_per_1k: 0.001
+    output_cost_per_1k: 0.002
+    latency_p50: 1.0
+  - id: cheap
+    label: Cheap
+    max_tokens: 256
+    input_cost_per_1k: 0.0001
+    output_cost_per_1k: 0.0002
+    latency_p50: 8.0
+"""
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    path = tmp_path / "models.yaml"
+    path.write_text(CATALOG, encoding="utf-8")
+    monkeypatch.setattr(model_catalog, "CATALOG_PATH", str(path))
+    return path
+
+
+def test_entries_get_every_field(catalog):
+    assert model_ids() == ["fast", "cheap"]
+    assert get_model("fast")["label"] == "fast"
+    assert get_model("cheap")["context_window"] is None
+
+
+def test_unknown_models_get_a_bare_entry(catalog):
+    spec = get_model("someone.else-v1")
+    assert (spec["id"], spec["label"], spec["max_tokens"]) == ("someone.else-v1", "someone.else-v1", None)
+    assert estimate_cost("someone.else-v1", 1000, 1000) is None
+
+
+def test_the_catalog_is_reread_when_the_file_changes(catalog):
+    first = get_catalog()
+    assert get_catalog() is first
+    version = model_catalog.catalog_version()
+    catalog.write_text(CATALOG.replace("max_tokens: 256\n    input_cost_per_1k: 0.001",
+                                       "max_tokens: 512\n    input_cost_per_1k: 0.001"), encoding="utf-8")
+    os.utime(catalog, (os.path.getatime(catalog), os.path.getmtime(catalog) + 1))
+    assert model_catalog.catalog_version() != version
+    assert get_model("fast")["max_tokens"] == 512
+
+
+@pytest.mark.parametrize("text, error", [
+    ("models:\n  - label: no id\n", "without an id"),
+    ("models:\n  - id: a\n  - id: a\n", "listed twice"),
+    ("models:\n  - id: a\n    block: X\n  - id: b\n    block: X\n", "used by two"),
+])
+def test_invalid_catalogs_are_rejected(tmp_path, text, error):
+    path = tmp_path / "models.yaml"
+    path.write_text(text, encoding="utf-8")
+    with pytest.raises(ValueError, match=error):
+        load_catalog(str(path))
+
+
+def test_costs_come_from_the_catalog(catalog):
+    assert estimate_cost("fast", 1000, 500) == pytest.approx(0.002)
+
+
+def test_routing_picks_the_cheapest_model_within_the_budget(catalog):
+    assert route_model() == "cheap"
+    assert route_model(latency_budget=2.0) == "fast"
+    # Measured latencies win over the catalog's.
+    assert route_model(latency_budget=2.0, observed={"cheap": 1.5}) == "cheap"
+    # Nothing fits: the fastest model is used.
+    assert route_model(latency_budget=0.1) == "fast"
@@ -0,0 +1,78 @@
+import copy
+import gc
+import json
+
+from payload import (BLOB_MIN_CHARS, COMPLETION, SEARCH, TEXT, BlobStore, as_payload, completion_payload,
+                     from_json, get_blob_store, passages_payload, search_payload, text_payload, to_jsonable)
+
+
+def _large_results(tag):
+    return [{"url": f"https://example.com/{tag}/{i}", "content": "x" * 100} for i in range(BLOB_MIN_CHARS // 100)]
+
+
+def test_identical_large_bodies_are_held_once():
+    store = get_blob_store()
+    before = store.stats()
+    first = search_payload("web", "llamas", _large_results("shared"))
+    second = search_payload("web", "llamas", _large_results("shared"))
+    assert first.body is second.body
+    after = store.stats()
+    assert after["puts"] - before["puts"] == 2
+    assert after["shared"] - before["shared"] == 1
+
+
+def test_small_bodies_stay_inline():
+    before = get_blob_store().stats()["puts"]
+    search_payload("web", "llamas", ["one result"])
+    assert get_blob_store().stats()["puts"] == before
+
+
+def test_blobs_are_dropped_with_their_last_payload():
+    store = BlobStore()
+    serialized = json.dumps(["y" * BLOB_MIN_CHARS])
+    blob = store.put(["y" * BLOB_MIN_CHARS], serialized)
+    assert store.stats()["blobs"] == 1 and store.stats()["chars"] == len(serialized)
+    del blob
+    gc.collect()
+    assert store.stats()["blobs"] == 0
+
+
+def test_digests_follow_the_content():
+    assert text_payload("a").digest == text_payload("a").digest
+    assert text_payload("a").digest != text_payload("b").digest
+    assert text_payload("a").digest != text_payload("a", source="x").digest
+    large = _large_results("digest")
+    assert search_payload("web", "q", large).digest == search_payload("web", "q", list(large)).digest
+
+
+def test_search_text_is_rendered_from_the_body():
+    payload = search_payload("web", "llamas", [{"url": "https://example.com", "content": "Llamas."}, "More."])
+    assert payload.kind == SEARCH and payload.meta["count"] == 2
+    assert payload.text == "https://example.com\nLlamas.\n\nMore."
+    passages = passages_payload("llamas", [{"source": "notes", "text": "Llamas."}])
+    assert passages.text == "[1] (notes) Llamas."
+
+
+def test_copies_are_the_payload_itself():
+    payload = completion_payload("prompt", "model", "answer")
+    assert copy.copy(payload) is payload
+    assert copy.deepcopy({"out": payload})["out"] is payload
+
+
+def test_json_round_trip():
+    payload = completion_payload("prompt", "model", "answer", route="primary")
+    record = json.loads(json.dumps(to_jsonable({"out": [payload]})))["out"][0]
+    rebuilt = from_json(record)
+    assert (rebuilt.kind, rebuilt.text, rebuilt.meta) == (COMPLETION, "answer", payload.meta)
+    assert rebuilt.digest == payload.digest
+
+
+def test_plain_values_are_wrapped():
+    assert as_payload(None) is None
+    text = text_payload("t")
+    assert as_payload(text) is text
+    assert as_payload("t").kind == TEXT
+    assert as_payload({"input": "p", "model": "m", "output": 42}).text == "42"
+    assert as_payload({"query": "q", "results": ["r"]}).meta["query"] == "q"
+    assert as_payload(["a", "b"]).body == ["a", "b"]
+    assert not as_payload("") and as_payload([])
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from rate_limit import AdaptiveLimiter, RateLimiter, get_limiter, reset_limiters
+
+
+def test_token_bucket_spaces_out_requests():
+    limiter = RateLimiter(rate=20, burst=1)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.18
+
+
+def test_no_rate_means_no_limit():
+    limiter = RateLimiter(rate=None)
+    start = time.monotonic()
+    for _ in range(1000):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.1
+
+
+def test_concurrency_is_capped_until_a_release():
+    limiter = AdaptiveLimiter(max_concurrency=2)
+    limiter.acquire()
+    limiter.acquire()
+    admitted = threading.Event()
+    threading.Thread(target=lambda: (limiter.acquire(), admitted.set()), daemon=True).start()
+    assert not admitted.wait(0.2)
+    limiter.release()
+    assert admitted.wait(1)
+    assert limiter.stats()["in_flight"] == 2
+
+
+def test_throttling_cuts_the_rate_and_pauses_admissions():
+    limiter = AdaptiveLimiter(max_concurrency=8, backoff=0.2)
+    assert limiter.rate is None
+    for _ in range(4):
+        limiter.acquire()
+    limiter.release(throttled=True)
+    rate = limiter.rate
+    assert rate is not None
+    # Requests sent before the cut are throttled too, but cut the rate once.
+    limiter.release(throttled=True)
+    assert limiter.rate == rate
+    assert limiter.stats()["throttles"] == 2
+
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.1
+
+
+def test_successes_raise_the_rate_up_to_the_ceiling():
+    limiter = AdaptiveLimiter(max_concurrency=8, max_rate=100, backoff=0.01, increase=400, window=0.1)
+    for _ in range(8):
+        limiter.acquire()
+    limiter.release(throttled=True)
+    cut = limiter.rate
+    assert cut < 100
+    time.sleep(0.02)
+    for _ in range(7):
+        limiter.release()
+    assert cut < limiter.rate <= 100
+
+
+def test_the_rate_never_drops_below_the_floor():
+    limiter = AdaptiveLimiter(max_concurrency=10, min_rate=0.5, backoff=0.001, max_backoff=0.001)
+    for _ in range(10):
+        limiter.acquire()
+    for _ in range(10):
+        time.sleep(0.002)
+        limiter.release(throttled=True)
+    assert limiter.rate == 0.5
+
+
+def test_async_callers_share_the_cap():
+    limiter = AdaptiveLimiter(max_concurrency=2)
+    peak = []
+
+    async def call():
+        await limiter.acquire_async()
+        peak.append(limiter.in_flight)
+        await asyncio.sleep(0.02)
+        limiter.release()
+
+    async def main():
+        await asyncio.gather(*(call() for _ in range(6)))
+
+    asyncio.run(main())
+    assert max(peak) == 2
+    assert limiter.stats()["admitted"] == 6
+
+
+@pytest.fixture
+def limiters():
+    reset_limiters()
+    yield
+    reset_limiters()
+
+
+def test_each_model_gets_its_own_limiter(limiters):
+    assert get_limiter("a") is get_limiter("a")
+    assert get_limiter("a") is not get_limiter("b")
+
+
+def test_new_limits_apply_without_losing_the_learned_rate(limiters):
+    limiter = get_limiter("a", max_concurrency=4, max_rate=10)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    learned = limiter.rate
+    assert get_limiter("a", max_concurrency=8, max_rate=20) is limiter
+    assert (limiter.max_concurrency, limiter.max_rate) == (8, 20)
+    assert limiter.rate == learned
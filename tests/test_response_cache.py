@@ -0,0 +1,63 @@
+import time
+
+import llm
+from response_cache import ResponseCache, make_key
+
+HAIKU = "anthropic.claude-3-haiku-20240307-v1:0"
+
+
+def test_make_key_ignores_field_order():
+    assert make_key(a=1, b="x") == make_key(b="x", a=1)
+    assert make_key(a=1, b="x") != make_key(a=2, b="x")
+
+
+def test_entries_expire_in_memory_and_on_disk(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResponseCache(path=path, ttl=0.2)
+    cache.set("k", {"text": "hello"})
+    assert cache.get("k") == {"text": "hello"}
+    # A fresh instance has an empty memory tier, so this is a disk hit.
+    assert ResponseCache(path=path, ttl=0.2).get("k") == {"text": "hello"}
+
+    time.sleep(0.3)
+    assert cache.get("k") is None
+    assert ResponseCache(path=path, ttl=0.2).get("k") is None
+    assert cache.stats()["disk_entries"] == 0
+
+
+def test_memory_tier_drops_least_recently_used(tmp_path):
+    cache = ResponseCache(path=None, memory_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_only_deterministic_requests_are_cached_by_default():
+    assert llm._should_cache(0, None)
+    assert not llm._should_cache(0.7, None)
+    assert llm._should_cache(0.7, True)
+    assert not llm._should_cache(0, False)
+
+
+def test_call_llm_serves_repeats_from_the_cache(bedrock):
+    first = llm.call_llm("cache me", model=HAIKU, temperature=0)
+    second = llm.call_llm("cache me", model=HAIKU, temperature=0)
+    assert second.content == first.content
+    assert second.response_metadata.get("cached")
+    assert bedrock.request_count == 1
+
+
+def test_call_llm_samples_again_without_opting_in(bedrock):
+    llm.call_llm("sample me", model=HAIKU, temperature=0.7)
+    second = llm.call_llm("sample me", model=HAIKU, temperature=0.7)
+    assert not second.response_metadata.get("cached")
+    assert bedrock.request_count == 2
+
+    llm.call_llm("sample me too", model=HAIKU, temperature=0.7, cache=True)
+    assert llm.call_llm("sample me too", model=HAIKU, temperature=0.7, cache=True) \
+        .response_metadata.get("cached")
+    assert bedrock.request_count == 3
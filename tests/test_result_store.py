@@ -0,0 +1,63 @@
+from payload import search_payload, text_payload
+from result_store import PAGE_CHARS, PAGE_ITEMS, ResultStore, get_page, page_count, preview
+
+
+def test_previews_are_cut_to_the_limit():
+    assert preview("short", limit=10) == ("short", False)
+    assert preview("x" * 20, limit=10) == ("x" * 10 + "…", True)
+    assert preview({"answer": "ünïcode"}, limit=100) == ('{"answer": "ünïcode"}', False)
+    assert preview(text_payload("y" * 20), limit=5) == ("y" * 5 + "…", True)
+
+
+def test_long_text_is_paged_by_characters():
+    text = "a" * PAGE_CHARS + "b" * 10
+    assert page_count(text) == 2
+    assert get_page(text, 1) == "b" * 10
+
+
+def test_lists_and_dicts_are_paged_by_items():
+    items = list(range(PAGE_ITEMS * 2 + 1))
+    assert page_count(items) == 3
+    assert get_page(items, 2) == [PAGE_ITEMS * 2]
+    mapping = {f"k{i:02d}": i for i in range(PAGE_ITEMS + 2)}
+    assert page_count(mapping) == 2
+    assert get_page(mapping, 1) == {f"k{PAGE_ITEMS:02d}": PAGE_ITEMS, f"k{PAGE_ITEMS + 1:02d}": PAGE_ITEMS + 1}
+
+
+def test_search_results_keep_their_query_on_every_page():
+    value = {"query": "llamas", "results": [f"result {i}" for i in range(PAGE_ITEMS + 3)]}
+    assert page_count(value) == 2
+    assert get_page(value, 1) == {"query": "llamas", "results": ["result 10", "result 11", "result 12"]}
+
+
+def test_payloads_are_paged_by_their_body():
+    payload = search_payload("web", "llamas", [f"result {i}" for i in range(PAGE_ITEMS + 1)])
+    assert page_count(payload) == 2
+    assert get_page(payload, 1) == [f"result {PAGE_ITEMS}"]
+
+
+def test_store_drops_the_oldest_results_past_its_count():
+    store = ResultStore(max_results=2)
+    first = store.put("one", block="A", label="out")
+    store.put("two")
+    store.put("three")
+    assert store.get(first["id"]) is None
+    assert [entry["value"] for entry in store.entries()] == ["two", "three"]
+
+
+def test_store_drops_the_oldest_results_past_its_size():
+    store = ResultStore(max_chars=10)
+    store.put("x" * 6)
+    store.put("y" * 6)
+    assert [entry["value"] for entry in store.entries()] == ["y" * 6]
+    # The newest result is kept even when it alone is over the limit.
+    store.put("z" * 50)
+    assert len(store) == 1 and store.entries()[0]["size"] == 50
+
+
+def test_entries_record_where_they_came_from():
+    store = ResultStore()
+    entry = store.put({"a": 1}, block="Web Search", label="results")
+    assert (entry["block"], entry["label"], entry["size"]) == ("Web Search", "results", len('{"a": 1}'))
+    store.clear()
+    assert store.entries() == []
@@ -0,0 +1,112 @@
+import pytest
+from barfi import Block
+
+from flow_engine import run_flow
+from flow_sinks import ResultSink, get_sink
+from payload import TEXT, text_payload
+from run_store import RunStore, replay_plan, schema_hash
+
+calls = []
+
+
+def echo_compute(self):
+    calls.append(self._name)
+    self.set_interface(name="output_0", value=text_payload(get_sink().get_value("init_input", "")))
+
+
+def shout_compute(self):
+    calls.append(self._name)
+    self.set_interface(name="output_0", value=text_payload(self.get_interface(name="input_0").text.upper()))
+
+
+def _blocks():
+    echo = Block(name="Echo")
+    echo.add_output(name="output_0")
+    echo.add_compute(echo_compute)
+    shout = Block(name="Shout")
+    shout.add_input(name="input_0")
+    shout.add_output(name="output_0")
+    shout.add_compute(shout_compute)
+    return [echo, shout]
+
+
+def _schema(x=0):
+    return {
+        "nodes": [
+            {"id": "e", "name": "echo", "type": "Echo", "options": [], "position": {"x": x},
+             "interfaces": [["output_0", {"id": "e:output_0"}]]},
+            {"id": "s", "name": "shout", "type": "Shout", "options": [],
+             "interfaces": [["input_0", {"id": "s:input_0"}], ["output_0", {"id": "s:output_0"}]]},
+        ],
+        "connections": [{"from": "e:output_0", "to": "s:input_0"}],
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    calls.clear()
+    return RunStore(path=str(tmp_path / "runs.sqlite3"))
+
+
+def _run(store, owner="ada", replay=None, replay_of=None):
+    inputs = {"init_input": "hi", "usage_session": "s1"}
+    report = run_flow(_blocks(), _schema(), sink=ResultSink(values=dict(inputs)), replay=replay)
+    return store.record(report, _schema(), inputs, owner=owner, replay_of=replay_of)
+
+
+def test_schema_hash_ignores_positions():
+    assert schema_hash(_schema(0)) == schema_hash(_schema(100))
+
+
+def test_runs_keep_their_blocks_and_outputs(store):
+    run = store.get(_run(store))
+    assert (run["owner"], run["label"], run["status"]) == ("ada", "hi", "ok")
+    # Attribution values are not stored.
+    assert run["inputs"] == {"init_input": "hi"}
+    shout = run["blocks"]["s"]
+    assert shout["status"] == "Computed" and shout["reused"] is None
+    output = shout["outputs"]["output_0"]
+    assert (output.kind, output.text) == (TEXT, "HI")
+
+
+def test_identical_outputs_are_stored_once(store):
+    _run(store)
+    _run(store)
+    assert store.stats() == {"runs": 2, "outputs": 2}
+
+
+def test_runs_are_listed_per_owner(store):
+    first = _run(store, owner="ada")
+    _run(store, owner="bob")
+    assert [run["id"] for run in store.runs("ada")] == [first]
+    assert store.get("missing") is None
+
+
+def test_a_recorded_run_replays_without_recomputing(store):
+    run_id = _run(store)
+    calls.clear()
+    replayed = _run(store, replay=replay_plan(store.get(run_id)), replay_of=run_id)
+    assert calls == []
+    run = store.get(replayed)
+    assert run["replay_of"] == run_id
+    assert {block["reused"] for block in run["blocks"].values()} == {"replay"}
+    assert run["blocks"]["s"]["outputs"]["output_0"].text == "HI"
+
+
+def test_changed_blocks_run_again(store):
+    run = store.get(_run(store))
+    assert set(replay_plan(run, changed=["echo"])) == {"s"}
+    calls.clear()
+    replayed = store.get(_run(store, replay=replay_plan(run, changed=["echo"])))
+    # Echo gave the same output again, so Shout's recorded output still applies.
+    assert calls == ["echo"]
+    assert replayed["blocks"]["s"]["reused"] == "replay"
+
+
+def test_dependents_of_a_changed_output_run_again(store):
+    plan = replay_plan(store.get(_run(store)), changed=["echo"])
+    calls.clear()
+    inputs = {"init_input": "bye"}
+    report = run_flow(_blocks(), _schema(), sink=ResultSink(values=inputs), replay=plan)
+    assert calls == ["echo", "shout"]
+    assert report["results"]["shout"]["outputs"]["output_0"].text == "BYE"
@@ -0,0 +1,68 @@
+import pytest
+
+import search_tools
+from benchmarks.stub_search import StubSearchServer
+
+
+@pytest.fixture
+def search(monkeypatch):
+    """Points the search tools at a local stub, with empty caches and stats."""
+    server = StubSearchServer().start()
+    environ = server.environ()
+    monkeypatch.setattr(search_tools, "TAVILY_API_URL", environ["TAVILY_API_URL"])
+    monkeypatch.setattr(search_tools, "WIKIPEDIA_API_URL", environ["WIKIPEDIA_API_URL"])
+    monkeypatch.setattr(search_tools, "_tools", {})
+    monkeypatch.setattr(search_tools, "_stats", {})
+    search_tools.clear_search_cache()
+    yield server
+    search_tools.clear_search_cache()
+    server.stop()
+
+
+def test_wikipedia_search_uses_the_mediawiki_api(search):
+    assert search_tools.wikipedia_search("llamas") == \
+        "Page: llamas (topic)\nSummary: Summary of llamas (topic)."
+    # One search request plus one extract request per hit.
+    assert search.request_count == 2
+
+
+def test_wikipedia_search_leaves_the_wikipedia_package_alone(search):
+    wikipedia = pytest.importorskip("wikipedia")
+    api_url, get = wikipedia.API_URL, wikipedia.requests.get
+    search_tools.wikipedia_search("alpacas")
+    assert wikipedia.API_URL == api_url
+    assert wikipedia.requests.get is get
+
+
+def test_wikipedia_wrapper_honours_top_k_and_length_limits(search):
+    wrapper = search_tools.PooledWikipediaAPIWrapper(top_k_results=1, doc_content_chars_max=20)
+    assert wrapper.wiki_client is None
+    assert wrapper.run("vicuñas") == "Page: vicuñas (topic)"[:20]
+
+
+def test_repeated_queries_are_served_from_the_cache(search):
+    first = search_tools.web_search("bedrock", api_key="key")
+    requests = search.request_count
+    assert search_tools.web_search("bedrock", api_key="key") == first
+    assert search.request_count == requests
+    # max_results changes the answer, so it is cached separately.
+    assert len(search_tools.web_search("bedrock", api_key="key", max_results=3)) == 3
+    stats = search_tools.search_stats()["web"]
+    assert (stats["calls"], stats["hits"], stats["misses"]) == (3, 1, 2)
+
+
+def test_failed_searches_are_not_cached(search, monkeypatch):
+    monkeypatch.setattr(search_tools, "TAVILY_API_URL", f"{search.url}/missing")
+    assert isinstance(search_tools.web_search("bedrock", api_key="key"), str)
+    search_tools.web_search("bedrock", api_key="key")
+    assert search.request_count == 2
+    assert search_tools.search_stats()["web"]["hits"] == 0
+
+
+def test_pubmed_wrapper_fetches_every_article(search):
+    wrapper = search_tools.PooledPubMedAPIWrapper(
+        base_url_esearch=f"{search.url}/pubmed/esearch.fcgi?",
+        base_url_efetch=f"{search.url}/pubmed/efetch.fcgi?")
+    articles = list(wrapper.lazy_load("llamas"))
+    assert [article["Title"] for article in articles] == ["Article 101", "Article 102"]
+    assert search.request_count == 3
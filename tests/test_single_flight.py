@@ -0,0 +1,94 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import llm
+from single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    with ThreadPoolExecutor(8) as pool:
+        futures = [pool.submit(flights.do, "key", fetch) for _ in range(8)]
+        time.sleep(0.1)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["result"] * 8
+    assert sorted(shared for _, shared in results) == [False] + [True] * 7
+    assert flights.stats()["shared"] == 7
+
+
+def test_errors_reach_every_caller_and_are_not_kept():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(flights.do, "key", fail) for _ in range(4)]
+        time.sleep(0.1)
+        release.set()
+        for future in futures:
+            with pytest.raises(RuntimeError, match="boom"):
+                future.result()
+
+    assert flights.do("key", lambda: "fresh") == ("fresh", False)
+
+
+def test_different_keys_run_separately():
+    flights = SingleFlight()
+    assert flights.do("a", lambda: 1) == (1, False)
+    assert flights.do("b", lambda: 2) == (2, False)
+
+
+def test_late_stream_followers_see_every_chunk():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def chunks():
+        yield "a"
+        started.set()
+        release.wait(5)
+        yield "b"
+        yield "c"
+
+    leader, shared = flights.stream("key", chunks)
+    assert not shared
+    started.wait(5)
+    follower, shared = flights.stream("key", chunks)
+    assert shared
+    release.set()
+    assert list(leader) == ["a", "b", "c"]
+    assert list(follower) == ["a", "b", "c"]
+
+
+def test_identical_model_calls_share_one_request(bedrock):
+    bedrock.latency = 0.3
+    prompt = f"coalesce me {time.time()}"
+    with ThreadPoolExecutor(4) as pool:
+        replies = list(pool.map(lambda _: llm.call_llm(prompt, temperature=0), range(4)))
+    assert bedrock.request_count == 1
+    assert {reply.content for reply in replies} == {"alpha beta gamma"}
+    assert sum(bool(reply.response_metadata.get("coalesced")) for reply in replies) == 3
+
+
+def test_sampled_model_calls_are_not_shared(bedrock):
+    bedrock.latency = 0.1
+    with ThreadPoolExecutor(3) as pool:
+        list(pool.map(lambda _: llm.call_llm("sample me", temperature=0.7), range(3)))
+    assert bedrock.request_count == 3
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+import speculation
+from llm import DEFAULT_MODEL
+from speculation import Speculator
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _prompt(name):
+    # Unique per run, so no test is served by another's cached response.
+    return f"{name} {time.time()}"
+
+
+@pytest.fixture
+def speculator(bedrock):
+    return Speculator(debounce=0.05)
+
+
+def test_a_stable_prompt_is_sent_once_and_claimed(speculator, bedrock):
+    prompt = _prompt("stable")
+    speculator.observe("ada", prompt, DEFAULT_MODEL, 0.7)
+    speculator.observe("ada", prompt, DEFAULT_MODEL, 0.7)
+    _wait_for(lambda: speculator._owners["ada"].parked.get((prompt, DEFAULT_MODEL, 0.7)) == "ready")
+    assert speculator.claim("ada", prompt, DEFAULT_MODEL, 0.7)
+    assert not speculator.claim("ada", prompt, DEFAULT_MODEL, 0.7)
+    stats = speculator.stats()
+    assert (stats["launched"], stats["hits"], stats["claims"]) == (1, 1, 2)
+    assert stats["tokens"] > 0 and bedrock.request_count == 1
+
+
+def test_only_the_last_of_quick_edits_is_sent(speculator, bedrock):
+    for i in range(3):
+        speculator.observe("ada", _prompt(f"edit {i}"), DEFAULT_MODEL, 0.7)
+    _wait_for(lambda: speculator.stats()["launched"] == 1 and not speculator._owners["ada"].running)
+    time.sleep(0.1)
+    assert bedrock.request_count == 1
+
+
+def test_claims_and_cancels_drop_pending_prompts(speculator, bedrock):
+    speculator.observe("ada", _prompt("claimed"), DEFAULT_MODEL, 0.7)
+    assert not speculator.claim("ada", "something else", DEFAULT_MODEL, 0.7)
+    speculator.observe("bob", _prompt("cancelled"), DEFAULT_MODEL, 0.7)
+    speculator.cancel("bob")
+    time.sleep(0.2)
+    assert speculator.stats()["launched"] == 0 and bedrock.request_count == 0
+
+
+def test_calls_over_the_token_budget_are_skipped(bedrock):
+    speculator = Speculator(debounce=0.01, tokens_per_hour=1)
+    speculator.observe("ada", _prompt("expensive"), DEFAULT_MODEL, 0.7)
+    _wait_for(lambda: speculator.stats()["skipped_budget"] == 1)
+    assert bedrock.request_count == 0
+
+
+def test_idle_owners_are_forgotten(bedrock, monkeypatch):
+    speculator = Speculator(debounce=0.01, idle_ttl=0)
+    speculator.observe("ada", _prompt("idle"), DEFAULT_MODEL, 0.7)
+    speculator.cancel("ada")
+    assert speculator.stats()["owners"] == 0
+
+    bedrock.latency = 0.3
+    speculator.observe("bob", _prompt("in flight"), DEFAULT_MODEL, 0.7)
+    _wait_for(lambda: speculator._owners["bob"].running)
+    speculator.observe("eve", _prompt("other"), DEFAULT_MODEL, 0.7)
+    # Bob's call is still running, so his state is kept.
+    assert "bob" in speculator._owners
+    _wait_for(lambda: not speculator._owners["bob"].running)
+    speculator.claim("eve", "x", DEFAULT_MODEL, 0.7)
+    # ...and then his spend, until it leaves the hour.
+    assert "bob" in speculator._owners
+    monkeypatch.setattr(speculation, "_WINDOW", 0.0)
+    speculator.claim("eve", "x", DEFAULT_MODEL, 0.7)
+    assert set(speculator._owners) == {"eve"}
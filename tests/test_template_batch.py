@@ -0,0 +1,80 @@
+import json
+import os
+
+import pytest
+
+from template_batch import completed_jobs, parse_rows, results_path, run_template_batch
+
+HAIKU = "anthropic.claude-3-haiku-20240307-v1:0"
+ROWS = [{"id": "a", "topic": "llamas"}, {"id": "b", "topic": "alpacas"}, {"topic": "vicuñas"}]
+
+
+@pytest.fixture
+def output(tmp_path):
+    return str(tmp_path / "results.jsonl")
+
+
+def _run(output, template="Tell me about {topic}.", temperature=0.7):
+    return run_template_batch(template, ROWS, output, models=[HAIKU], temperature=temperature,
+                              concurrency=2)
+
+
+def _records(output):
+    with open(output, encoding="utf-8") as handle:
+        return [json.loads(line) for line in handle]
+
+
+def test_rows_come_from_csv_or_jsonl():
+    assert parse_rows("id,topic\na,llamas\n", "csv") == [{"id": "a", "topic": "llamas"}]
+    assert parse_rows('{"topic": "llamas"}\n\n{"topic": "alpacas"}\n', "jsonl") == \
+        [{"topic": "llamas"}, {"topic": "alpacas"}]
+    with pytest.raises(ValueError):
+        parse_rows("", "xlsx")
+
+
+def test_every_row_is_run_and_recorded(bedrock, output):
+    result = _run(output)
+    assert (result["total"], result["skipped"]) == (3, 0)
+    assert result["models"][HAIKU]["completed"] == 3
+    records = _records(output)
+    assert sorted(r["row_id"] for r in records) == ["2", "a", "b"]
+    assert {r["prompt"] for r in records} == {f"Tell me about {row['topic']}." for row in ROWS}
+
+
+def test_a_rerun_skips_completed_rows(bedrock, output):
+    _run(output)
+    requests = bedrock.request_count
+    result = _run(output)
+    assert (result["total"], result["skipped"]) == (0, 3)
+    assert bedrock.request_count == requests
+
+
+def test_an_interrupted_run_resumes_where_it_stopped(bedrock, output):
+    _run(output)
+    records = _records(output)
+    with open(output, "w", encoding="utf-8") as handle:
+        handle.write(json.dumps(records[0]) + "\n")
+        handle.write(json.dumps(dict(records[1], status="error")) + "\n")
+        handle.write(json.dumps(records[2])[:20])  # Cut off mid-write
+    result = _run(output)
+    assert (result["total"], result["skipped"]) == (2, 1)
+
+
+def test_an_edited_template_or_temperature_runs_again(bedrock, output):
+    _run(output)
+    assert _run(output, template="Summarize {topic}.")["total"] == 3
+    assert _run(output, temperature=0.2)["total"] == 3
+    assert len(completed_jobs(output)) == 9
+
+
+def test_rows_that_do_not_fit_the_template_are_errors(bedrock, output):
+    result = _run(output, template="Tell me about {animal}.")
+    assert result["models"][HAIKU]["errors"] == 3
+    assert bedrock.request_count == 0
+
+
+def test_results_stay_in_the_owners_directory(tmp_path):
+    path = results_path("../../etc/passwd", owner="../ada", directory=str(tmp_path))
+    assert path == os.path.join(str(tmp_path), "ada", "passwd.jsonl")
+    assert results_path("", directory=str(tmp_path)) == \
+        os.path.join(str(tmp_path), "shared", "batch_results.jsonl")
@@ -0,0 +1,60 @@
+import pytest
+
+from template_engine import TemplateError, compile_template
+
+
+class User(object):
+    name = "Ada"
+
+
+VALUES = {"name": "world", "user": User(), "items": ["first", "second"], "scores": {"a": 0.5},
+          "score": 3.14159, "width": 10, "text": "it's"}
+
+
+@pytest.mark.parametrize("source", [
+    "",
+    "plain text",
+    "Hello {name}!",
+    "{name}{name}",
+    "{{literal}} and {{{name}}}",
+    "{user.name} has {items[0]} and {items[1]}",
+    "{scores[a]:.0%}",
+    "{text!r} {text!s} {text!a}",
+    "{score:.2f}|{score:>{width}.1f}|{name:^{width}}",
+    "{name:*<8}",
+    "line one\nline \"two\" '''three''' {name}",
+])
+def test_render_matches_str_format(source):
+    assert compile_template(source).render(VALUES) == source.format(**VALUES)
+
+
+def test_keyword_values_override_the_mapping():
+    template = compile_template("{greeting}, {name}")
+    assert template.render({"greeting": "Hi", "name": "a"}, name="b") == "Hi, b"
+
+
+def test_variables_are_listed_in_order_of_first_use():
+    template = compile_template("{b} {a.x} {b} {c:{width}}")
+    assert template.variables == ["b", "a", "c", "width"]
+
+
+def test_missing_values_raise_key_error_like_str_format():
+    with pytest.raises(KeyError):
+        "{missing}".format(**VALUES)
+    with pytest.raises(KeyError):
+        compile_template("{missing}").render(VALUES)
+
+
+@pytest.mark.parametrize("source", ["{", "}", "{name", "{}", "{0}", "{name!x}"])
+def test_malformed_templates_are_rejected(source):
+    with pytest.raises(TemplateError):
+        compile_template(source)
+
+
+def test_template_text_is_never_executed():
+    source = '{name}"""+__import__("os").getcwd()+"""'
+    assert compile_template(source).render(VALUES) == source.format(**VALUES)
+
+
+def test_compiled_templates_are_cached_by_source():
+    assert compile_template("Hello {name}") is compile_template("Hello {name}")
@@ -0,0 +1,59 @@
+import pytest
+
+from template_store import TemplateStore
+
+
+def _template(prompt):
+    return {"prompt_template": prompt, "placeholder_json": "{}", "model_name": "m",
+            "temperature": 0.7, "cache": False}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TemplateStore(path=str(tmp_path / "templates.sqlite3"))
+    store.save("Summarize article", _template("Summarize {article} for {audience}."))
+    store.save("Translate", _template("Translate {text} into {language}."))
+    store.save("Classify sentiment", _template("Is this review positive? {review}"))
+    return store
+
+
+def _names(result):
+    matches, _ = result
+    return [name for name, _ in matches]
+
+
+def test_empty_query_lists_everything_by_name(store):
+    matches, total = store.search("")
+    assert total == 3
+    assert [name for name, _ in matches] == ["Classify sentiment", "Summarize article", "Translate"]
+
+
+def test_search_matches_name_text_and_variables(store):
+    assert _names(store.search("translate")) == ["Translate"]
+    assert _names(store.search("positive")) == ["Classify sentiment"]
+    assert _names(store.search("audience")) == ["Summarize article"]
+
+
+def test_every_word_must_match_as_a_prefix(store):
+    assert _names(store.search("summ art")) == ["Summarize article"]
+    assert _names(store.search("summ language")) == []
+
+
+def test_query_operators_are_searched_literally(store):
+    assert store.search('"unbalanced OR NOT') == ([], 0)
+    assert store.search("(*)") == ([], 0)
+
+
+def test_search_pages_through_matches(store):
+    matches, total = store.search("", limit=2, offset=2)
+    assert total == 3
+    assert [name for name, _ in matches] == ["Translate"]
+
+
+def test_search_sees_the_latest_version_only(store):
+    store.save("Translate", _template("Rewrite {text} in plain words."))
+    assert _names(store.search("language")) == []
+    assert _names(store.search("plain")) == ["Translate"]
+    store.delete("Translate")
+    assert _names(store.search("plain")) == []
+    assert store.search("")[1] == 2
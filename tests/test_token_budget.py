@@ -0,0 +1,93 @@
+import pytest
+
+import token_budget
+from model_catalog import estimate_cost
+from token_budget import (UsageLedger, estimate_tokens, fit_prompt, format_cost, prompt_budget,
+                          usage_scopes)
+
+SONNET = "anthropic.claude-3-sonnet-20240229-v1:0"
+TITAN = "amazon.titan-text-premier-v1:0"
+
+
+def test_estimates_depend_on_the_model_family():
+    assert estimate_tokens("", SONNET) == 0
+    assert estimate_tokens("a" * 35, SONNET) == 10
+    assert estimate_tokens("a" * 40, TITAN) == 10
+    assert estimate_tokens("a" * 36, "unknown.model") == 11
+
+
+def test_non_ascii_characters_count_as_a_token_each():
+    assert estimate_tokens("日本語", SONNET) == 3
+    assert estimate_tokens("café", SONNET) == 1 + 1
+
+
+def test_budget_comes_from_the_environment_or_the_catalog(monkeypatch):
+    monkeypatch.setattr(token_budget, "PROMPT_BUDGET", None)
+    assert prompt_budget(SONNET) == 200000 - 1024
+    assert prompt_budget("unknown.model") is None
+    monkeypatch.setattr(token_budget, "PROMPT_BUDGET", 500)
+    assert prompt_budget(SONNET) == 500
+
+
+def test_prompts_within_budget_are_sent_as_they_are():
+    prompt, info = fit_prompt("Summarize this.", SONNET, budget=100)
+    assert prompt == "Summarize this."
+    assert info == {"estimated_tokens": 5, "budget": 100, "truncated": False}
+
+
+def test_long_prompts_lose_their_middle():
+    prompt = "INSTRUCTIONS " + "filler text " * 2000 + " QUESTION?"
+    fitted, info = fit_prompt(prompt, SONNET, budget=200)
+    assert info["truncated"]
+    assert info["estimated_tokens"] <= 200
+    assert fitted.startswith("INSTRUCTIONS ")
+    assert fitted.endswith(" QUESTION?")
+    assert "tokens truncated to fit the prompt budget" in fitted
+
+
+def test_mixed_script_prompts_also_fit():
+    fitted, info = fit_prompt("説明してください。" * 500, SONNET, budget=300)
+    assert info["truncated"] and info["estimated_tokens"] <= 300
+
+
+def test_ledger_adds_calls_up_per_scope():
+    ledger = UsageLedger()
+    scopes = usage_scopes(session="s1", user="ada")
+    assert scopes == [("session", "s1"), ("user", "ada")]
+    cost = ledger.record(scopes, SONNET, 1000, 500)
+    assert cost == pytest.approx(estimate_cost(SONNET, 1000, 500))
+    ledger.record(usage_scopes(session="s2"), SONNET, 100, 50)
+
+    assert ledger.totals(("session", "s1"))["input_tokens"] == 1000
+    assert ledger.totals(("user", "ada"))["models"][SONNET]["calls"] == 1
+    everything = ledger.totals()
+    assert (everything["calls"], everything["input_tokens"], everything["output_tokens"]) == (2, 1100, 550)
+
+
+def test_cached_calls_cost_nothing():
+    ledger = UsageLedger()
+    assert ledger.record([], SONNET, 1000, 500, cached=True) == 0.0
+    totals = ledger.totals()
+    assert (totals["calls"], totals["cached_calls"], totals["input_tokens"], totals["cost"]) == (1, 1, 0, 0.0)
+
+
+def test_unpriced_models_and_missing_counts_are_zero():
+    ledger = UsageLedger()
+    assert ledger.record([], "unknown.model", None, None) == 0.0
+    assert ledger.totals()["calls"] == 1
+
+
+def test_ledger_scopes_can_be_reset():
+    ledger = UsageLedger()
+    ledger.record([("session", "s1")], SONNET, 10, 10)
+    ledger.reset(("session", "s1"))
+    assert ledger.totals(("session", "s1"))["calls"] == 0
+    assert ledger.totals()["calls"] == 1
+    ledger.reset()
+    assert ledger.totals()["calls"] == 0
+
+
+def test_small_costs_stay_visible():
+    assert format_cost(0) == "$0.0000"
+    assert format_cost(0.00001) == "< $0.0001"
+    assert format_cost(1.5) == "$1.5000"
@@ -0,0 +1,105 @@
+import json
+import threading
+
+import pytest
+
+from tracing import (clear_spans, current_context, end_span, get_spans, span, start_span, to_chrome_trace,
+                     to_otel_json, use_context)
+
+
+@pytest.fixture(autouse=True)
+def spans():
+    clear_spans()
+    yield
+    clear_spans()
+
+
+def _by_name(trace_id=None):
+    return {s["name"]: s for s in get_spans(trace_id)}
+
+
+def test_spans_nest_on_a_thread():
+    with span("flow", "flow") as flow:
+        with span("block", "block", type="Init Block"):
+            pass
+    spans = _by_name(flow["trace_id"])
+    assert spans["block"]["parent_id"] == flow["span_id"]
+    assert spans["block"]["trace_id"] == flow["trace_id"]
+    assert spans["flow"]["parent_id"] is None
+    assert spans["flow"]["start_ns"] <= spans["block"]["start_ns"] <= spans["block"]["end_ns"] \
+        <= spans["flow"]["end_ns"]
+    assert current_context() is None
+
+
+def test_context_crosses_to_worker_threads():
+    with span("flow", "flow") as flow:
+        context = current_context()
+
+        def work():
+            with use_context(context), span("search", "search"):
+                pass
+
+        thread = threading.Thread(target=work, name="worker")
+        thread.start()
+        thread.join()
+    search = _by_name(flow["trace_id"])["search"]
+    assert search["parent_id"] == flow["span_id"]
+    assert search["thread_name"] == "worker"
+
+
+def test_detached_spans_do_not_adopt_children():
+    with span("flow") as flow:
+        routing = start_span("routing", detached=True)
+        with span("block"):
+            pass
+        end_span(routing)
+    spans = _by_name(flow["trace_id"])
+    assert spans["block"]["parent_id"] == flow["span_id"]
+    assert spans["routing"]["parent_id"] == flow["span_id"]
+
+
+def test_errors_are_recorded_and_raised():
+    with pytest.raises(RuntimeError):
+        with span("block") as record:
+            raise RuntimeError("boom")
+    assert record["error"] == "RuntimeError('boom')"
+    assert record in get_spans(record["trace_id"])
+
+
+def test_chrome_trace_has_one_event_per_span_and_thread_names():
+    with span("flow", "flow", blocks=2) as flow:
+        with span("block", "block"):
+            pass
+    trace = json.loads(json.dumps(to_chrome_trace(get_spans(flow["trace_id"]))))
+    events = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+    assert sorted(e["name"] for e in events) == ["block", "flow"]
+    flow_event = next(e for e in events if e["name"] == "flow")
+    assert flow_event["cat"] == "flow" and flow_event["args"]["blocks"] == 2
+    assert flow_event["dur"] >= 0
+    names = [e for e in trace["traceEvents"] if e["ph"] == "M"]
+    assert names == [{"name": "thread_name", "ph": "M", "pid": flow_event["pid"],
+                      "tid": flow_event["tid"], "args": {"name": threading.current_thread().name}}]
+
+
+def test_otel_export_keeps_ids_attributes_and_status():
+    with pytest.raises(ValueError):
+        with span("flow", "flow") as flow:
+            with span("llm", "llm", model="m", tokens=12, cached=False, cost=0.5, region=None):
+                pass
+            raise ValueError("bad")
+    export = json.loads(json.dumps(to_otel_json(get_spans(flow["trace_id"]))))
+    resource = export["resourceSpans"][0]
+    assert resource["resource"]["attributes"][0]["key"] == "service.name"
+    spans = {s["name"]: s for s in resource["scopeSpans"][0]["spans"]}
+    llm = spans["llm"]
+    assert llm["traceId"] == flow["trace_id"] and llm["parentSpanId"] == flow["span_id"]
+    attributes = {a["key"]: a["value"] for a in llm["attributes"]}
+    assert attributes["model"] == {"stringValue": "m"}
+    assert attributes["tokens"] == {"intValue": "12"}
+    assert attributes["cached"] == {"boolValue": False}
+    assert attributes["cost"] == {"doubleValue": 0.5}
+    assert "region" not in attributes
+    assert llm["status"] == {"code": 1}
+    assert spans["flow"]["status"]["code"] == 2
+    assert "parentSpanId" not in spans["flow"]
+    assert int(llm["endTimeUnixNano"]) >= int(llm["startTimeUnixNano"])
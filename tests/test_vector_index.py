@@ -0,0 +1,104 @@
+import pytest
+
+import vector_index
+from blocks import _documents
+from payload import completion_payload, passages_payload, search_payload, text_payload
+from vector_index import VectorIndex, chunk_text, fetched_source, hashing_embed, upload_prefix
+
+
+@pytest.fixture
+def index(tmp_path):
+    return VectorIndex(path=str(tmp_path / "index"))
+
+
+def _texts(chunks):
+    return [chunk["text"] for chunk in chunks]
+
+
+def test_short_paragraphs_are_packed_and_long_ones_overlap():
+    assert chunk_text("one\n\ntwo", size=20) == ["one\n\ntwo"]
+    chunks = chunk_text("x" * 25, size=10, overlap=2)
+    assert chunks == ["x" * 10, "x" * 10, "x" * 9]
+
+
+def test_embeddings_are_unit_length():
+    vectors = hashing_embed(["llamas eat grass", ""])
+    assert vectors[0] @ vectors[0] == pytest.approx(1.0)
+    assert not vectors[1].any()
+
+
+def test_the_closest_chunk_comes_first(index):
+    ids = index.add(["Llamas live in the Andes.", "Python is a programming language."], source="notes")
+    assert len(ids) == 2
+    hits = index.search("where do llamas live", k=1)
+    assert _texts(hits) == ["Llamas live in the Andes."]
+    assert hits[0]["source"] == "notes" and not hits[0]["fetched"]
+
+
+def test_identical_text_is_stored_once(index):
+    first = index.add("Llamas hum.", source="a")
+    assert index.add("Llamas hum.", source="b") == first
+    assert len(index) == 1
+    assert index.sources() == [("a", 1), ("b", 1)]
+
+
+def test_uploads_are_found_by_every_owner_that_added_them(index):
+    # The same text uploaded by a second owner is stored once but found by both.
+    index.add("Shared secret recipe.", source=upload_prefix("ada") + "recipe.txt")
+    index.add("Shared secret recipe.", source=upload_prefix("bob") + "recipe.txt")
+    hits = index.search("recipe", source_prefix=upload_prefix("bob"))
+    assert [hit["source"] for hit in hits] == [upload_prefix("bob") + "recipe.txt"]
+    assert index.search("recipe", source_prefix=upload_prefix("eve")) == []
+
+
+def test_past_searches_only_include_fetched_chunks(index):
+    index.add("Llamas are camelids.", source=fetched_source("https://example.com/llamas"))
+    index.add("Llamas are my favourite animal, says the model.", source="model output")
+    index.add("My private notes about llamas.", source="text")
+    index.add("Uploaded llama facts.", source=upload_prefix("ada") + "facts.txt")
+    hits = index.search("llamas", k=10, fetched=True)
+    assert _texts(hits) == ["Llamas are camelids."]
+    assert hits[0]["source"] == "https://example.com/llamas" and hits[0]["fetched"]
+
+
+def test_ids_limit_the_search(index):
+    ids = index.add("Alpacas are smaller than llamas.", source="text")
+    index.add("Llamas carry packs.", source="text")
+    assert _texts(index.search("llamas", ids=ids)) == ["Alpacas are smaller than llamas."]
+
+
+def test_the_index_survives_reopening_and_growing(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_index, "INITIAL_CAPACITY", 2)
+    path = str(tmp_path / "index")
+    VectorIndex(path=path).add([f"document number {i}" for i in range(5)], source="docs")
+    reopened = VectorIndex(path=path)
+    assert len(reopened) == 5
+    assert reopened.search("document number 3", k=1)[0]["text"] == "document number 3"
+    with pytest.raises(ValueError, match="embeddings"):
+        VectorIndex(path=path, embeddings="amazon.titan-embed-text-v2:0")
+
+
+def test_clear_and_stats(index):
+    index.add("Llamas.", source="a")
+    stats = index.stats()
+    assert (stats["chunks"], stats["sources"]) == (1, 1) and stats["vector_bytes"] > 0
+    index.clear()
+    assert index.stats() == {"chunks": 0, "sources": 0, "vector_bytes": 0}
+    assert index.search("llamas") == []
+
+
+def test_only_search_results_are_indexed_as_fetched():
+    web = search_payload("web", "llamas", [{"url": "https://example.com", "content": "Llamas."}, "More."])
+    assert _documents(web) == [(fetched_source("https://example.com"), "Llamas."),
+                               (fetched_source("llamas"), "More.")]
+    assert _documents(completion_payload("q", "m", "An answer.")) == [("model output", "An answer.")]
+    assert _documents(text_payload("Some text.")) == [("text", "Some text.")]
+
+
+def test_passages_keep_where_they_came_from():
+    passages = passages_payload("llamas", [
+        {"id": 1, "source": "https://example.com", "text": "Llamas.", "score": 0.9, "fetched": True},
+        {"id": 2, "source": "model output", "text": "An answer.", "score": 0.5, "fetched": False},
+    ])
+    assert _documents(passages) == [(fetched_source("https://example.com"), "Llamas."),
+                                    ("model output", "An answer.")]
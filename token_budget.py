@@ -0,0 +1,204 @@
+"""
+Token estimates, prompt budgets and running usage totals.
+
+Bedrock only reports token counts after a request, so prompts are sized
+locally before sending: a per-family characters-per-token estimate that
+errs on the high side, checked against the model's prompt budget from the
+catalog (see model_catalog). Prompts over budget are cut down before the
+call rather than rejected after a full round trip.
+
+Reported usage is added up per scope, e.g. per session and per user, with
+costs from the catalog's per-1k-token prices.
+"""
+import logging
+import math
+import os
+import threading
+from collections import defaultdict
+
+from model_catalog import estimate_cost, get_model
+
+logger = logging.getLogger(__name__)
+
+# Average characters per token for English text, by model id prefix. Kept
+# slightly low so estimates overshoot rather than undershoot.
+CHARS_PER_TOKEN = {
+    "anthropic": 3.5,
+    "amazon": 4.0,
+    "meta": 3.8,
+    "mistral": 3.5,
+    "cohere": 3.8,
+    "ai21": 4.0,
+}
+DEFAULT_CHARS_PER_TOKEN = 3.5
+
+# Applies to every model when set; otherwise each model's catalog entry
+# decides (max_input_tokens, or context_window less max_tokens).
+PROMPT_BUDGET = int(os.environ.get("LLM_PROMPT_BUDGET", "0")) or None
+
+TRUNCATION_MARKER = "\n\n[... {tokens} tokens truncated to fit the prompt budget ...]\n\n"
+
+
+def _chars_per_token(model):
+    family = model.split(".", 1)[0]
+    return CHARS_PER_TOKEN.get(family, DEFAULT_CHARS_PER_TOKEN)
+
+
+def estimate_tokens(text, model):
+    """
+    Estimates how many tokens a model will count for some text.
+
+    Non-ASCII characters (accents, CJK, emoji) are counted as a token each,
+    since tokenizers rarely merge them the way they merge English words.
+
+    Args:
+        text (str): Prompt or completion text
+        model (str): Bedrock model id
+
+    Returns:
+        int: Estimated token count
+    """
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return math.ceil(ascii_chars / _chars_per_token(model)) + (len(text) - ascii_chars)
+
+
+def prompt_budget(model):
+    """
+    Returns the most prompt tokens a model should be sent, or None if
+    neither LLM_PROMPT_BUDGET nor the catalog sets a limit.
+    """
+    if PROMPT_BUDGET:
+        return PROMPT_BUDGET
+    spec = get_model(model)
+    if spec["max_input_tokens"]:
+        return spec["max_input_tokens"]
+    if spec["context_window"]:
+        # Leave room for the completion in the context window.
+        return spec["context_window"] - (spec["max_tokens"] or 0)
+    return None
+
+
+def fit_prompt(prompt, model, budget=None):
+    """
+    Pre-flight check: cuts a prompt down to the model's budget.
+
+    Over-budget prompts keep their beginning and end (instructions usually
+    open or close a prompt; pasted search results sit in between) and lose
+    the middle, which is replaced with a marker.
+
+    Args:
+        prompt (str): The prompt to send
+        model (str): Bedrock model id
+        budget (int): Token budget, defaults to prompt_budget(model)
+
+    Returns:
+        tuple: (prompt to send, dict with estimated_tokens, budget and
+            truncated)
+    """
+    budget = budget or prompt_budget(model)
+    estimated = estimate_tokens(prompt, model)
+    info = {"estimated_tokens": estimated, "budget": budget, "truncated": False}
+    if budget is None or estimated <= budget:
+        return prompt, info
+
+    marker = TRUNCATION_MARKER.format(tokens=estimated - budget)
+    # Scale by the estimate's own ratio so mixed-script prompts shrink enough.
+    keep = max(0, int(len(prompt) * (budget - estimate_tokens(marker, model)) / estimated))
+    head = keep * 3 // 4
+    tail = keep - head
+    fitted = prompt[:head] + marker + (prompt[-tail:] if tail else "")
+    logger.warning(f"Prompt for {model} estimated at {estimated} tokens, over its budget of "
+                   f"{budget}; truncated to {len(fitted)} characters")
+    info.update(estimated_tokens=estimate_tokens(fitted, model), truncated=True)
+    return fitted, info
+
+
+def usage_scopes(session=None, user=None):
+    """Returns the ledger scopes for a call made in a session by a user."""
+    scopes = []
+    if session:
+        scopes.append(("session", session))
+    if user:
+        scopes.append(("user", user))
+    return scopes
+
+
+def _empty_totals():
+    return {"calls": 0, "cached_calls": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0,
+            "models": defaultdict(lambda: {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0})}
+
+
+class UsageLedger(object):
+    """
+    Running token and cost totals, kept per scope.
+
+    A scope is any hashable key, such as ("session", id) or ("user", name);
+    every call is also counted under the ("all", None) scope. Cached
+    responses count as calls but cost nothing.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = defaultdict(_empty_totals)
+
+    def record(self, scopes, model, input_tokens, output_tokens, cached=False):
+        """
+        Adds one model call to the totals of each scope.
+
+        Returns:
+            float: The call's cost in USD (0.0 if unpriced or cached)
+        """
+        input_tokens = 0 if cached else int(input_tokens or 0)
+        output_tokens = 0 if cached else int(output_tokens or 0)
+        cost = estimate_cost(model, input_tokens, output_tokens) or 0.0
+        with self._lock:
+            for scope in [("all", None)] + list(scopes):
+                totals = self._totals[scope]
+                totals["calls"] += 1
+                totals["cached_calls"] += int(cached)
+                totals["input_tokens"] += input_tokens
+                totals["output_tokens"] += output_tokens
+                totals["cost"] += cost
+                per_model = totals["models"][model]
+                per_model["calls"] += 1
+                per_model["input_tokens"] += input_tokens
+                per_model["output_tokens"] += output_tokens
+                per_model["cost"] += cost
+        return cost
+
+    def totals(self, scope=("all", None)):
+        """Returns a copy of one scope's totals, with per-model totals under "models"."""
+        with self._lock:
+            totals = self._totals.get(scope) or _empty_totals()
+            return dict(totals, models={m: dict(t) for m, t in totals["models"].items()})
+
+    def reset(self, scope=None):
+        """Clears one scope's totals, or every scope's."""
+        with self._lock:
+            if scope is None:
+                self._totals.clear()
+            else:
+                self._totals.pop(scope, None)
+
+
+_ledger = UsageLedger()
+
+
+def get_ledger():
+    """Returns the process-wide UsageLedger."""
+    return _ledger
+
+
+def format_cost(cost):
+    """Formats a USD amount; fractions of a hundredth of a cent stay visible."""
+    return f"${cost:.4f}" if cost >= 0.0001 or not cost else "< $0.0001"
+
+
+def format_usage(totals):
+    """Formats a scope's totals (see UsageLedger.totals) as one markdown line."""
+    cached = f" ({totals['cached_calls']} cached)" if totals["cached_calls"] else ""
+    return (f"**Calls:** {totals['calls']}{cached} · "
+            f"**Tokens:** {totals['input_tokens']:,} in / {totals['output_tokens']:,} out · "
+            f"**Cost:** {format_cost(totals['cost'])}")
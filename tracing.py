@@ -0,0 +1,217 @@
+"""
+Lightweight tracing: timed spans for flows, blocks, model calls and searches.
+
+Spans nest per thread (a model call inside a block becomes that block's
+child), and use_context carries a parent across to worker threads. Finished
+spans go to a bounded in-process buffer, from which a trace can be shown as
+a timeline or exported as Chrome trace JSON (chrome://tracing, Perfetto) or
+OpenTelemetry (OTLP/JSON).
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Finished spans kept in memory, oldest dropped first.
+BUFFER_SPANS = int(os.environ.get("TRACE_BUFFER_SPANS", "20000"))
+SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "prompt-engineer-workbench")
+
+# perf_counter is precise but has no epoch; anchor it once so span times
+# are wall-clock nanoseconds, as both export formats expect.
+_EPOCH_OFFSET_NS = time.time_ns() - time.perf_counter_ns()
+
+_spans = deque(maxlen=BUFFER_SPANS)
+_local = threading.local()
+
+
+def _now_ns():
+    return time.perf_counter_ns() + _EPOCH_OFFSET_NS
+
+
+def _new_id(bits):
+    return os.urandom(bits // 8).hex()
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def current_context():
+    """
+    Returns (trace id, span id) of the innermost open span on this thread,
+    or None outside any span.
+    """
+    stack = _stack()
+    if stack:
+        return stack[-1]["trace_id"], stack[-1]["span_id"]
+    return getattr(_local, "parent", None)
+
+
+@contextmanager
+def use_context(context):
+    """Makes spans opened on this thread children of `context` (see current_context)."""
+    previous = getattr(_local, "parent", None)
+    _local.parent = context
+    try:
+        yield
+    finally:
+        _local.parent = previous
+
+
+def start_span(name, category="app", parent=None, detached=False, **attributes):
+    """
+    Opens a span; close it with end_span. Prefer span().
+
+    Args:
+        parent (tuple): (trace id, span id) to nest under, instead of the
+            innermost open span on this thread
+        detached (bool): Keep the span off this thread's stack, so spans
+            opened meanwhile do not nest under it. For coroutines and
+            generators, which interleave on one thread.
+
+    Returns:
+        dict: The span record. Add to its "attributes" while it is open.
+    """
+    parent = parent or current_context()
+    record = {
+        "name": name,
+        "category": category,
+        "trace_id": parent[0] if parent else _new_id(128),
+        "span_id": _new_id(64),
+        "parent_id": parent[1] if parent else None,
+        "start_ns": _now_ns(),
+        "end_ns": None,
+        "thread_id": threading.get_ident(),
+        "thread_name": threading.current_thread().name,
+        "attributes": dict(attributes),
+        "error": None,
+    }
+    if not detached:
+        _stack().append(record)
+    return record
+
+
+def end_span(record, error=None):
+    """Closes a span and adds it to the buffer."""
+    record["end_ns"] = _now_ns()
+    if error is not None:
+        record["error"] = repr(error)
+    stack = _stack()
+    # Generators can close their spans out of order, so remove by identity.
+    for i in range(len(stack) - 1, -1, -1):
+        if stack[i] is record:
+            del stack[i]
+            break
+    _spans.append(record)
+
+
+@contextmanager
+def span(name, category="app", parent=None, detached=False, **attributes):
+    """
+    Times the enclosed code as a span.
+
+    Args:
+        name (str): What is being timed, e.g. the block or model name
+        category (str): "flow", "block", "llm", "search", ...
+        parent, detached: See start_span
+        **attributes: Details to attach, e.g. model id or token counts
+
+    Yields:
+        dict: The span record; callers may add to record["attributes"]
+    """
+    record = start_span(name, category, parent=parent, detached=detached, **attributes)
+    try:
+        yield record
+    except BaseException as e:
+        end_span(record, error=e)
+        raise
+    else:
+        end_span(record)
+
+
+def get_spans(trace_id=None):
+    """Returns finished spans in the buffer, optionally only one trace's."""
+    return [s for s in list(_spans) if trace_id is None or s["trace_id"] == trace_id]
+
+
+def clear_spans():
+    """Empties the span buffer."""
+    _spans.clear()
+
+
+def to_chrome_trace(spans):
+    """
+    Converts spans to the Chrome trace event format (one complete "X" event
+    per span, one track per thread).
+
+    Returns:
+        dict: JSON-serializable trace, loadable in chrome://tracing or Perfetto
+    """
+    pid = os.getpid()
+    events = []
+    threads = {}
+    for s in spans:
+        threads.setdefault(s["thread_id"], s["thread_name"])
+        args = dict(s["attributes"], span_id=s["span_id"], parent_id=s["parent_id"])
+        if s["error"]:
+            args["error"] = s["error"]
+        events.append({
+            "name": s["name"],
+            "cat": s["category"],
+            "ph": "X",
+            "ts": s["start_ns"] / 1000,
+            "dur": (s["end_ns"] - s["start_ns"]) / 1000,
+            "pid": pid,
+            "tid": s["thread_id"],
+            "args": args,
+        })
+    for tid, name in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def _otel_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otel_json(spans):
+    """
+    Converts spans to OpenTelemetry's OTLP/JSON trace format.
+
+    Returns:
+        dict: JSON-serializable ExportTraceServiceRequest
+    """
+    otel_spans = []
+    for s in spans:
+        attributes = dict(s["attributes"], category=s["category"], thread=s["thread_name"])
+        otel_span = {
+            "traceId": s["trace_id"],
+            "spanId": s["span_id"],
+            "name": s["name"],
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(s["start_ns"]),
+            "endTimeUnixNano": str(s["end_ns"]),
+            "attributes": [{"key": k, "value": _otel_value(v)}
+                           for k, v in attributes.items() if v is not None],
+            "status": {"code": 2, "message": s["error"]} if s["error"] else {"code": 1},
+        }
+        if s["parent_id"]:
+            otel_span["parentSpanId"] = s["parent_id"]
+        otel_spans.append(otel_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": otel_spans}],
+        }]
+    }
@@ -0,0 +1,416 @@
+"""
+Local vector index over search results and uploaded documents.
+
+Text is split into chunks, embedded, and stored once: chunk text and
+sources in SQLite, vectors in a memory-mapped NumPy array next to it. The
+Retrieval block adds whatever its tools fetched and passes only the
+chunks most similar to its query downstream, so model blocks see a short,
+ranked context instead of every tool output in full. Chunks stay indexed
+across runs and sessions, so corpora fetched earlier can be searched again
+without re-querying the tools. Only what tools fetched is shared that way;
+uploads are searched by their owner, and model output and text inputs only
+by the block they were passed to.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Like the response cache and template store, the index defaults to the
+# working directory the app was started from. It is a directory holding
+# index.sqlite3 and vectors.npy.
+INDEX_PATH = os.environ.get("RETRIEVAL_INDEX_PATH", "retrieval_index")
+
+# "hashing" embeds locally (no network, no cost) by hashing words and word
+# pairs into a fixed number of dimensions; anything else is taken as a
+# Bedrock embedding model id, e.g. "amazon.titan-embed-text-v2:0".
+EMBEDDINGS = os.environ.get("RETRIEVAL_EMBEDDINGS", "hashing")
+HASHING_DIM = int(os.environ.get("RETRIEVAL_HASHING_DIM", "1024"))
+
+# Chunk size and the overlap between consecutive chunks of a long passage,
+# in characters.
+CHUNK_CHARS = int(os.environ.get("RETRIEVAL_CHUNK_CHARS", "1000"))
+CHUNK_OVERLAP = int(os.environ.get("RETRIEVAL_CHUNK_OVERLAP", "150"))
+
+# Rows allocated in vectors.npy at a time; the file doubles when full.
+INITIAL_CAPACITY = 1024
+
+# Sources of uploaded documents start with this prefix and their owner.
+UPLOAD_PREFIX = "upload: "
+
+# Sources of documents fetched by search tools start with this prefix.
+FETCHED_PREFIX = "fetched: "
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    source TEXT,
+    text TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source);
+CREATE TABLE IF NOT EXISTS chunk_sources (
+    chunk_id INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    PRIMARY KEY (chunk_id, source)
+);
+CREATE INDEX IF NOT EXISTS chunk_sources_source ON chunk_sources (source);
+CREATE TABLE IF NOT EXISTS index_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+-- Indexes built before chunk_sources existed record each chunk's first source.
+INSERT OR IGNORE INTO chunk_sources (chunk_id, source)
+    SELECT id, COALESCE(source, '') FROM chunks WHERE NOT EXISTS (SELECT 1 FROM chunk_sources);
+"""
+
+
+def chunk_text(text, size=CHUNK_CHARS, overlap=CHUNK_OVERLAP):
+    """
+    Splits text into chunks of at most `size` characters.
+
+    Paragraphs are packed together while they fit; a paragraph longer than
+    `size` is cut into windows that overlap by `overlap` characters.
+
+    Returns:
+        list: Chunk strings, in order
+    """
+    overlap = min(overlap, size // 2)
+    step = size - overlap
+    chunks = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) > size:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.extend(paragraph[i:i + size] for i in range(0, len(paragraph) - overlap, step))
+        elif len(current) + len(paragraph) + 2 <= size:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+        else:
+            chunks.append(current)
+            current = paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def hashing_embed(texts, dim=HASHING_DIM):
+    """
+    Embeds texts locally by feature hashing words and word pairs.
+
+    Returns:
+        numpy.ndarray: (len(texts), dim) float32 rows of unit length (zero
+            rows for texts without words)
+    """
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = _WORD.findall(text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for feature in features:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vectors[row, h % dim] += 1.0 if h & 0x80000000 else -1.0
+    # Dampen frequent terms, then normalize so dot products are cosines.
+    np.copysign(np.log1p(np.abs(vectors)), vectors, out=vectors)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+_bedrock_embeddings = {}
+_bedrock_lock = threading.Lock()
+
+
+def _bedrock_embed(texts, model):
+    from langchain_aws import BedrockEmbeddings
+
+    with _bedrock_lock:
+        client = _bedrock_embeddings.get(model)
+        if client is None:
+            kwargs = {}
+            # Same switch as llm.py, for local development against a stub.
+            endpoint_url = os.environ.get("BEDROCK_ENDPOINT_URL")
+            if endpoint_url:
+                kwargs["endpoint_url"] = endpoint_url
+            client = _bedrock_embeddings[model] = BedrockEmbeddings(model_id=model, **kwargs)
+    vectors = np.asarray(client.embed_documents(list(texts)), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def embed(texts, embeddings=EMBEDDINGS):
+    """Embeds texts with the configured backend (see EMBEDDINGS) as unit-length rows."""
+    if embeddings == "hashing":
+        return hashing_embed(texts)
+    return _bedrock_embed(texts, embeddings)
+
+
+def upload_prefix(owner):
+    """The source prefix of documents uploaded by an owner (a username or session id)."""
+    return f"{UPLOAD_PREFIX}{owner}/"
+
+
+def fetched_source(source):
+    """The source a document fetched by a tool is indexed under, e.g. for a search result's URL."""
+    return source if source.startswith(FETCHED_PREFIX) else f"{FETCHED_PREFIX}{source}"
+
+
+def _chunk_key(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class VectorIndex(object):
+    """
+    Chunks and their embeddings, searched by cosine similarity.
+
+    Chunk i's vector is row i - 1 of a memory-mapped float32 array, so
+    searches read vectors straight from the page cache and adding chunks
+    only appends rows. Identical chunk text is stored and embedded once;
+    every source it was added under is recorded in chunk_sources (chunks
+    without a source under ''), so each owner's uploads are found by their
+    own prefix even when another owner uploaded the same text first. One
+    process writes an index at a time.
+    """
+
+    def __init__(self, path=INDEX_PATH, embeddings=EMBEDDINGS):
+        self.path = path
+        self.embeddings = embeddings
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(os.path.join(path, "index.sqlite3"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+        meta = dict(self._db.execute("SELECT key, value FROM index_meta"))
+        if meta.get("embeddings", embeddings) != embeddings:
+            raise ValueError(
+                f"The index at {path} was built with {meta['embeddings']} embeddings, not {embeddings}")
+        self.dim = int(meta["dim"]) if "dim" in meta else None
+        if embeddings == "hashing" and self.dim not in (None, HASHING_DIM):
+            raise ValueError(f"The index at {path} has {self.dim} dimensions, not {HASHING_DIM}")
+        self._count = self._db.execute("SELECT COALESCE(MAX(id), 0) FROM chunks").fetchone()[0]
+        self._vectors = None
+        vectors_path = os.path.join(path, "vectors.npy")
+        if os.path.exists(vectors_path):
+            self._vectors = np.load(vectors_path, mmap_mode="r+")
+
+    def _reserve(self, rows):
+        """Makes room for `rows` more vectors, growing vectors.npy if needed."""
+        needed = self._count + rows
+        capacity = 0 if self._vectors is None else self._vectors.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(INITIAL_CAPACITY, capacity)
+        while new_capacity < needed:
+            new_capacity *= 2
+        vectors_path = os.path.join(self.path, "vectors.npy")
+        staging_path = vectors_path + ".tmp"
+        grown = np.lib.format.open_memmap(staging_path, mode="w+", dtype=np.float32,
+                                          shape=(new_capacity, self.dim))
+        if self._count:
+            grown[:self._count] = self._vectors[:self._count]
+        grown.flush()
+        del grown
+        self._vectors = None
+        os.replace(staging_path, vectors_path)
+        self._vectors = np.load(vectors_path, mmap_mode="r+")
+
+    def add(self, texts, source=None):
+        """
+        Chunks texts and indexes the chunks not seen before.
+
+        Args:
+            texts (str | list): Documents to add
+            source (str): Where they came from, e.g. a search query, URL or
+                file name
+
+        Returns:
+            list: Ids of the texts' chunks, whether new or already indexed
+        """
+        if isinstance(texts, str):
+            texts = [texts]
+        chunks = list(dict.fromkeys(chunk for text in texts for chunk in chunk_text(text)))
+        if not chunks:
+            return []
+        keys = [_chunk_key(chunk) for chunk in chunks]
+        with self._lock:
+            known = self._ids_for(keys)
+            new = [(key, chunk) for key, chunk in zip(keys, chunks) if key not in known]
+            if new:
+                with span("embed", "retrieval", chunks=len(new), embeddings=self.embeddings):
+                    vectors = embed([chunk for _, chunk in new], self.embeddings)
+                if self.dim is None:
+                    self.dim = vectors.shape[1]
+                    with self._db:
+                        self._db.executemany(
+                            "INSERT OR REPLACE INTO index_meta (key, value) VALUES (?, ?)",
+                            [("embeddings", self.embeddings), ("dim", str(self.dim))])
+                self._reserve(len(new))
+                self._vectors[self._count:self._count + len(new)] = vectors
+                self._vectors.flush()
+                now = time.time()
+                with self._db:
+                    self._db.executemany(
+                        "INSERT INTO chunks (id, key, source, text, created) VALUES (?, ?, ?, ?, ?)",
+                        [(self._count + i + 1, key, source, chunk, now) for i, (key, chunk) in enumerate(new)])
+                self._count += len(new)
+                known = self._ids_for(keys)
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO chunk_sources (chunk_id, source) VALUES (?, ?)",
+                    [(known[key], source or "") for key in dict.fromkeys(keys)])
+        return [known[key] for key in keys]
+
+    def _ids_for(self, keys):
+        ids = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = self._db.execute(
+                f"SELECT key, id FROM chunks WHERE key IN ({', '.join('?' * len(batch))})", batch)
+            ids.update(rows)
+        return ids
+
+    def search(self, query, k=4, ids=None, source_prefix=None, fetched=False):
+        """
+        Returns the k chunks most similar to the query.
+
+        Args:
+            query (str): What to look for
+            k (int): Number of chunks to return
+            ids (list): Consider these chunk ids (see add)
+            source_prefix (str): Also consider chunks whose source starts
+                with this, e.g. upload_prefix(owner)
+            fetched (bool): Also consider every chunk added under a
+                fetched_source, i.e. everything tools have fetched so far
+            With none of these, every chunk is considered.
+
+        Returns:
+            list: Dicts with id, source, text, score (cosine similarity) and
+                fetched (whether a tool fetched the chunk), best first. A
+                chunk added under several sources reports the one under
+                `source_prefix`, else the one it was fetched from, else one
+                that is not an upload. Fetched sources are reported without
+                FETCHED_PREFIX.
+        """
+        with self._lock, span("retrieve", "retrieval", k=k) as trace:
+            if not self._count or k < 1:
+                return []
+            if ids is None and source_prefix is None and not fetched:
+                candidates = None
+            else:
+                candidates = set(ids or ())
+                if source_prefix is not None:
+                    rows = self._db.execute(
+                        "SELECT chunk_id FROM chunk_sources WHERE substr(source, 1, ?) = ?",
+                        (len(source_prefix), source_prefix))
+                    candidates.update(row[0] for row in rows)
+                if fetched:
+                    rows = self._db.execute(
+                        "SELECT chunk_id FROM chunk_sources WHERE substr(source, 1, ?) = ?",
+                        (len(FETCHED_PREFIX), FETCHED_PREFIX))
+                    candidates.update(row[0] for row in rows)
+                if not candidates:
+                    return []
+                candidates = np.fromiter(sorted(candidates), dtype=np.int64)
+            q = embed([query], self.embeddings)[0]
+            if candidates is None:
+                scores = self._vectors[:self._count] @ q
+                row_ids = np.arange(1, self._count + 1)
+            else:
+                scores = self._vectors[candidates - 1] @ q
+                row_ids = candidates
+            trace["attributes"]["candidates"] = len(row_ids)
+            k = min(k, len(row_ids))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            hits = [(int(row_ids[i]), float(scores[i])) for i in top]
+            placeholders = ", ".join("?" * len(hits))
+            hit_ids = [chunk_id for chunk_id, _ in hits]
+            texts = dict(self._db.execute(f"SELECT id, text FROM chunks WHERE id IN ({placeholders})", hit_ids))
+            sources = {}
+            for chunk_id, source in self._db.execute(
+                    f"SELECT chunk_id, source FROM chunk_sources WHERE chunk_id IN ({placeholders}) "
+                    "ORDER BY source", hit_ids):
+                sources.setdefault(chunk_id, []).append(source)
+        results = []
+        for chunk_id, score in hits:
+            chunk_sources = sources.get(chunk_id, [])
+            results.append({"id": chunk_id, "source": self._reported_source(chunk_sources, source_prefix),
+                            "text": texts[chunk_id], "score": score,
+                            "fetched": any(source.startswith(FETCHED_PREFIX) for source in chunk_sources)})
+        return results
+
+    @staticmethod
+    def _reported_source(sources, source_prefix):
+        # Never names another owner's upload when the caller has a source of its own.
+        if source_prefix is not None:
+            for source in sources:
+                if source.startswith(source_prefix):
+                    return source
+        for source in sources:
+            if source.startswith(FETCHED_PREFIX):
+                return source[len(FETCHED_PREFIX):]
+        for source in sources:
+            if not source.startswith(UPLOAD_PREFIX):
+                return source or None
+        return sources[0] if sources else None
+
+    def sources(self, prefix=None):
+        """Returns (source, chunk count) pairs, optionally only for sources with a prefix."""
+        with self._lock:
+            query = "SELECT NULLIF(source, ''), COUNT(*) FROM chunk_sources"
+            params = ()
+            if prefix is not None:
+                query += " WHERE substr(source, 1, ?) = ?"
+                params = (len(prefix), prefix)
+            return self._db.execute(query + " GROUP BY source ORDER BY source", params).fetchall()
+
+    def stats(self):
+        """Returns the number of chunks and sources, and the size of the vector file in bytes."""
+        with self._lock:
+            sources = self._db.execute(
+                "SELECT COUNT(DISTINCT source) FROM chunk_sources WHERE source != ''").fetchone()[0]
+            size = 0 if self._vectors is None else self._vectors.nbytes
+            return {"chunks": self._count, "sources": sources, "vector_bytes": size}
+
+    def clear(self):
+        """Removes every chunk and vector."""
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM chunks")
+                self._db.execute("DELETE FROM chunk_sources")
+                self._db.execute("DELETE FROM index_meta")
+            self._vectors = None
+            vectors_path = os.path.join(self.path, "vectors.npy")
+            if os.path.exists(vectors_path):
+                os.remove(vectors_path)
+            self._count = 0
+            self.dim = None
+
+    def __len__(self):
+        return self._count
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Returns the process-wide VectorIndex (see INDEX_PATH and EMBEDDINGS)."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = VectorIndex()
+        return _index